@@ -0,0 +1,232 @@
+"""
+Асинхронный доступ к данным: запросы к хранилищу (storage.py) выполняются в отдельных потоках,
+чтобы ожидание диска, блокировки SQLite или сети не останавливало цикл событий бота
+"""
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from cache import LRUCache
+from storage import create_storage
+
+logger = logging.getLogger(__name__)
+
+# Хранилище выбирается в config.STORAGE_BACKEND
+storage = create_storage()
+
+# Чтение идет параллельно (WAL не блокирует читателей), запись - в одном потоке
+_readers = None
+_writer = None
+_closed = False  # после shutdown потоки не создаются заново до start
+
+def _executors():
+    global _readers, _writer
+    if _closed:
+        raise RuntimeError("доступ к базе данных остановлен (async_db.shutdown)")
+    if _readers is None:
+        _readers = ThreadPoolExecutor(max_workers=config.DB_READ_THREADS, thread_name_prefix='db-read')
+        _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write')
+    return _readers, _writer
+
+async def _run(executor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+async def read(func, *args, **kwargs):
+    """Выполняет функцию чтения из хранилища в пуле читателей"""
+    return await _run(_executors()[0], func, *args, **kwargs)
+
+async def write(func, *args, **kwargs):
+    """Выполняет функцию записи в хранилище в потоке писателя"""
+    return await _run(_executors()[1], func, *args, **kwargs)
+
+# Город пользователя по user_id; None тоже кэшируется - город еще не выбран.
+# Обновляется при записи через set_user_city, поэтому срока жизни у записей нет.
+profiles = LRUCache(config.PROFILE_CACHE_SIZE, max_bytes=config.PROFILE_CACHE_MAX_BYTES)
+# Кэш верен, только пока все записи идут через этот процесс. При нескольких процессах
+# webhook или общем хранилище (kv) город, измененный в другом процессе, не сбросит
+# запись здесь, поэтому тогда кэш не используется и город читается из хранилища
+profile_cache_enabled = config.WEBHOOK_PROCESSES <= 1 and not storage.shared
+_MISSING = object()
+_profile_writes = 0  # число записей: чтение, начатое до записи, не кладет в кэш старый город
+
+# Отложенная запись: user_id -> (user_id, city, username, first_name, city_id);
+# несколько изменений одного пользователя до записи схлопываются в одно
+_pending = {}
+_flushing = {}  # пачка, которая пишется сейчас
+_flush_write = None  # задача записи этой пачки
+_flush_task = None
+_flush_wakeup = None
+flushes = 0
+flushed_rows = 0
+
+def write_nowait(func, *args, **kwargs):
+    """Ставит запись в очередь писателя, не дожидаясь ее выполнения; после shutdown запись отбрасывается"""
+    if _closed:
+        logger.warning(f"⚠️ Запись {getattr(func, '__name__', func)} после остановки базы данных отброшена")
+        return None
+    return _executors()[1].submit(func, *args, **kwargs)
+
+async def get_user_city(user_id):
+    """Город пользователя из кэша, при промахе - из базы"""
+    if profile_cache_enabled:
+        city = profiles.get(user_id, _MISSING)
+        if city is not _MISSING:
+            return city
+    # запись могла еще не дойти до базы
+    row = _pending.get(user_id) or _flushing.get(user_id)
+    if row is not None:
+        return row[1]
+    writes = _profile_writes
+    city = await read(storage.get_user_city, user_id)
+    if profile_cache_enabled and writes == _profile_writes:
+        profiles.set(user_id, city)
+    return city
+
+async def set_user_city(user_id, city, username=None, first_name=None, city_id=None):
+    """Сохраняет город (и его id в справочнике городов) в базе и сразу обновляет кэш.
+
+    При PROFILE_WRITE_BEHIND запись только ставится в очередь и уходит в базу
+    пачкой вместе с другими (flush).
+    """
+    global _profile_writes
+    _profile_writes += 1
+    if config.PROFILE_WRITE_BEHIND:
+        _pending[user_id] = (user_id, city, username, first_name, city_id)
+        if profile_cache_enabled:
+            profiles.set(user_id, city)
+        _ensure_flusher()
+        if len(_pending) >= config.PROFILE_FLUSH_BATCH:
+            _flush_wakeup.set()
+        return
+    try:
+        await write(storage.set_user_city, user_id, city, username, first_name, city_id)
+    except Exception:
+        profiles.pop(user_id)
+        raise
+    if profile_cache_enabled:
+        profiles.set(user_id, city)
+
+def _ensure_flusher():
+    global _flush_task, _flush_wakeup
+    if _flush_task is None or _flush_task.done():
+        _flush_wakeup = asyncio.Event()
+        _flush_task = asyncio.ensure_future(_flush_loop())
+
+async def _flush_loop():
+    """Пишет накопленные изменения раз в PROFILE_FLUSH_INTERVAL или при заполнении пачки"""
+    while True:
+        try:
+            await asyncio.wait_for(_flush_wakeup.wait(), config.PROFILE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_wakeup.clear()
+        await flush()
+
+async def flush():
+    """Записывает очередь отложенных изменений одной транзакцией; возвращает число записей"""
+    global _pending, _flushing, _flush_write
+    # пачка отмененного flush может еще писаться: следующая идет только после нее
+    while _flush_write is not None:
+        await asyncio.shield(_flush_write)
+    if not _pending:
+        return 0
+    _flushing, _pending = _pending, {}
+    # отдельная задача под shield: отмена flush при остановке не отменяет начатую пачку,
+    # а _flushing и возврат в очередь при ошибке остаются за самой записью
+    _flush_write = asyncio.ensure_future(_write_batch(_flushing))
+    return await asyncio.shield(_flush_write)
+
+async def _write_batch(batch):
+    global _flushing, _flush_write, flushes, flushed_rows
+    try:
+        await write(storage.set_user_cities, list(batch.values()))
+    except Exception as e:
+        # возвращаем в очередь то, что не успели перезаписать более новыми изменениями
+        for user_id, row in batch.items():
+            _pending.setdefault(user_id, row)
+        logger.error(f"❌ Не удалось записать города пачкой, повторю позже: {e}")
+        return 0
+    finally:
+        _flushing = {}
+        _flush_write = None
+    flushes += 1
+    flushed_rows += len(batch)
+    return len(batch)
+
+def invalidate_profile(user_id=None):
+    """Сбрасывает кэш для пользователя или целиком (после изменений базы в обход async_db)"""
+    global _profile_writes
+    _profile_writes += 1
+    if user_id is None:
+        profiles.clear()
+    else:
+        profiles.pop(user_id)
+
+async def warm_up_profiles(limit=None):
+    """Загружает в кэш города последних активных пользователей"""
+    limit = config.PROFILE_CACHE_WARMUP if limit is None else limit
+    if limit <= 0 or not profile_cache_enabled:
+        return 0
+    writes = _profile_writes
+    rows = await read(storage.get_recent_user_cities, min(limit, profiles.max_size))
+    if writes != _profile_writes or not rows:
+        return 0
+    # самые активные последними: LRU вытеснит их в последнюю очередь
+    for user_id, city in reversed(rows):
+        profiles.set(user_id, city)
+    logger.info(f"👥 Кэш городов прогрет: {len(rows)} пользователей")
+    return len(rows)
+
+async def get_user_stats():
+    return await read(storage.get_user_stats)
+
+async def get_top_cities(limit=10):
+    return await read(storage.get_top_cities, limit)
+
+def stats():
+    """Статистика кэша городов и отложенной записи для health endpoint"""
+    return dict(
+        profiles.stats(),
+        enabled=profile_cache_enabled,
+        write_behind=config.PROFILE_WRITE_BEHIND,
+        pending_writes=len(_pending) + len(_flushing),
+        flushes=flushes,
+        flushed_rows=flushed_rows,
+    )
+
+async def close():
+    """Записывает отложенные изменения и останавливает потоки базы данных"""
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        await asyncio.gather(_flush_task, return_exceptions=True)
+        _flush_task = None
+    await flush()
+    if _pending:
+        logger.error(f"❌ При остановке не записано изменений городов: {len(_pending)}")
+    shutdown()
+
+def start():
+    """Снова разрешает доступ к базе после shutdown (перезапуск бота в том же процессе)"""
+    global _closed
+    _closed = False
+
+def shutdown():
+    """Дожидается очереди записей и закрывает потоки и соединения с базой.
+
+    Запросы после этого не открывают потоки заново: read/write выбрасывают RuntimeError,
+    write_nowait отбрасывает запись, пока не вызван start.
+    """
+    global _readers, _writer, _closed
+    _closed = True
+    if _readers is not None:
+        _writer.shutdown(wait=True)
+        _readers.shutdown(wait=True)
+        _readers = None
+        _writer = None
+    storage.close()
+    logger.info("🗄️ Потоки базы данных остановлены")
@@ -0,0 +1,178 @@
+"""
+Резервные копии базы данных: онлайн-копирование через backup API SQLite по расписанию
+"""
+
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+import config
+import database as db
+
+logger = logging.getLogger(__name__)
+
+BACKUP_PREFIX = 'users_backup_'
+
+class _TooManyRestarts(Exception):
+    pass
+
+def _copy(dest, pages, sleep, max_restarts):
+    """Пошаговое копирование; возвращает (число шагов, число перезапусков)"""
+    steps = 0
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal steps, restarts, last_remaining
+        steps += 1
+        # запись в базу с другого соединения начинает копирование заново
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+
+    db.get_connection().backup(dest, pages=pages, progress=progress, sleep=sleep)
+    return steps, restarts
+
+def create_backup(directory=None, compress=None, pages=None, sleep=None):
+    """Копирует базу в directory, не останавливая работу бота; возвращает сведения о копии.
+
+    Копирование идет шагами по pages страниц с паузой sleep между ними, поэтому
+    читатели и писатель не ждут окончания копии. Каждая запись в базу во время
+    копирования начинает его заново; если это случилось больше BACKUP_MAX_RESTARTS раз,
+    база копируется за один шаг (в режиме WAL это не блокирует запись).
+    Копия пишется во временный файл и переименовывается только целиком.
+    """
+    directory = config.BACKUP_DIR if directory is None else directory
+    compress = config.BACKUP_COMPRESS if compress is None else compress
+    pages = config.BACKUP_PAGES_PER_STEP if pages is None else pages
+    sleep = config.BACKUP_STEP_SLEEP if sleep is None else sleep
+
+    os.makedirs(directory, exist_ok=True)
+    name = f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+    path = os.path.join(directory, name)
+    tmp_path = path + '.tmp'
+
+    start = time.monotonic()
+    dest = sqlite3.connect(tmp_path)
+    try:
+        try:
+            steps, restarts = _copy(dest, pages, sleep, config.BACKUP_MAX_RESTARTS)
+        except _TooManyRestarts:
+            logger.info("💾 База часто меняется во время копирования, копирую за один шаг")
+            steps, restarts = _copy(dest, -1, 0, 0)
+            restarts = config.BACKUP_MAX_RESTARTS + 1
+    except BaseException:
+        dest.close()
+        os.remove(tmp_path)
+        raise
+    dest.close()
+    db_size = os.path.getsize(tmp_path)
+
+    if compress:
+        path += '.gz'
+        with open(tmp_path, 'rb') as src, gzip.open(path + '.tmp', 'wb', compresslevel=6) as out:
+            shutil.copyfileobj(src, out)
+        os.remove(tmp_path)
+        tmp_path = path + '.tmp'
+    os.replace(tmp_path, path)
+
+    return {
+        'path': path,
+        'db_bytes': db_size,
+        'file_bytes': os.path.getsize(path),
+        'steps': steps,
+        'restarts': restarts,
+        'duration': round(time.monotonic() - start, 3),
+    }
+
+def rotate_backups(directory=None, keep=None):
+    """Удаляет старые копии, оставляя keep последних; возвращает удаленные пути"""
+    directory = config.BACKUP_DIR if directory is None else directory
+    keep = config.BACKUP_KEEP if keep is None else keep
+    if not os.path.isdir(directory):
+        return []
+
+    # в имени метка времени, поэтому сортировка по имени - это сортировка по времени
+    backups = sorted(
+        name for name in os.listdir(directory)
+        if name.startswith(BACKUP_PREFIX) and not name.endswith('.tmp')
+    )
+    removed = []
+    for name in backups[:max(0, len(backups) - keep)]:
+        path = os.path.join(directory, name)
+        os.remove(path)
+        removed.append(path)
+    return removed
+
+class BackupService:
+    """Периодические резервные копии в фоне с ротацией и метриками"""
+
+    def __init__(self, interval=None, directory=None, keep=None, compress=None):
+        self.interval = config.BACKUP_INTERVAL if interval is None else interval
+        self.directory = config.BACKUP_DIR if directory is None else directory
+        self.keep = config.BACKUP_KEEP if keep is None else keep
+        self.compress = config.BACKUP_COMPRESS if compress is None else compress
+        self._task = None
+        self._lock = asyncio.Lock()
+        self.backups = 0
+        self.failures = 0
+        self.last = None
+        self.last_error = None
+
+    def start(self):
+        """Запускает копирование по расписанию (если BACKUP_INTERVAL > 0)"""
+        if self.interval <= 0 or self._task is not None:
+            return
+        if config.STORAGE_BACKEND != 'sqlite':
+            logger.info(f"💾 Резервные копии выключены: хранилище {config.STORAGE_BACKEND}, а не SQLite")
+            return
+        self._task = asyncio.ensure_future(self._loop())
+        logger.info(f"💾 Резервные копии каждые {self.interval} с в {self.directory}, храню {self.keep}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
+
+    async def run_once(self):
+        """Создает копию и удаляет лишние старые; возвращает сведения о копии или None"""
+        async with self._lock:
+            try:
+                # копирование идет в отдельном потоке, цикл событий продолжает работу
+                info = await asyncio.to_thread(create_backup, self.directory, self.compress)
+                removed = await asyncio.to_thread(rotate_backups, self.directory, self.keep)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = repr(e)
+                logger.error(f"❌ Ошибка при создании резервной копии: {e}")
+                return None
+
+        self.backups += 1
+        self.last = dict(info, finished_at=datetime.now().isoformat(timespec='seconds'))
+        logger.info(
+            f"💾 Резервная копия {info['path']}: {info['file_bytes'] / 1024:.0f} КБ "
+            f"за {info['duration']} с ({info['steps']} шагов), удалено старых: {len(removed)}"
+        )
+        return info
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'backups': self.backups,
+            'failures': self.failures,
+            'last': self.last,
+            'last_error': self.last_error,
+        }
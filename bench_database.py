@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест хранилища: задержки get_user_city / set_user_city
+при одновременных запросах из нескольких потоков.
+
+Запуск: python bench_database.py --threads 8 --ops 2000 --writes 0.1 [--backend memory]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+# storage читает config, а тот требует токены; для замера хранилища они не нужны
+os.environ.setdefault('BOT_TOKEN', '123456:bench')
+os.environ.setdefault('WEATHER_API_KEY', 'bench')
+
+import storage
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+def worker(store, ops, write_ratio, users, reads, writes, barrier):
+    rnd = random.Random()
+    barrier.wait()
+    for _ in range(ops):
+        user_id = rnd.randrange(users)
+        if rnd.random() < write_ratio:
+            start = time.perf_counter()
+            store.set_user_city(user_id, rnd.choice(['Москва', 'Казань', 'Омск', 'Тверь']), 'bench', 'Bench')
+            writes.append(time.perf_counter() - start)
+        else:
+            start = time.perf_counter()
+            store.get_user_city(user_id)
+            reads.append(time.perf_counter() - start)
+
+def report(name, latencies):
+    if not latencies:
+        return
+    ms = [x * 1000 for x in latencies]
+    print(f"{name:6} n={len(ms):6}  p50={percentile(ms, 50):7.3f} мс  p95={percentile(ms, 95):7.3f} мс  "
+          f"p99={percentile(ms, 99):7.3f} мс  max={max(ms):7.3f} мс")
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест хранилища')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=2000, help='операций на поток')
+    parser.add_argument('--writes', type=float, default=0.1, help='доля записей')
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--backend', default='sqlite', choices=sorted(storage.BACKENDS))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.backend == 'sqlite':
+            store = storage.SQLiteStorage(os.path.join(tmp, 'bench.db'))
+        else:
+            store = storage.create_storage(args.backend)
+        store.init()
+        store.set_user_cities([(user_id, 'Москва', None, None, None) for user_id in range(args.users)])
+
+        reads, writes = [], []
+        barrier = threading.Barrier(args.threads)
+        threads = [
+            threading.Thread(target=worker, args=(store, args.ops, args.writes, args.users, reads, writes, barrier))
+            for _ in range(args.threads)
+        ]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        print(f"Хранилище: {args.backend}, потоков: {args.threads}, операций: {args.threads * args.ops}, записей: {args.writes:.0%}")
+        print(f"Пропускная способность: {args.threads * args.ops / elapsed:.0f} оп/с")
+        report('чтение', reads)
+        report('запись', writes)
+
+        store.close()
+
+if __name__ == '__main__':
+    main()
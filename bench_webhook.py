@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест webhook: сколько обновлений в секунду принимает сервер
+с разным числом процессов-обработчиков (WEBHOOK_PROCESSES).
+
+Сервер запускается без Telegram и OpenWeatherMap: бенчмарк шлет /help от разных
+чатов, ответ уходит в теле ответа на webhook, и Bot API не вызывается.
+Состояния FSM хранятся на kv_server.py, который бенчмарк запускает сам.
+Нагрузку создают несколько клиентских процессов, чтобы упираться в сервер,
+а не в клиента; ускорение заметно, только если ядер хватает и серверу, и клиентам.
+
+Запуск: python bench_webhook.py --processes 1,2,4 --requests 20000 --clients 4 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def update(update_id):
+    chat = {"id": 1000000 + update_id, "type": "private"}
+    user = {"id": chat["id"], "is_bot": False, "first_name": "Bench"}
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "chat": chat, "from": user, "text": "/help",
+    }}
+
+async def _load(url, first_id, count, concurrency, start_at):
+    latencies, errors, replies = [], 0, 0
+    ids = iter(range(first_id, first_id + count))
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        async def sender():
+            nonlocal errors, replies
+            for update_id in ids:
+                started = time.perf_counter()
+                try:
+                    async with session.post(url, json=update(update_id)) as resp:
+                        body = await resp.read()
+                        if resp.status != 200:
+                            errors += 1
+                        elif b'sendMessage' in body:
+                            replies += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+        await asyncio.gather(*(sender() for _ in range(concurrency)))
+    return latencies, errors, replies
+
+def client(args):
+    """Клиентский процесс: count обновлений с concurrency одновременными запросами"""
+    return asyncio.run(_load(*args))
+
+def start_server(processes, port, workdir, kv_url):
+    env = dict(
+        os.environ,
+        BOT_TOKEN=os.environ.get('BOT_TOKEN') or '123456:bench',
+        WEATHER_API_KEY=os.environ.get('WEATHER_API_KEY') or 'bench',
+        PORT=str(port),
+        STORAGE_BACKEND='sqlite',
+        # состояния FSM читаются на каждое обновление, как в рабочей конфигурации
+        FSM_STORAGE='kv',
+        KV_URL=kv_url,
+        DB_PATH=os.path.join(workdir, 'bench.db'),
+        WEBHOOK_QUEUE_SIZE='100000',
+        # весь бюджет Telegram - на ответы в теле webhook
+        TELEGRAM_GLOBAL_RATE=str(10 ** 6),
+    )
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', str(processes)],
+        env=env, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return server, env
+
+def wait_ready(port, processes, timeout=60):
+    """Ждет, пока все processes обработчиков не начнут слушать порт"""
+    async def check():
+        deadline = time.monotonic() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                try:
+                    async with session.get(f'http://127.0.0.1:{port}/workers') as resp:
+                        workers = (await resp.json())['workers']
+                        if sum(w['state'] == 'serving' for w in workers) >= processes:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.5)
+        raise TimeoutError(f"сервер с {processes} процессами не запустился за {timeout} с")
+    asyncio.run(check())
+
+def run(processes, requests, clients, concurrency):
+    with tempfile.TemporaryDirectory() as workdir:
+        port, kv_port = free_port(), free_port()
+        kv = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kv_server.py'),
+             '--port', str(kv_port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        server, env = start_server(processes, port, workdir, f'http://127.0.0.1:{kv_port}')
+        try:
+            wait_ready(port, processes)
+            # путь webhook зависит от токена, как в config.py
+            url = f"http://127.0.0.1:{port}/webhook/{env['BOT_TOKEN'].split(':')[0]}"
+            share = requests // clients
+            start_at = time.time() + 1
+            jobs = [(url, i * share + 1, share, concurrency, start_at) for i in range(clients)]
+            with multiprocessing.get_context('spawn').Pool(clients) as pool:
+                results = pool.map(client, jobs)
+            duration = time.time() - start_at
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=60)
+            kv.terminate()
+            kv.wait(timeout=10)
+
+    latencies = [x for result in results for x in result[0]]
+    return {
+        'rps': len(latencies) / duration,
+        'p50': percentile(latencies, 50) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'errors': sum(result[1] for result in results),
+        'replies': sum(result[2] for result in results),
+        'total': len(latencies),
+    }
+
+def serve(processes):
+    """Сервер бенчмарка: процессы-обработчики без установки webhook в Telegram"""
+    import async_db
+    import webhook_workers
+
+    async_db.storage.init()
+    asyncio.run(webhook_workers.supervise(processes))
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест webhook в нескольких процессах')
+    parser.add_argument('--processes', default='1,2,4', help='числа процессов через запятую')
+    parser.add_argument('--requests', type=int, default=20000, help='обновлений на каждый запуск')
+    parser.add_argument('--clients', type=int, default=4, help='клиентских процессов')
+    parser.add_argument('--concurrency', type=int, default=64, help='одновременных запросов на клиента')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    print(f"Ядер: {os.cpu_count()}, обновлений: {args.requests}, "
+          f"клиентов: {args.clients} x {args.concurrency} одновременных запросов")
+    print(f"{'процессов':>9} {'обновлений/с':>13} {'ускорение':>10} {'p50, мс':>8} {'p99, мс':>8} {'ошибок':>7} {'ответов в теле':>15}")
+    base = None
+    for processes in [int(p) for p in args.processes.split(',') if p.strip()]:
+        result = run(processes, args.requests, args.clients, args.concurrency)
+        base = base or result['rps']
+        print(f"{processes:>9} {result['rps']:>13.0f} {result['rps'] / base:>9.2f}x "
+              f"{result['p50']:>8.1f} {result['p99']:>8.1f} {result['errors']:>7} "
+              f"{result['replies']:>7}/{result['total']}")
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,8 @@
 import asyncio
 import logging
-import aiohttp
 import sys
 import traceback
 import json
-from datetime import datetime, timezone, timedelta
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters.command import Command
 from aiogram.fsm.context import FSMContext
@@ -17,8 +15,16 @@ from aiogram.types import (
 
 # Импортируем модули
 import config
-import database as db
+import async_db
+from backup import BackupService
+from fsm_storage import create_fsm_storage
+from send_scheduler import SendScheduler
+from update_queue import reply_in_webhook
 import keyboards as kb
+from weather_client import WeatherClient
+from weather_service import WeatherService
+from weather_models import CurrentWeather, WeatherError, ERROR_NOT_FOUND, ERROR_AUTH
+from weather_render import render_current, render_current_at, render_forecast, render_map, render_error
 
 # Настройка логирования
 logging.basicConfig(
@@ -33,16 +39,44 @@ logger = logging.getLogger(__name__)
 
 # инициализация бота и диспетчера
 bot = Bot(token=config.BOT_TOKEN)
-dp = Dispatcher()
-
-# создание базы данных и таблицы при старте
-db.init_db()
+dp = Dispatcher(storage=create_fsm_storage())
+
+# все сообщения проходят через планировщик с лимитами Telegram
+send_scheduler = SendScheduler()
+bot.session.middleware(send_scheduler)
+
+# общий HTTP клиент OpenWeatherMap (пул соединений на весь процесс)
+weather_api = WeatherClient()
+# кэширующий слой поверх клиента
+weather_service = WeatherService(weather_api)
+# резервные копии базы по расписанию
+backup_service = BackupService()
+
+@dp.startup()
+async def on_startup():
+    async_db.start()
+    await weather_api.start()
+    await weather_service.geocodes.load()
+    await async_db.warm_up_profiles()
+    if config.WEBHOOK_WORKER_INDEX == 0:
+        # при нескольких процессах webhook копии делает только первый
+        backup_service.start()
+
+@dp.shutdown()
+async def on_shutdown():
+    await weather_service.close()
+    await weather_api.close()
+    await backup_service.stop()
+    await async_db.close()
+    await dp.storage.close()
 
 # установка города
 class SetCity(StatesGroup):
     waiting_for_city_name = State()
 
 # Обработчики команд с обработкой ошибок
+# Единственный ответ обработчики отправляют через send_reply: в режиме webhook он может
+# уйти в теле ответа на webhook, без отдельного запроса к Bot API
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
     try:
@@ -51,7 +85,7 @@ async def cmd_start(message: types.Message):
         logger.info(f"Пользователь {username} (ID: {user_id}) запустил бота")
         
         # Проверяем, есть ли у пользователя сохраненный город
-        user_city = db.get_user_city(user_id)
+        user_city = await async_db.get_user_city(user_id)
         first_name = message.from_user.first_name or "Друг"
         city_info = f"\n🏙️ Ваш город: {user_city}" if user_city else "\n💡 Установите город по умолчанию командой /setcity"
         
@@ -111,7 +145,8 @@ async def handle_location(message: types.Message):
 @dp.message(Command("help"))
 async def cmd_help(message: types.Message):
     try:
-        await message.answer(
+        await send_reply(
+            message,
             "📋 Доступные команды:\n\n"
             "🚀 /start - запустить бота\n"
             "🌤️ /weather - текущая погода\n"
@@ -137,10 +172,11 @@ async def cmd_help(message: types.Message):
 @dp.message(Command("stats"))
 async def cmd_stats(message: types.Message):
     try:
-        stats = db.get_user_stats()
-        user_city = db.get_user_city(message.from_user.id)
+        stats = await async_db.get_user_stats()
+        user_city = await async_db.get_user_city(message.from_user.id)
         
-        await message.answer(
+        await send_reply(
+            message,
             f"📊 Статистика бота:\n\n"
             f"👥 Всего пользователей: {stats['total_users']}\n"
             f"🏙️ Уникальных городов: {stats['unique_cities']}\n"
@@ -160,7 +196,8 @@ async def cmd_stats(message: types.Message):
 @dp.message(Command("about"))
 async def cmd_about(message: types.Message):
     try:
-        await message.answer(
+        await send_reply(
+            message,
             "🤖 О боте:\n\n"
             "🌤️ Weather Bot v2.1\n"
             "Надежный бот для получения прогноза погоды\n\n"
@@ -196,15 +233,15 @@ async def cmd_status(message: types.Message):
         
         # Проверяем базу данных
         try:
-            stats = db.get_user_stats()
+            stats = await async_db.get_user_stats()
             db_status = "✅ Работает"
         except:
             db_status = "❌ Ошибка"
         
         # Проверяем API погоды
         try:
-            weather_info = await get_weather("Moscow")
-            api_status = "✅ Работает" if "Москва" in weather_info or "Moscow" in weather_info else "⚠️ Частично"
+            weather = await weather_service.current("Moscow")
+            api_status = "✅ Работает" if isinstance(weather, CurrentWeather) else "⚠️ Частично"
         except:
             api_status = "❌ Ошибка"
         
@@ -229,7 +266,8 @@ async def cmd_status(message: types.Message):
 async def cmd_location(message: types.Message):
     """Команда для запроса местоположения"""
     try:
-        await message.answer(
+        await send_reply(
+            message,
             "📍 Отправьте ваше местоположение для получения погоды\n\n"
             "Нажмите кнопку ниже или используйте скрепку → Местоположение в Telegram",
             reply_markup=kb.get_location_request_keyboard()
@@ -242,7 +280,7 @@ async def cmd_location(message: types.Message):
 async def cmd_forecast(message: types.Message):
     """Команда для получения прогноза на неделю"""
     try:
-        city = db.get_user_city(message.from_user.id)
+        city = await async_db.get_user_city(message.from_user.id)
         if city:
             await message.answer("📅 Получаю прогноз на 5 дней...")
             forecast_info = await get_weather_forecast(city)
@@ -261,7 +299,7 @@ async def cmd_forecast(message: types.Message):
 async def cmd_map(message: types.Message):
     """Команда для получения карты погоды"""
     try:
-        city = db.get_user_city(message.from_user.id)
+        city = await async_db.get_user_city(message.from_user.id)
         if city:
             await message.answer("🗺️ Получаю карты погоды...")
             map_info = await get_weather_map(city)
@@ -302,23 +340,27 @@ async def city_chosen(message: types.Message, state: FSMContext):
             return
             
         # Проверяем, существует ли город, запросив погоду
-        weather_info = await get_weather(city_name)
-        if "не найден" in weather_info.lower() or "ошибка" in weather_info.lower():
-            await message.answer(f"{weather_info}\n\nПопробуйте ввести название города еще раз:")
+        weather = await weather_service.current(city_name, timeout=10)
+        if isinstance(weather, WeatherError):
+            await message.answer(f"{render_error(weather)}\n\nПопробуйте ввести название города еще раз:")
             return
+        weather_info = render_current(weather, city_name)
+        # сохраняем официальное название и id города, а не написание пользователя
+        city_name = weather.name or city_name
             
         try:
-            db.set_user_city(
+            await async_db.set_user_city(
                 message.from_user.id, 
                 city_name,
                 message.from_user.username,
-                message.from_user.first_name
+                message.from_user.first_name,
+                weather.city_id
             )
         except Exception as db_error:
             logger.error(f"Ошибка при сохранении города в БД: {db_error}")
             # Попробуем базовый вариант
             try:
-                db.set_user_city(message.from_user.id, city_name)
+                await async_db.set_user_city(message.from_user.id, city_name, city_id=weather.city_id)
             except Exception as db_error2:
                 logger.error(f"Критическая ошибка БД: {db_error2}")
                 await message.answer(f"⚠️ Город найден, но не удалось сохранить настройки.\n\n{weather_info}")
@@ -338,146 +380,34 @@ async def city_chosen(message: types.Message, state: FSMContext):
 async def get_weather(city: str):
     """Получает текущую погоду для города"""
     try:
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={config.WEATHER_API_KEY}&units=metric&lang=ru"
-        
-        timeout = aiohttp.ClientTimeout(total=10)  # таймаут 10 секунд
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    description = data['weather'][0]['description']
-                    temp = data['main']['temp']
-                    feels_like = data['main']['feels_like']
-                    wind_speed = data['wind']['speed']
-                    humidity = data['main']['humidity']
-                    pressure = data['main']['pressure']
-                    
-                    # Получаем информацию о часовом поясе города
-                    timezone_offset = data.get('timezone', 0)  # смещение в секундах от UTC
-                    logger.info(f"Часовой пояс для {city}: {timezone_offset} секунд от UTC")
-                    
-                    # Вычисляем местное время города
-                    utc_now = datetime.now(timezone.utc)
-                    local_time = utc_now + timedelta(seconds=timezone_offset)
-                    local_time_str = local_time.strftime('%H:%M:%S')
-                    local_date_str = local_time.strftime('%d.%m.%Y')
-                    
-                    # Получаем время восхода и заката (если доступно)
-                    sunrise_str = "—"
-                    sunset_str = "—"
-                    
-                    try:
-                        if 'sys' in data and 'sunrise' in data['sys'] and 'sunset' in data['sys']:
-                            sunrise_utc = datetime.fromtimestamp(data['sys']['sunrise'], tz=timezone.utc)
-                            sunset_utc = datetime.fromtimestamp(data['sys']['sunset'], tz=timezone.utc)
-                            
-                            sunrise_local = sunrise_utc + timedelta(seconds=timezone_offset)
-                            sunset_local = sunset_utc + timedelta(seconds=timezone_offset)
-                            
-                            sunrise_str = sunrise_local.strftime('%H:%M')
-                            sunset_str = sunset_local.strftime('%H:%M')
-                    except (KeyError, ValueError, OSError) as e:
-                        logger.warning(f"Ошибка при получении времени восхода/заката: {e}")
-                        # Используем значения по умолчанию
-                    
-                    # Определяем эмодзи для погоды
-                    weather_emoji = get_weather_emoji(data['weather'][0]['main'])
-                    
-                    return (
-                        f"{weather_emoji} Погода в городе {city.capitalize()}:\n\n"
-                        f"🌡️ Температура: {temp}°C\n"
-                        f"🤔 Ощущается как: {feels_like}°C\n"
-                        f"🌬️ Скорость ветра: {wind_speed} м/с\n"
-                        f"💧 Влажность: {humidity}%\n"
-                        f"📊 Давление: {pressure} гПа\n"
-                        f"📝 Описание: {description.capitalize()}\n\n"
-                        f"📅 Дата: {local_date_str}\n"
-                        f"🕐 Местное время: {local_time_str}\n"
-                        f"🌅 Восход: {sunrise_str}\n"
-                        f"🌇 Закат: {sunset_str}\n"
-                        f"🌍 Часовой пояс: UTC{timezone_offset//3600:+d}"
-                    )
-                elif response.status == 404:
-                    return "❌ Город не найден. Проверьте правильность написания названия города."
-                elif response.status == 401:
-                    logger.error("Неверный API ключ OpenWeatherMap")
-                    return "⚠️ Ошибка сервиса. Попробуйте позже."
-                else:
-                    logger.error(f"API вернул статус {response.status}")
-                    return "⚠️ Сервис временно недоступен. Попробуйте позже."
-                    
-    except asyncio.TimeoutError:
-        logger.error(f"Таймаут при запросе погоды для города {city}")
-        return "⏰ Превышено время ожидания. Попробуйте позже."
-    except aiohttp.ClientError as e:
-        logger.error(f"Ошибка сети при запросе погоды: {e}")
-        return "🌐 Проблемы с сетью. Попробуйте позже."
+        weather = await weather_service.current(city, timeout=10)  # таймаут 10 секунд
+        if isinstance(weather, WeatherError):
+            log_weather_error(weather, f"погоды города {city}")
+            return render_error(weather)
+        return render_current(weather, city)
     except Exception as e:
         logger.error(f"Неожиданная ошибка при получении погоды: {e}")
         return "❌ Произошла ошибка. Попробуйте позже."
 
-def get_weather_emoji(weather_main: str) -> str:
-    """Возвращает эмодзи в зависимости от типа погоды"""
-    weather_emojis = {
-        'Clear': '☀️',
-        'Clouds': '☁️',
-        'Rain': '🌧️',
-        'Drizzle': '🌦️',
-        'Thunderstorm': '⛈️',
-        'Snow': '❄️',
-        'Mist': '🌫️',
-        'Fog': '🌫️',
-        'Haze': '🌫️'
-    }
-    return weather_emojis.get(weather_main, '🌤️')
+def log_weather_error(error: WeatherError, what: str):
+    """Пишет в лог причину, по которой не удалось получить данные"""
+    if error.kind == ERROR_NOT_FOUND:
+        return
+    if error.kind == ERROR_AUTH:
+        logger.error("Неверный API ключ OpenWeatherMap")
+    elif error.status is not None:
+        logger.error(f"API вернул статус {error.status} при запросе {what}")
+    else:
+        logger.warning(f"Не удалось получить данные {what}: {error.kind}")
 
 async def get_weather_by_coordinates(lat: float, lon: float):
     """Получает текущую погоду по координатам"""
     try:
-        url = f"http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={config.WEATHER_API_KEY}&units=metric&lang=ru"
-        
-        timeout = aiohttp.ClientTimeout(total=10)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    city_name = data.get('name', 'Неизвестное место')
-                    country = data.get('sys', {}).get('country', '')
-                    location_name = f"{city_name}, {country}" if country else city_name
-                    
-                    description = data['weather'][0]['description']
-                    temp = data['main']['temp']
-                    feels_like = data['main']['feels_like']
-                    wind_speed = data['wind']['speed']
-                    humidity = data['main']['humidity']
-                    pressure = data['main']['pressure']
-                    
-                    # Получаем информацию о часовом поясе
-                    timezone_offset = data.get('timezone', 0)
-                    utc_now = datetime.now(timezone.utc)
-                    local_time = utc_now + timedelta(seconds=timezone_offset)
-                    local_time_str = local_time.strftime('%H:%M:%S')
-                    local_date_str = local_time.strftime('%d.%m.%Y')
-                    
-                    # Определяем эмодзи для погоды
-                    weather_emoji = get_weather_emoji(data['weather'][0]['main'])
-                    
-                    return (
-                        f"{weather_emoji} Погода в {location_name}:\n\n"
-                        f"🌡️ Температура: {temp}°C\n"
-                        f"🤔 Ощущается как: {feels_like}°C\n"
-                        f"🌬️ Скорость ветра: {wind_speed} м/с\n"
-                        f"💧 Влажность: {humidity}%\n"
-                        f"📊 Давление: {pressure} гПа\n"
-                        f"📝 Описание: {description.capitalize()}\n\n"
-                        f"📅 Дата: {local_date_str}\n"
-                        f"🕐 Местное время: {local_time_str}\n"
-                        f"📍 Координаты: {lat:.4f}, {lon:.4f}"
-                    )
-                else:
-                    logger.error(f"Weather API вернул статус {response.status} для координат {lat}, {lon}")
-                    return None
-                    
+        weather = await weather_service.current_by_coordinates(lat, lon, timeout=10)
+        if isinstance(weather, WeatherError):
+            log_weather_error(weather, f"погоды для координат {lat}, {lon}")
+            return None
+        return render_current_at(weather, lat, lon)
     except Exception as e:
         logger.error(f"Ошибка при получении погоды по координатам: {e}")
         return None
@@ -485,84 +415,11 @@ async def get_weather_by_coordinates(lat: float, lon: float):
 async def get_weather_forecast(city: str):
     """Получает прогноз погоды на 5 дней"""
     try:
-        url = f"http://api.openweathermap.org/data/2.5/forecast?q={city}&appid={config.WEATHER_API_KEY}&units=metric&lang=ru"
-        
-        timeout = aiohttp.ClientTimeout(total=15)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    
-                    # Получаем информацию о часовом поясе
-                    timezone_offset = data.get('city', {}).get('timezone', 0)
-                    city_name = data.get('city', {}).get('name', city)
-                    
-                    forecast_text = f"📅 Прогноз погоды на 5 дней для {city_name}:\n\n"
-                    
-                    # Группируем прогнозы по дням
-                    daily_forecasts = {}
-                    
-                    for item in data['list'][:40]:  # Берем первые 40 записей (5 дней по 8 записей)
-                        # Конвертируем время в местное
-                        utc_time = datetime.fromtimestamp(item['dt'], tz=timezone.utc)
-                        local_time = utc_time + timedelta(seconds=timezone_offset)
-                        date_key = local_time.strftime('%Y-%m-%d')
-                        day_name = local_time.strftime('%A')
-                        
-                        # Переводим дни недели на русский
-                        day_names_ru = {
-                            'Monday': 'Понедельник',
-                            'Tuesday': 'Вторник', 
-                            'Wednesday': 'Среда',
-                            'Thursday': 'Четверг',
-                            'Friday': 'Пятница',
-                            'Saturday': 'Суббота',
-                            'Sunday': 'Воскресенье'
-                        }
-                        day_name_ru = day_names_ru.get(day_name, day_name)
-                        
-                        if date_key not in daily_forecasts:
-                            daily_forecasts[date_key] = {
-                                'day_name': day_name_ru,
-                                'date': local_time.strftime('%d.%m'),
-                                'temps': [],
-                                'descriptions': [],
-                                'weather_main': []
-                            }
-                        
-                        daily_forecasts[date_key]['temps'].append(item['main']['temp'])
-                        daily_forecasts[date_key]['descriptions'].append(item['weather'][0]['description'])
-                        daily_forecasts[date_key]['weather_main'].append(item['weather'][0]['main'])
-                    
-                    # Формируем прогноз по дням
-                    for date_key in sorted(daily_forecasts.keys())[:5]:  # Только 5 дней
-                        day_data = daily_forecasts[date_key]
-                        
-                        min_temp = min(day_data['temps'])
-                        max_temp = max(day_data['temps'])
-                        
-                        # Выбираем наиболее частое описание погоды
-                        most_common_weather = max(set(day_data['weather_main']), key=day_data['weather_main'].count)
-                        weather_emoji = get_weather_emoji(most_common_weather)
-                        
-                        # Берем первое описание (обычно самое точное)
-                        description = day_data['descriptions'][0].capitalize()
-                        
-                        forecast_text += f"{weather_emoji} **{day_data['day_name']} ({day_data['date']})**\n"
-                        forecast_text += f"   🌡️ {min_temp:.0f}°...{max_temp:.0f}°C\n"
-                        forecast_text += f"   📝 {description}\n\n"
-                    
-                    return forecast_text
-                    
-                elif response.status == 404:
-                    return "❌ Город не найден для прогноза погоды."
-                else:
-                    logger.error(f"Forecast API вернул статус {response.status}")
-                    return "⚠️ Сервис прогноза временно недоступен."
-                    
-    except asyncio.TimeoutError:
-        logger.error(f"Таймаут при запросе прогноза для города {city}")
-        return "⏰ Превышено время ожидания прогноза."
+        forecast = await weather_service.forecast(city, timeout=15)
+        if isinstance(forecast, WeatherError):
+            log_weather_error(forecast, f"прогноза города {city}")
+            return render_error(forecast, forecast=True)
+        return render_forecast(forecast, city)
     except Exception as e:
         logger.error(f"Ошибка при получении прогноза: {e}")
         return "❌ Произошла ошибка при получении прогноза."
@@ -570,33 +427,11 @@ async def get_weather_forecast(city: str):
 async def get_weather_map(city: str):
     """Получает ссылку на карту осадков для города"""
     try:
-        # Сначала получаем координаты города
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={config.WEATHER_API_KEY}"
-        
-        timeout = aiohttp.ClientTimeout(total=10)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    lat = data['coord']['lat']
-                    lon = data['coord']['lon']
-                    city_name = data['name']
-                    
-                    # Создаем ссылки на карты
-                    precipitation_map = f"https://openweathermap.org/weathermap?basemap=map&cities=true&layer=precipitation&lat={lat}&lon={lon}&zoom=10"
-                    clouds_map = f"https://openweathermap.org/weathermap?basemap=map&cities=true&layer=clouds&lat={lat}&lon={lon}&zoom=10"
-                    temp_map = f"https://openweathermap.org/weathermap?basemap=map&cities=true&layer=temp&lat={lat}&lon={lon}&zoom=10"
-                    
-                    return (
-                        f"🗺️ Карты погоды для {city_name}:\n\n"
-                        f"🌧️ [Карта осадков]({precipitation_map})\n"
-                        f"☁️ [Карта облачности]({clouds_map})\n"
-                        f"🌡️ [Карта температуры]({temp_map})\n\n"
-                        f"📍 Координаты: {lat:.2f}, {lon:.2f}"
-                    )
-                else:
-                    return "❌ Не удалось получить координаты города для карты."
-                    
+        # Координаты города берутся из индекса, без запроса к API, если город уже известен
+        geocode = await weather_service.geocode(city, timeout=10)
+        if isinstance(geocode, WeatherError):
+            return "❌ Не удалось получить координаты города для карты."
+        return render_map(geocode)
     except Exception as e:
         logger.error(f"Ошибка при получении карты: {e}")
         return "❌ Произошла ошибка при получении карты погоды."
@@ -649,13 +484,18 @@ async def set_bot_commands():
 @dp.message(Command("weather"))
 async def cmd_weather(message: types.Message):
     try:
-        city = db.get_user_city(message.from_user.id)
+        city = await async_db.get_user_city(message.from_user.id)
         if city:
+            if weather_service.has_current(city):
+                # погода в кэше: ответ без "Получаю...", одним сообщением
+                await send_reply(message, await get_weather(city))
+                return
             await message.answer("🔄 Получаю актуальную погоду...")
             weather_info = await get_weather(city)
             await message.answer(weather_info)
         else:
-            await message.answer(
+            await send_reply(
+                message,
                 "🏙️ У вас не установлен город по умолчанию.\n\n"
                 "Используйте /setcity чтобы установить город, "
                 "или просто отправьте название любого города!"
@@ -668,7 +508,8 @@ async def cmd_weather(message: types.Message):
 @dp.message(F.text == "❌ Отмена")
 async def handle_cancel(message: types.Message):
     try:
-        await message.answer(
+        await send_reply(
+            message,
             "✅ Отменено\n\n"
             "Выберите другую функцию:",
             reply_markup=kb.get_inline_menu_keyboard()
@@ -681,14 +522,19 @@ async def text_weather_handler(message: types.Message):
     try:
         city_name = message.text.strip()
         if not city_name:
-            await message.answer("❌ Пожалуйста, введите название города.")
+            await send_reply(message, "❌ Пожалуйста, введите название города.")
             return
             
         # Игнорируем слишком длинные сообщения (вероятно, не названия городов)
         if len(city_name) > 50:
-            await message.answer("❌ Название города слишком длинное. Попробуйте еще раз.")
+            await send_reply(message, "❌ Название города слишком длинное. Попробуйте еще раз.")
             return
             
+        if weather_service.has_current(city_name):
+            logger.info(f"Пользователь {message.from_user.id} запросил погоду для города: {city_name}")
+            await send_reply(message, await get_weather(city_name))
+            return
+
         await message.answer("🔄 Получаю погоду...")
         weather_info = await get_weather(city_name)
         await message.answer(weather_info)
@@ -699,14 +545,22 @@ async def text_weather_handler(message: types.Message):
         logger.error(f"Ошибка при обработке текста: {e}")
         await safe_send_message(message, "❌ Произошла ошибка. Попробуйте позже.")
 
+async def send_reply(message: types.Message, text: str, **kwargs):
+    """Ответ на сообщение: в теле ответа на webhook, если он еще ждет, иначе обычным запросом.
+
+    Ошибка обычной отправки доходит до обработчика, как при await message.answer(...)
+    """
+    method = message.answer(text, **kwargs)
+    if not reply_in_webhook(method):
+        await method
+
 # Безопасная отправка сообщений
 async def safe_send_message(message: types.Message, text: str):
     try:
         await message.answer(text)
     except TelegramRetryAfter as e:
-        logger.warning(f"Rate limit, ждем {e.retry_after} секунд")
-        await asyncio.sleep(e.retry_after)
-        await message.answer(text)
+        # планировщик уже подождал и повторил отправку
+        logger.warning(f"Rate limit не снят и после повтора: {e.retry_after} секунд")
     except TelegramBadRequest as e:
         logger.error(f"Неверный запрос: {e}")
     except Exception as e:
@@ -717,7 +571,7 @@ async def safe_send_message(message: types.Message, text: str):
 async def callback_weather(callback: CallbackQuery):
     try:
         await callback.answer()
-        city = db.get_user_city(callback.from_user.id)
+        city = await async_db.get_user_city(callback.from_user.id)
         if city:
             await callback.message.answer("🔄 Получаю актуальную погоду...")
             weather_info = await get_weather(city)
@@ -744,8 +598,8 @@ async def callback_setcity(callback: CallbackQuery, state: FSMContext):
 async def callback_stats(callback: CallbackQuery):
     try:
         await callback.answer()
-        stats = db.get_user_stats()
-        user_city = db.get_user_city(callback.from_user.id)
+        stats = await async_db.get_user_stats()
+        user_city = await async_db.get_user_city(callback.from_user.id)
         
         await callback.message.answer(
             f"📊 Статистика бота:\n\n"
@@ -792,15 +646,15 @@ async def callback_status(callback: CallbackQuery):
         
         # Проверяем базу данных
         try:
-            stats = db.get_user_stats()
+            stats = await async_db.get_user_stats()
             db_status = "✅ Работает"
         except:
             db_status = "❌ Ошибка"
         
         # Проверяем API погоды
         try:
-            weather_info = await get_weather("Moscow")
-            api_status = "✅ Работает" if "Москва" in weather_info or "Moscow" in weather_info else "⚠️ Частично"
+            weather = await weather_service.current("Moscow")
+            api_status = "✅ Работает" if isinstance(weather, CurrentWeather) else "⚠️ Частично"
         except:
             api_status = "❌ Ошибка"
         
@@ -861,7 +715,7 @@ async def callback_city_weather(callback: CallbackQuery):
 async def callback_forecast(callback: CallbackQuery):
     try:
         await callback.answer()
-        city = db.get_user_city(callback.from_user.id)
+        city = await async_db.get_user_city(callback.from_user.id)
         if city:
             await callback.message.answer("📅 Получаю прогноз на 5 дней...")
             forecast_info = await get_weather_forecast(city)
@@ -879,7 +733,7 @@ async def callback_forecast(callback: CallbackQuery):
 async def callback_map(callback: CallbackQuery):
     try:
         await callback.answer()
-        city = db.get_user_city(callback.from_user.id)
+        city = await async_db.get_user_city(callback.from_user.id)
         if city:
             await callback.message.answer("🗺️ Получаю карты погоды...")
             map_info = await get_weather_map(city)
@@ -995,7 +849,7 @@ async def main():
             logger.info("🚀 Запуск бота...")
             
             # Инициализация базы данных
-            db.init_db()
+            async_db.storage.init()
             logger.info("✅ База данных инициализирована")
             
             # Проверка подключения к боту
@@ -1033,7 +887,11 @@ async def main():
 # Graceful shutdown
 async def shutdown():
     logger.info("🛑 Получен сигнал остановки...")
+    await weather_service.close()
+    await weather_api.close()
     await bot.session.close()
+    await backup_service.stop()
+    await async_db.close()
     logger.info("✅ Бот корректно остановлен")
 
 if __name__ == "__main__":
@@ -0,0 +1,199 @@
+"""
+Кэши в памяти процесса
+"""
+
+import asyncio
+import sys
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Кэш с временем жизни записей и вытеснением самых старых по использованию (LRU).
+
+    ttl - жесткий срок жизни: после него запись больше не отдается как актуальная.
+    soft_ttl - мягкий срок: запись старше него еще отдается, но ее пора обновить в фоне.
+    Устаревшие записи не удаляются сразу: они остаются запасным ответом (get_stale),
+    пока их не вытеснят более свежие.
+    """
+
+    def __init__(self, ttl: float, max_size: int, soft_ttl: float = None):
+        self.ttl = ttl
+        self.soft_ttl = ttl if soft_ttl is None else min(soft_ttl, ttl)
+        self.max_size = max_size
+        self._data = OrderedDict()  # ключ -> (значение, время записи)
+        self.hits = 0
+        self.soft_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def lookup(self, key):
+        """Возвращает (значение, нужно ли обновить) для записи моложе ttl, иначе None"""
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        age = time.monotonic() - item[1]
+        if age > self.ttl:
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        needs_refresh = age > self.soft_ttl
+        if needs_refresh:
+            self.soft_hits += 1
+        return item[0], needs_refresh
+
+    def get(self, key, default=None):
+        """Возвращает значение, если оно есть и не устарело"""
+        entry = self.lookup(key)
+        return default if entry is None else entry[0]
+
+    def get_stale(self, key):
+        """Возвращает (значение, возраст в секундах) независимо от TTL или None"""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        return item[0], time.monotonic() - item[1]
+
+    def set(self, key, value):
+        """Сохраняет значение и вытесняет самые давние записи при переполнении"""
+        self._data[key] = (value, time.monotonic())
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        """Счетчики попаданий и промахов"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'soft_ttl': self.soft_ttl,
+            'hits': self.hits,
+            'soft_hits': self.soft_hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 3) if total else 0.0,
+        }
+
+# Примерные накладные расходы OrderedDict на одну запись, байт
+_ENTRY_OVERHEAD = 100
+
+def approx_size(key, value) -> int:
+    """Примерный размер записи кэша в байтах"""
+    return sys.getsizeof(key) + sys.getsizeof(value) + _ENTRY_OVERHEAD
+
+class LRUCache:
+    """Кэш без срока жизни с вытеснением давно не использованных записей.
+
+    Ограничен и числом записей, и примерным объемом памяти (max_bytes).
+    """
+
+    def __init__(self, max_size: int, max_bytes: int = None, sizeof=approx_size):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data = OrderedDict()  # ключ -> (значение, размер)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key, value):
+        """Сохраняет значение и вытесняет самые давние записи при переполнении"""
+        self.pop(key)
+        size = self._sizeof(key, value)
+        self._data[key] = (value, size)
+        self.bytes += size
+        while self._data and (len(self._data) > self.max_size
+                              or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            _, (_, evicted) = self._data.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        if item is None:
+            return default
+        self.bytes -= item[1]
+        return item[0]
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / total, 3) if total else 0.0,
+        }
+
+class SingleFlight:
+    """Объединяет одновременные одинаковые запросы: все ждут один общий вызов"""
+
+    def __init__(self):
+        self._in_flight = {}  # ключ -> задача с общим вызовом
+        self.calls = 0
+        self.collapsed = 0
+
+    async def do(self, key, func):
+        """Выполняет func() один раз на ключ, остальные вызовы ждут тот же результат.
+
+        Исключение получают все ожидающие, результат нигде не сохраняется.
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.collapsed += 1
+
+        # shield: отмена одного ожидающего не отменяет запрос для остальных
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        self._in_flight.pop(key, None)
+        if not task.cancelled():
+            # помечаем исключение полученным, даже если все ожидающие отменились
+            task.exception()
+
+    def stats(self):
+        return {
+            'in_flight': len(self._in_flight),
+            'calls': self.calls,
+            'collapsed': self.collapsed,
+        }
@@ -0,0 +1,112 @@
+"""
+Circuit breaker для запросов к внешним API
+"""
+
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+class CircuitOpenError(Exception):
+    """Breaker разомкнут: запрос не отправляется, чтобы не ждать заведомо недоступный API"""
+
+class CircuitBreaker:
+    """Размыкается, когда доля ошибок в последних вызовах превышает порог.
+
+    В разомкнутом состоянии вызовы сразу получают CircuitOpenError. Через reset_timeout
+    breaker пропускает пробные запросы (half-open): успех замыкает его, ошибка снова размыкает.
+    before_call возвращает токен, который передается в record_*: пробным считается только
+    вызов с токеном текущего half-open, а не запрос, начатый еще до размыкания.
+    """
+
+    def __init__(self, name: str, failure_ratio: float, window: int, min_calls: int,
+                 reset_timeout: float, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = STATE_CLOSED
+        self._results = deque(maxlen=window)  # True - успех, False - ошибка
+        self._opened_at = 0.0
+        self._probes = set()  # токены пробных вызовов текущего half-open
+
+        self.short_circuited = 0
+        self.times_opened = 0
+
+    def before_call(self):
+        """Проверяет, можно ли выполнить вызов; иначе бросает CircuitOpenError.
+
+        Возвращает токен вызова для record_*: object() для пробного вызова, None для обычного.
+        """
+        if self.state == STATE_OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                self.short_circuited += 1
+                raise CircuitOpenError(f"{self.name}: breaker разомкнут")
+            self._set_state(STATE_HALF_OPEN)
+
+        if self.state == STATE_HALF_OPEN:
+            if len(self._probes) >= self.half_open_max_calls:
+                self.short_circuited += 1
+                raise CircuitOpenError(f"{self.name}: идет пробный запрос")
+            probe = object()
+            self._probes.add(probe)
+            return probe
+        return None
+
+    def _is_probe(self, token) -> bool:
+        return self.state == STATE_HALF_OPEN and token in self._probes
+
+    def record_skipped(self, token=None):
+        """Вызов так и не дошел до API (например, не хватило квоты) - пробный слот освобождается"""
+        if self._is_probe(token):
+            self._probes.discard(token)
+
+    def record_success(self, token=None):
+        if self.state == STATE_HALF_OPEN:
+            if not self._is_probe(token):
+                # вызов начат до размыкания: исход пробы решает только пробный запрос
+                return
+            self._results.clear()
+            self._set_state(STATE_CLOSED)
+        self._results.append(True)
+
+    def record_failure(self, token=None):
+        if self.state == STATE_HALF_OPEN:
+            if self._is_probe(token):
+                self._open()
+            return
+
+        self._results.append(False)
+        failures = self._results.count(False)
+        if (self.state == STATE_CLOSED and len(self._results) >= self.min_calls
+                and failures / len(self._results) >= self.failure_ratio):
+            self._open()
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self.times_opened += 1
+        self._set_state(STATE_OPEN)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"🔌 Circuit breaker {self.name}: {self.state} -> {state}")
+            self.state = state
+            # токены прошлых проб не действуют в следующем half-open
+            self._probes.clear()
+
+    def stats(self):
+        results = list(self._results)
+        return {
+            'state': self.state,
+            'failure_ratio': round(results.count(False) / len(results), 3) if results else 0.0,
+            'window_calls': len(results),
+            'times_opened': self.times_opened,
+            'short_circuited': self.short_circuited,
+        }
@@ -33,4 +33,95 @@ USE_WEBHOOK = os.getenv('USE_WEBHOOK', 'false').lower() == 'true'
 
 # Дополнительные настройки
 DEBUG = os.getenv('DEBUG', 'false').lower() == 'true'
-LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
\ No newline at end of file
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+# Настройки HTTP клиента OpenWeatherMap
+OWM_BASE_URL = os.getenv('OWM_BASE_URL', 'http://api.openweathermap.org')
+OWM_LIMIT_PER_HOST = int(os.getenv('OWM_LIMIT_PER_HOST', 20))
+OWM_DNS_CACHE_TTL = int(os.getenv('OWM_DNS_CACHE_TTL', 300))  # секунд
+OWM_KEEPALIVE_TIMEOUT = int(os.getenv('OWM_KEEPALIVE_TIMEOUT', 60))  # секунд
+
+# Кэш текущей погоды (данные OWM обновляются примерно раз в 10 минут).
+# После WEATHER_CACHE_TTL запись еще отдается, но обновляется в фоне,
+# после WEATHER_CACHE_HARD_TTL запрос ждет ответа API.
+WEATHER_CACHE_TTL = int(os.getenv('WEATHER_CACHE_TTL', 600))  # секунд
+WEATHER_CACHE_HARD_TTL = int(os.getenv('WEATHER_CACHE_HARD_TTL', 1200))  # секунд
+WEATHER_CACHE_SIZE = int(os.getenv('WEATHER_CACHE_SIZE', 1000))  # записей
+
+# Квота OpenWeatherMap (бесплатный тариф: 60 вызовов в минуту)
+OWM_CALLS_PER_MINUTE = int(os.getenv('OWM_CALLS_PER_MINUTE', 60))
+OWM_MAX_IN_FLIGHT = int(os.getenv('OWM_MAX_IN_FLIGHT', 10))  # одновременных запросов
+OWM_QUEUE_TIMEOUT = float(os.getenv('OWM_QUEUE_TIMEOUT', 5))  # секунд ожидания в очереди
+
+# Circuit breaker для OpenWeatherMap
+OWM_BREAKER_FAILURE_RATIO = float(os.getenv('OWM_BREAKER_FAILURE_RATIO', 0.5))  # доля ошибок для размыкания
+OWM_BREAKER_WINDOW = int(os.getenv('OWM_BREAKER_WINDOW', 20))  # последних вызовов в окне
+OWM_BREAKER_MIN_CALLS = int(os.getenv('OWM_BREAKER_MIN_CALLS', 5))
+OWM_BREAKER_RESET_TIMEOUT = float(os.getenv('OWM_BREAKER_RESET_TIMEOUT', 30))  # секунд до пробного запроса
+
+# Кэш прогноза (последний удачный прогноз также служит запасным ответом)
+FORECAST_CACHE_TTL = int(os.getenv('FORECAST_CACHE_TTL', 1800))  # секунд
+FORECAST_CACHE_HARD_TTL = int(os.getenv('FORECAST_CACHE_HARD_TTL', 3600))  # секунд
+
+# Квантование координат для кэша погоды по местоположению (точность geohash)
+GEO_CACHE_PRECISION = int(os.getenv('GEO_CACHE_PRECISION', 5))  # 5 символов ~ 4.9 x 4.9 км
+GEO_STATS_PRECISIONS = [int(p) for p in os.getenv('GEO_STATS_PRECISIONS', '4,5,6,7').split(',') if p.strip()]
+
+# Текущая погода из ближайшего слота прогноза: один запрос прогноза отвечает
+# и на /weather, и на /forecast, и на /map. По умолчанию выключено: слот прогноза
+# (шаг 3 часа) - это не измерение, он служит только запасным ответом, когда /weather недоступен
+WEATHER_CURRENT_FROM_FORECAST = os.getenv('WEATHER_CURRENT_FROM_FORECAST', 'false').lower() == 'true'
+WEATHER_SLOT_MAX_GAP = int(os.getenv('WEATHER_SLOT_MAX_GAP', 5400))  # секунд между слотом и текущим временем
+
+# SQLite: одно постоянное соединение на поток, журнал WAL
+# (DB_PATH, DB_CACHE_SIZE_KB, DB_BUSY_TIMEOUT_MS, DB_SYNCHRONOUS читает database.py)
+DB_READ_THREADS = int(os.getenv('DB_READ_THREADS', 4))  # потоков для чтения из async_db
+
+# Кэш городов пользователей в памяти (заполняется при чтении, обновляется при записи).
+# Только для одного процесса с хранилищем sqlite или memory: при WEBHOOK_PROCESSES > 1
+# и STORAGE_BACKEND=kv кэш не используется, см. async_db.profile_cache_enabled
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', 50000))  # пользователей
+PROFILE_CACHE_MAX_BYTES = int(os.getenv('PROFILE_CACHE_MAX_BYTES', 16 * 1024 * 1024))  # байт
+PROFILE_CACHE_WARMUP = int(os.getenv('PROFILE_CACHE_WARMUP', 10000))  # пользователей при старте, 0 - выключено
+
+# Отложенная запись городов: изменения копятся и пишутся пачкой раз в PROFILE_FLUSH_INTERVAL
+PROFILE_WRITE_BEHIND = os.getenv('PROFILE_WRITE_BEHIND', 'false').lower() == 'true'
+PROFILE_FLUSH_INTERVAL = float(os.getenv('PROFILE_FLUSH_INTERVAL', 1.0))  # секунд
+PROFILE_FLUSH_BATCH = int(os.getenv('PROFILE_FLUSH_BATCH', 500))  # записей, после которых пишем сразу
+
+# Резервные копии базы данных (онлайн через backup API SQLite)
+BACKUP_INTERVAL = int(os.getenv('BACKUP_INTERVAL', 0))  # секунд между копиями, 0 - выключено
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', 7))  # сколько последних копий хранить
+BACKUP_COMPRESS = os.getenv('BACKUP_COMPRESS', 'false').lower() == 'true'  # gzip
+BACKUP_PAGES_PER_STEP = int(os.getenv('BACKUP_PAGES_PER_STEP', 256))  # страниц за один шаг копирования
+BACKUP_STEP_SLEEP = float(os.getenv('BACKUP_STEP_SLEEP', 0.005))  # секунд паузы между шагами
+BACKUP_MAX_RESTARTS = int(os.getenv('BACKUP_MAX_RESTARTS', 3))  # перезапусков из-за записи до копирования за один шаг
+
+# Хранилище данных: sqlite (файл DB_PATH), memory (для тестов) или kv (сетевое, общее для нескольких экземпляров)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite').lower()
+KV_URL = os.getenv('KV_URL', 'http://127.0.0.1:8765')  # см. kv_server.py
+KV_TIMEOUT = float(os.getenv('KV_TIMEOUT', 5))  # секунд
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory').lower()  # состояния диалогов: memory или kv (общие для нескольких процессов)
+
+# Webhook: ответ Telegram сразу после приема обновления, обработка в фоне из ограниченной очереди
+WEBHOOK_ACK_FAST = os.getenv('WEBHOOK_ACK_FAST', 'true').lower() == 'true'
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))  # обновлений; при заполнении webhook отвечает 503
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 16))  # одновременно обрабатываемых чатов
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', 10))  # секунд на дообработку очереди при остановке
+WEBHOOK_LANE_STARVATION = float(os.getenv('WEBHOOK_LANE_STARVATION', 5))  # секунд ожидания, после которых обновление считается голодающим
+WEBHOOK_REPLY_DEADLINE = float(os.getenv('WEBHOOK_REPLY_DEADLINE', 0.3))  # секунд ожидания ответа обработчика для тела ответа на webhook; 0 - не ждать
+
+# Webhook в нескольких процессах: обновления чата пересылаются одному процессу, см. webhook_workers.py
+WEBHOOK_PROCESSES = int(os.getenv('WEBHOOK_PROCESSES', 1))  # 1 - один процесс, как раньше; при > 1 родительский процесс пересылает обновления процессам-обработчикам
+WEBHOOK_WORKER_MAX_REQUESTS = int(os.getenv('WEBHOOK_WORKER_MAX_REQUESTS', 0))  # запросов до плавной замены процесса, 0 - не заменять
+WEBHOOK_WORKER_MAX_REQUESTS_JITTER = int(os.getenv('WEBHOOK_WORKER_MAX_REQUESTS_JITTER', 0))  # случайная добавка, чтобы процессы не менялись одновременно
+WEBHOOK_WORKER_INDEX = int(os.getenv('WEBHOOK_WORKER_INDEX', 0))  # номер процесса; задает родительский процесс
+
+# Исходящие сообщения: планировщик с лимитами Telegram (сообщение ждет очереди вместо ответа 429)
+TELEGRAM_GLOBAL_RATE = int(os.getenv('TELEGRAM_GLOBAL_RATE', 30))  # сообщений в секунду на бота
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))  # сообщений в секунду в личный чат
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', 3))  # сообщений подряд в чат без ожидания
+TELEGRAM_GROUP_PER_MINUTE = int(os.getenv('TELEGRAM_GROUP_PER_MINUTE', 20))  # сообщений в минуту в группу
+TELEGRAM_MAX_IN_FLIGHT = int(os.getenv('TELEGRAM_MAX_IN_FLIGHT', 50))  # одновременных запросов к Bot API
+TELEGRAM_SEND_TIMEOUT = float(os.getenv('TELEGRAM_SEND_TIMEOUT', 30))  # секунд ожидания очереди
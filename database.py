@@ -1,182 +1,140 @@
 import sqlite3
 import logging
 import os
-from datetime import datetime
+import threading
+from pathlib import Path
+
+import migrations
 
 logger = logging.getLogger(__name__)
 
-DB_PATH = 'users.db'
+# Настройки читаются напрямую из окружения, а не из config: модуль используется
+# и без токенов бота (fix_database.py, проверка init_db в CI). Поэтому .env
+# загружаем здесь же: модуль может быть импортирован раньше config
+try:
+    from dotenv import load_dotenv
+    load_dotenv(Path('.') / '.env')
+except ImportError:
+    # dotenv не установлен, используем только системные переменные
+    pass
 
-def init_db():
-    """Инициализация базы данных с улучшенной структурой"""
-    try:
-        conn = sqlite3.connect(DB_PATH, timeout=10.0)
-        cur = conn.cursor()
-        
-        # Проверяем существующую структуру таблицы
-        cur.execute("PRAGMA table_info(users)")
-        columns = [column[1] for column in cur.fetchall()]
-        
-        if not columns:
-            # Таблица не существует, создаем новую
-            logger.info("📝 Создаю новую таблицу users...")
-            cur.execute('''
-            CREATE TABLE users (
-                user_id INTEGER PRIMARY KEY,
-                city TEXT,
-                username TEXT,
-                first_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            ''')
-        else:
-            # Таблица существует, проверяем и добавляем недостающие столбцы
-            logger.info("🔄 Проверяю структуру существующей таблицы...")
-            
-            # Добавляем недостающие столбцы
-            if 'username' not in columns:
-                logger.info("➕ Добавляю столбец username...")
-                cur.execute('ALTER TABLE users ADD COLUMN username TEXT')
-                
-            if 'first_name' not in columns:
-                logger.info("➕ Добавляю столбец first_name...")
-                cur.execute('ALTER TABLE users ADD COLUMN first_name TEXT')
-                
-            if 'created_at' not in columns:
-                logger.info("➕ Добавляю столбец created_at...")
-                cur.execute('ALTER TABLE users ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
-                
-            if 'updated_at' not in columns:
-                logger.info("➕ Добавляю столбец updated_at...")
-                cur.execute('ALTER TABLE users ADD COLUMN updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
-            
-            # Убираем NOT NULL с city если он есть (для совместимости)
-            if 'city' in columns:
-                logger.info("🔧 Обновляю структуру таблицы...")
-                # Создаем временную таблицу с правильной структурой
-                cur.execute('''
-                CREATE TABLE users_new (
-                    user_id INTEGER PRIMARY KEY,
-                    city TEXT,
-                    username TEXT,
-                    first_name TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                ''')
-                
-                # Копируем данные
-                cur.execute('''
-                INSERT INTO users_new (user_id, city, username, first_name, created_at, updated_at)
-                SELECT 
-                    user_id, 
-                    city,
-                    CASE WHEN 'username' IN (SELECT name FROM pragma_table_info('users')) THEN username ELSE NULL END,
-                    CASE WHEN 'first_name' IN (SELECT name FROM pragma_table_info('users')) THEN first_name ELSE NULL END,
-                    CASE WHEN 'created_at' IN (SELECT name FROM pragma_table_info('users')) THEN created_at ELSE CURRENT_TIMESTAMP END,
-                    CASE WHEN 'updated_at' IN (SELECT name FROM pragma_table_info('users')) THEN updated_at ELSE CURRENT_TIMESTAMP END
-                FROM users
-                ''')
-                
-                # Удаляем старую таблицу и переименовываем новую
-                cur.execute('DROP TABLE users')
-                cur.execute('ALTER TABLE users_new RENAME TO users')
-        
-        # Создаем индекс для быстрого поиска
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON users(user_id)')
-        
-        conn.commit()
-        logger.info("✅ База данных успешно инициализирована")
-        
-        # Показываем финальную структуру
-        cur.execute("PRAGMA table_info(users)")
-        columns_info = cur.fetchall()
-        logger.info("📋 Структура таблицы users:")
-        for col in columns_info:
-            logger.info(f"   {col[1]} ({col[2]})")
-        
-    except sqlite3.Error as e:
-        logger.error(f"❌ Ошибка инициализации БД: {e}")
-        raise
-    finally:
-        if conn:
+DB_PATH = os.getenv('DB_PATH', 'users.db')
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', 8192))  # кэш страниц на соединение
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))  # ожидание блокировки записи
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL').upper()  # NORMAL безопасен для WAL
+
+# Соединения открываются один раз на поток и переиспользуются: sqlite3 кэширует
+# подготовленные выражения на соединение, поэтому SQL ниже держим неизменными строками.
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_generation = 0  # увеличивается в close_db, чтобы потоки открыли соединения заново
+# Запись идет по одной: так пишущие потоки ждут здесь, а не в busy handler SQLite
+_write_lock = threading.Lock()
+
+def _connect():
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,  # закрывается из close_db, используется только своим потоком
+        cached_statements=256,
+    )
+    # WAL: читатели не ждут писателя, запись не блокирует чтение
+    mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    if mode.lower() != 'wal':
+        logger.warning(f"⚠️ SQLite не перешел в режим WAL (journal_mode={mode})")
+    conn.execute(f'PRAGMA synchronous={DB_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+def get_connection():
+    """Постоянное соединение текущего потока"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.generation != _generation:
+        conn = _connect()
+        _local.conn = conn
+        _local.generation = _generation
+        with _connections_lock:
+            _connections.append(conn)
+        logger.debug(f"Открыто соединение с БД для потока {threading.current_thread().name}")
+    return conn
+
+def close_db():
+    """Закрывает все соединения; последующие вызовы откроют новые"""
+    global _generation
+    with _connections_lock:
+        connections = _connections[:]
+        _connections.clear()
+        _generation += 1
+    for i, conn in enumerate(connections):
+        try:
+            if i == 0:
+                # переносим WAL в основной файл, чтобы база была целой и без -wal файла
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
             conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Ошибка при закрытии соединения с БД: {e}")
+    if connections:
+        logger.info(f"🗄️ Закрыто соединений с БД: {len(connections)}")
+
+def init_db():
+    """Приводит схему базы к последней версии; если она актуальна, ничего не делает"""
+    conn = get_connection()
+    with _write_lock:
+        try:
+            applied = migrations.migrate(conn)
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка инициализации БД: {e}")
+            raise
+    if applied:
+        logger.info(f"✅ База данных обновлена до версии {migrations.LATEST_VERSION} (миграций: {applied})")
+    else:
+        logger.debug(f"База данных актуальна (версия {migrations.LATEST_VERSION})")
 
-def set_user_city(user_id, city, username=None, first_name=None):
+# Одна инструкция на вставку и обновление (SQLite 3.24+)
+_UPSERT_USER_SQL = '''
+    INSERT INTO users (user_id, city, username, first_name, city_id, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT(user_id) DO UPDATE SET
+        city = excluded.city,
+        city_id = excluded.city_id,
+        username = excluded.username,
+        first_name = excluded.first_name,
+        updated_at = CURRENT_TIMESTAMP
+'''
+
+def set_user_city(user_id, city, username=None, first_name=None, city_id=None):
     """Установка города пользователя с дополнительной информацией"""
-    try:
-        conn = sqlite3.connect(DB_PATH, timeout=10.0)
-        cur = conn.cursor()
-        
-        # Проверяем структуру таблицы
-        cur.execute("PRAGMA table_info(users)")
-        columns = [column[1] for column in cur.fetchall()]
-        
-        # Проверяем, существует ли пользователь
-        cur.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
-        exists = cur.fetchone()
-        
-        if exists:
-            # Обновляем существующего пользователя
-            if 'username' in columns and 'first_name' in columns and 'updated_at' in columns:
-                # Полная структура
-                cur.execute('''
-                    UPDATE users 
-                    SET city = ?, username = ?, first_name = ?, updated_at = CURRENT_TIMESTAMP 
-                    WHERE user_id = ?
-                ''', (city, username, first_name, user_id))
-            else:
-                # Базовая структура
-                cur.execute('''
-                    UPDATE users 
-                    SET city = ?
-                    WHERE user_id = ?
-                ''', (city, user_id))
-        else:
-            # Создаем нового пользователя
-            if 'username' in columns and 'first_name' in columns:
-                # Полная структура
-                cur.execute('''
-                    INSERT INTO users (user_id, city, username, first_name) 
-                    VALUES (?, ?, ?, ?)
-                ''', (user_id, city, username, first_name))
-            else:
-                # Базовая структура
-                cur.execute('''
-                    INSERT INTO users (user_id, city) 
-                    VALUES (?, ?)
-                ''', (user_id, city))
-        
-        conn.commit()
-        logger.info(f"✅ Город '{city}' установлен для пользователя {user_id}")
-        
-    except sqlite3.Error as e:
-        logger.error(f"❌ Ошибка при установке города: {e}")
-        # Попробуем базовый вариант без дополнительных полей
+    conn = get_connection()
+    with _write_lock:
         try:
-            conn = sqlite3.connect(DB_PATH, timeout=10.0)
-            cur = conn.cursor()
-            cur.execute('INSERT OR REPLACE INTO users (user_id, city) VALUES (?, ?)', (user_id, city))
+            conn.execute(_UPSERT_USER_SQL, (user_id, city, username, first_name, city_id))
             conn.commit()
-            logger.info(f"✅ Город '{city}' установлен для пользователя {user_id} (базовый режим)")
-        except sqlite3.Error as e2:
-            logger.error(f"❌ Критическая ошибка при установке города: {e2}")
+            logger.info(f"✅ Город '{city}' установлен для пользователя {user_id}")
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"❌ Ошибка при установке города: {e}")
+            raise
+
+def set_user_cities(rows):
+    """Установка городов пачкой в одной транзакции: rows - [(user_id, city, username, first_name, city_id)]"""
+    conn = get_connection()
+    with _write_lock:
+        try:
+            conn.executemany(_UPSERT_USER_SQL, rows)
+            conn.commit()
+            logger.info(f"✅ Города сохранены для {len(rows)} пользователей")
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"❌ Ошибка при сохранении городов: {e}")
             raise
-        finally:
-            if conn:
-                conn.close()
-    finally:
-        if conn:
-            conn.close()
 
 def get_user_city(user_id):
     """Получение города пользователя"""
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=10.0)
-        cur = conn.cursor()
-        
-        cur.execute('SELECT city FROM users WHERE user_id = ?', (user_id,))
+        cur = get_connection().execute('SELECT city FROM users WHERE user_id = ?', (user_id,))
         result = cur.fetchone()
         
         if result:
@@ -189,43 +147,157 @@ def get_user_city(user_id):
     except sqlite3.Error as e:
         logger.error(f"❌ Ошибка при получении города: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
+
+def get_recent_user_cities(limit):
+    """Города последних активных пользователей: [(user_id, city)]"""
+    try:
+        return get_connection().execute(
+            'SELECT user_id, city FROM users ORDER BY updated_at DESC LIMIT ?', (limit,)
+        ).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"❌ Ошибка при получении городов пользователей: {e}")
+        return []
 
 def get_user_stats():
-    """Получение статистики пользователей"""
+    """Получение статистики пользователей (счетчики обновляются триггерами)"""
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=10.0)
-        cur = conn.cursor()
-        
-        cur.execute('SELECT COUNT(*) FROM users')
-        total_users = cur.fetchone()[0]
-        
-        cur.execute('SELECT COUNT(DISTINCT city) FROM users WHERE city IS NOT NULL')
-        unique_cities = cur.fetchone()[0]
-        
+        counters = dict(get_connection().execute('SELECT name, value FROM stats_counters').fetchall())
         return {
-            'total_users': total_users,
-            'unique_cities': unique_cities
+            'total_users': counters.get('total_users', 0),
+            'unique_cities': counters.get('unique_cities', 0)
         }
         
     except sqlite3.Error as e:
         logger.error(f"❌ Ошибка при получении статистики: {e}")
         return {'total_users': 0, 'unique_cities': 0}
-    finally:
-        if conn:
-            conn.close()
+
+def get_top_cities(limit=10):
+    """Самые популярные города: [(город, число пользователей)]; города с одним id считаются вместе"""
+    try:
+        return get_connection().execute(
+            'SELECT city, users FROM city_counts ORDER BY users DESC LIMIT ?', (limit,)
+        ).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"❌ Ошибка при получении популярных городов: {e}")
+        return []
+
+# Порядок полей в выгрузке пользователей (user_export.py)
+USER_FIELDS = ('user_id', 'city', 'city_id', 'username', 'first_name', 'created_at', 'updated_at')
+
+def get_users_page(after_id, limit):
+    """Пользователи с user_id больше after_id по возрастанию user_id: [(поля USER_FIELDS)].
+
+    Страница ищется по первичному ключу, поэтому каждая следующая стоит столько же, сколько первая.
+    """
+    return get_connection().execute('''
+        SELECT user_id, city, city_id, username, first_name, created_at, updated_at
+        FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?
+    ''', (after_id, limit)).fetchall()
+
+# Загрузка сохраняет даты из выгрузки
+_IMPORT_USER_SQL = '''
+    INSERT INTO users (user_id, city, city_id, username, first_name, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), COALESCE(?, CURRENT_TIMESTAMP))
+    ON CONFLICT(user_id) DO UPDATE SET
+        city = excluded.city,
+        city_id = excluded.city_id,
+        username = excluded.username,
+        first_name = excluded.first_name,
+        created_at = excluded.created_at,
+        updated_at = excluded.updated_at
+'''
+
+def import_users(rows):
+    """Загрузка пользователей пачкой в одной транзакции: rows - [(поля USER_FIELDS)].
+
+    Триггеры статистики на время пачки снимаются (внутри той же транзакции), а счетчики
+    меняются одним запросом на город: построчные триггеры втрое замедляли загрузку.
+    """
+    conn = get_connection()
+    with _write_lock:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # город каждого пользователя пачки; последняя строка с тем же user_id побеждает, как и в upsert
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS import_batch (user_id INTEGER PRIMARY KEY, city TEXT, city_id INTEGER)')
+            conn.execute('DELETE FROM import_batch')
+            conn.executemany('INSERT OR REPLACE INTO import_batch VALUES (?, ?, ?)', [row[:3] for row in rows])
+
+            # CROSS JOIN фиксирует порядок: пачка перебирается, users ищется по первичному ключу
+            previous = conn.execute(f'''
+                SELECT {migrations.city_key_sql('users')} AS key, COUNT(*)
+                FROM import_batch CROSS JOIN users USING (user_id) GROUP BY key
+            ''').fetchall()
+            existing = sum(count for _, count in previous)
+            removed = [(key, count) for key, count in previous if key is not None]
+            added = conn.execute(f'''
+                SELECT {migrations.city_key_sql('import_batch')} AS key, MAX(city), COUNT(*) FROM import_batch
+                WHERE key IS NOT NULL GROUP BY key
+            ''').fetchall()
+            batch_size = conn.execute('SELECT COUNT(*) FROM import_batch').fetchone()[0]
+
+            for name in migrations.USER_STATS_TRIGGERS:
+                conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+            conn.executemany(_IMPORT_USER_SQL, rows)
+            migrations.create_user_stats_triggers(conn)
+
+            conn.executemany('UPDATE city_counts SET users = users - ? WHERE key = ?',
+                             [(count, key) for key, count in removed])
+            conn.executemany('''
+                INSERT INTO city_counts (key, city, users) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET users = users + excluded.users
+            ''', added)
+            conn.execute('DELETE FROM city_counts WHERE users <= 0')
+            conn.execute("UPDATE stats_counters SET value = value + ? WHERE name = 'total_users'",
+                         (batch_size - existing,))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"❌ Ошибка при загрузке пользователей: {e}")
+            raise
+
+def save_city(city_id, name, country, lat, lon, aliases=()):
+    """Сохранение города и вариантов его написания (нормализованных названий) одной транзакцией"""
+    conn = get_connection()
+    with _write_lock:
+        try:
+            conn.execute('''
+                INSERT INTO cities (city_id, name, country, lat, lon, updated_at)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(city_id) DO UPDATE SET
+                    name = excluded.name,
+                    country = excluded.country,
+                    lat = excluded.lat,
+                    lon = excluded.lon,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (city_id, name, country, lat, lon))
+            conn.executemany(
+                'INSERT OR REPLACE INTO city_aliases (alias, city_id) VALUES (?, ?)',
+                [(alias, city_id) for alias in aliases]
+            )
+            conn.commit()
+            logger.debug(f"Город {city_id} '{name}' сохранен, написаний: {len(aliases)}")
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"❌ Ошибка при сохранении города: {e}")
+
+def get_city_aliases():
+    """Все известные написания городов: [(alias, city_id, name, country, lat, lon)]"""
+    try:
+        return get_connection().execute('''
+            SELECT alias, city_id, name, country, lat, lon FROM city_aliases JOIN cities USING (city_id)
+        ''').fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"❌ Ошибка при получении городов: {e}")
+        return []
 
 def backup_database():
-    """Создание резервной копии базы данных"""
+    """Создание резервной копии базы данных в текущей папке"""
     try:
         if os.path.exists(DB_PATH):
-            backup_name = f"users_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-            
-            # Копируем файл
-            import shutil
-            shutil.copy2(DB_PATH, backup_name)
+            # Онлайн-копия через backup API SQLite: не мешает записи и учитывает файл -wal
+            import backup
+            info = backup.create_backup(directory='.', compress=False)
+            backup_name = os.path.basename(info['path'])
             
             logger.info(f"✅ Резервная копия создана: {backup_name}")
             return backup_name
@@ -235,4 +307,4 @@ def backup_database():
             
     except Exception as e:
         logger.error(f"❌ Ошибка при создании резервной копии: {e}")
-        return None
\ No newline at end of file
+        return None
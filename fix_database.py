@@ -8,11 +8,13 @@ import logging
 import os
 from datetime import datetime
 
+import migrations
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-DB_PATH = 'users.db'
+DB_PATH = os.getenv('DB_PATH', 'users.db')
 
 def fix_database():
     """Исправляет структуру базы данных"""
@@ -21,10 +23,15 @@ def fix_database():
             logger.info("📝 База данных не существует, будет создана при запуске бота")
             return True
             
-        # Создаем резервную копию
+        # Создаем резервную копию через backup API SQLite: копия целостна, даже если бот пишет в базу
         backup_name = f"users_backup_fix_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-        import shutil
-        shutil.copy2(DB_PATH, backup_name)
+        source = sqlite3.connect(DB_PATH, timeout=10.0)
+        target = sqlite3.connect(backup_name)
+        try:
+            source.backup(target, pages=256, sleep=0.005)
+        finally:
+            target.close()
+            source.close()
         logger.info(f"💾 Создана резервная копия: {backup_name}")
         
         conn = sqlite3.connect(DB_PATH, timeout=10.0)
@@ -52,21 +59,23 @@ def fix_database():
             username TEXT,
             first_name TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            city_id INTEGER REFERENCES cities(city_id)
         )
         ''')
         
         # Копируем данные из старой таблицы
         logger.info("📋 Копирую данные...")
         if 'city' in columns:
-            cur.execute('SELECT user_id, city FROM users')
+            city_id = 'city_id' if 'city_id' in columns else 'NULL'
+            cur.execute(f'SELECT user_id, city, {city_id} FROM users')
             old_data = cur.fetchall()
             
-            for user_id, city in old_data:
+            for user_id, city, city_id in old_data:
                 cur.execute('''
-                INSERT INTO users_fixed (user_id, city, created_at, updated_at) 
-                VALUES (?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                ''', (user_id, city))
+                INSERT INTO users_fixed (user_id, city, city_id, created_at, updated_at) 
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ''', (user_id, city, city_id))
             
             logger.info(f"✅ Скопировано записей: {len(old_data)}")
         
@@ -75,8 +84,14 @@ def fix_database():
         cur.execute('DROP TABLE users')
         cur.execute('ALTER TABLE users_fixed RENAME TO users')
         
-        # Создаем индекс
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON users(user_id)')
+        # Триггеры статистики удалены вместе со старой таблицей. Версию схемы не трогаем:
+        # повторный прогон миграций на уже обновленной базе невозможен
+        version = migrations.get_version(conn)
+        if version >= migrations.LATEST_VERSION:
+            logger.info("📊 Пересчитываю статистику и восстанавливаю триггеры...")
+            migrations.rebuild_user_stats(conn)
+        else:
+            logger.info(f"📊 Схема версии {version}: статистику пересчитают миграции при запуске бота")
         
         conn.commit()
         
@@ -0,0 +1,97 @@
+"""
+Хранилище состояний FSM aiogram: в памяти процесса или на KV сервере (kv_server.py)
+"""
+
+import logging
+import urllib.parse
+from typing import Any, Dict, Optional
+
+import aiohttp
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import config
+
+logger = logging.getLogger(__name__)
+
+class KVStorage(BaseStorage):
+    """Состояния и данные FSM на KV сервере, общие для всех процессов и экземпляров бота.
+
+    Нужно, когда обновления одного пользователя обрабатывают разные процессы:
+    "/setcity" может попасть в один процесс, а название города - в другой.
+    Пустое состояние и пустые данные удаляются, поэтому ключи занимают только
+    пользователи посреди диалога.
+    """
+
+    def __init__(self, url=None, timeout=None):
+        self.url = (url or config.KV_URL).rstrip('/')
+        self.timeout = aiohttp.ClientTimeout(total=config.KV_TIMEOUT if timeout is None else timeout)
+        self._session = None
+
+    def _path(self, key: StorageKey, part: str) -> str:
+        parts = ['fsm', key.bot_id, key.chat_id, key.user_id]
+        if key.thread_id is not None:
+            parts.append(key.thread_id)
+        parts += [key.destiny, part]
+        return '/kv/' + urllib.parse.quote(':'.join(str(p) for p in parts), safe='')
+
+    def _client(self) -> aiohttp.ClientSession:
+        # сессия создается в цикле событий процесса, который ею пользуется
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(self.url, timeout=self.timeout)
+        return self._session
+
+    async def _get(self, path):
+        async with self._client().get(path) as resp:
+            if resp.status == 404:
+                return None
+            resp.raise_for_status()
+            return (await resp.json())['value']
+
+    async def _put(self, path, value):
+        async with self._client().put(path, json={'value': value}) as resp:
+            resp.raise_for_status()
+
+    async def _delete(self, path):
+        async with self._client().delete(path) as resp:
+            resp.raise_for_status()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        if state is None:
+            await self._delete(self._path(key, 'state'))
+        else:
+            await self._put(self._path(key, 'state'), state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._get(self._path(key, 'state'))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if data:
+            await self._put(self._path(key, 'data'), dict(data))
+        else:
+            await self._delete(self._path(key, 'data'))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict(await self._get(self._path(key, 'data')) or {})
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+FSM_BACKENDS = {
+    'memory': MemoryStorage,
+    'kv': KVStorage,
+}
+
+def create_fsm_storage(name=None) -> BaseStorage:
+    """Хранилище FSM по имени (по умолчанию из config.FSM_STORAGE)"""
+    name = (name or config.FSM_STORAGE).lower()
+    try:
+        backend = FSM_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"❌ Неизвестный FSM_STORAGE: {name} (доступны: {', '.join(FSM_BACKENDS)})")
+    logger.info(f"🧠 Хранилище состояний FSM: {name}")
+    return backend()
@@ -0,0 +1,88 @@
+"""
+Квантование координат: geohash ячейки для общего кэша погоды по местоположению
+"""
+
+from cache import TTLCache
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Примерный размер ячейки geohash по точности (ширина x высота у экватора)
+CELL_SIZES = {
+    3: '156 x 156 км',
+    4: '39 x 20 км',
+    5: '4.9 x 4.9 км',
+    6: '1.2 x 0.6 км',
+    7: '153 x 153 м',
+}
+
+def geohash_bounds(lat: float, lon: float, precision: int):
+    """Возвращает (geohash, (мин. широта, макс. широта), (мин. долгота, макс. долгота))"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # биты чередуются: долгота, широта, долгота...
+
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(chars), tuple(lat_range), tuple(lon_range)
+
+def geohash(lat: float, lon: float, precision: int) -> str:
+    """Geohash точки с заданным числом символов"""
+    return geohash_bounds(lat, lon, precision)[0]
+
+def quantize(lat: float, lon: float, precision: int):
+    """Привязывает точку к ячейке: (geohash, широта центра, долгота центра)"""
+    cell, lat_range, lon_range = geohash_bounds(lat, lon, precision)
+    center_lat = round((lat_range[0] + lat_range[1]) / 2, 4)
+    center_lon = round((lon_range[0] + lon_range[1]) / 2, 4)
+    return cell, center_lat, center_lon
+
+class GeoCellStats:
+    """Теневая статистика: какой была бы доля попаданий в кэш при разной точности ячеек.
+
+    Для каждой точности хранит только ключи ячеек с тем же TTL, что и у настоящего кэша.
+    """
+
+    def __init__(self, precisions, ttl: float, max_size: int):
+        self._cells = {p: TTLCache(ttl=ttl, max_size=max_size) for p in precisions}
+        self._max_precision = max(precisions) if precisions else 0
+
+    def record(self, lat: float, lon: float):
+        if not self._cells:
+            return
+        # geohash меньшей точности - префикс более точного, считаем его один раз
+        full = geohash(lat, lon, self._max_precision)
+        for precision, cells in self._cells.items():
+            cell = full[:precision]
+            if cells.get(cell) is None:
+                cells.set(cell, True)
+
+    def stats(self):
+        result = {}
+        for precision, cells in self._cells.items():
+            s = cells.stats()
+            result[str(precision)] = {
+                'cell_size': CELL_SIZES.get(precision, '?'),
+                'cells': s['size'],
+                'hits': s['hits'],
+                'misses': s['misses'],
+                'hit_ratio': s['hit_ratio'],
+            }
+        return result
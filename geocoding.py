@@ -0,0 +1,92 @@
+"""
+Справочник городов: написания названий -> id города OpenWeatherMap и его координаты.
+Индекс в памяти поверх таблиц cities и city_aliases.
+"""
+
+import logging
+
+import async_db
+
+logger = logging.getLogger(__name__)
+
+def normalize_city(city: str) -> str:
+    """Приводит название города к виду для ключа кэша: без лишних пробелов и регистра"""
+    return ' '.join(city.split()).lower()
+
+class Geocode:
+    """Координаты и официальное название города"""
+
+    __slots__ = ('city_id', 'name', 'country', 'lat', 'lon')
+
+    def __init__(self, city_id, name, country, lat, lon):
+        self.city_id = city_id
+        self.name = name
+        self.country = country
+        self.lat = lat
+        self.lon = lon
+
+    def same_place(self, other) -> bool:
+        return (other is not None and self.city_id == other.city_id and self.name == other.name
+                and round(self.lat, 4) == round(other.lat, 4) and round(self.lon, 4) == round(other.lon, 4))
+
+class GeocodeIndex:
+    """Написание города -> id города, официальное название и координаты без обращения к API.
+
+    "Москва", "москва " и "Moscow" указывают на один город (id из ответа API), поэтому
+    кэши и запросы к API идут по id, а не по тексту, который ввел пользователь.
+    Индекс загружается из базы один раз при старте (load в on_startup) и пополняется
+    из любых ответов API погоды; get и resolve только читают словарь в памяти.
+    В базу пишутся только новые написания и изменившиеся города.
+    """
+
+    def __init__(self, normalize):
+        self._normalize = normalize
+        self._index = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self):
+        """Загружает все сохраненные написания городов из хранилища в пуле читателей"""
+        cities = {}
+        for alias, city_id, name, country, lat, lon in await async_db.read(async_db.storage.get_city_aliases):
+            geocode = cities.get(city_id)
+            if geocode is None:
+                geocode = cities[city_id] = Geocode(city_id, name, country, lat, lon)
+            # написание, уже полученное из ответа API, новее сохраненного
+            self._index.setdefault(alias, geocode)
+        logger.info(f"🗺️ Загружено городов: {len(cities)}, написаний: {len(self._index)}")
+
+    def get(self, city: str):
+        geocode = self._index.get(self._normalize(city))
+        if geocode is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return geocode
+
+    def resolve(self, city: str):
+        """id города для написания или None, если город еще не встречался"""
+        geocode = self._index.get(self._normalize(city))
+        return None if geocode is None else geocode.city_id
+
+    def remember(self, city: str, record):
+        """Запоминает координаты из записи CurrentWeather или Forecast"""
+        if not record.name or record.lat is None or record.lon is None:
+            return
+        geocode = Geocode(record.city_id, record.name, record.country, record.lat, record.lon)
+
+        aliases = []
+        for alias in {self._normalize(city), self._normalize(geocode.name)}:
+            if geocode.same_place(self._index.get(alias)):
+                continue
+            self._index[alias] = geocode
+            aliases.append(alias)
+        if aliases and geocode.city_id is not None:
+            # запись в базу уходит в поток писателя, ответ пользователю ее не ждет
+            async_db.write_nowait(
+                async_db.storage.save_city, geocode.city_id, geocode.name, geocode.country,
+                geocode.lat, geocode.lon, aliases,
+            )
+
+    def stats(self):
+        return {'size': len(self._index), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Простой key-value сервер по HTTP: локальная замена сетевого хранилища для STORAGE_BACKEND=kv.
+
+Протокол (значения - JSON):
+  GET    /kv/<ключ>        -> {"value": ...} или 404
+  PUT    /kv/<ключ>        {"value": ...} -> {"previous": прежнее значение или null}
+  DELETE /kv/<ключ>        -> {"previous": ...}
+  POST   /kv/<ключ>/incr   {"by": n} -> {"value": новое значение}
+  GET    /scan?prefix=<p>  -> {ключ: значение} для всех ключей с префиксом
+  GET    /scan?prefix=<p>&after=<ключ>&limit=<n>
+                           -> первые n ключей с префиксом после ключа after:
+                              страница для обхода большого числа ключей
+
+Все операции атомарны: сервер однопоточный. Scan отдает ключи по возрастанию
+(как строки). Данные хранятся в памяти и,
+если указан --data, сохраняются в JSON файл при остановке.
+
+Запуск: python kv_server.py --port 8765 [--data kv.json]
+"""
+
+import argparse
+import bisect
+import json
+import logging
+import os
+
+from aiohttp import web
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('kv_server')
+
+def create_app(data_path=None):
+    store = {}
+    if data_path and os.path.exists(data_path):
+        with open(data_path, encoding='utf-8') as f:
+            store.update(json.load(f))
+        logger.info(f"📂 Загружено ключей: {len(store)}")
+    keys = sorted(store)  # индекс для scan: страница не требует сортировки всех ключей
+
+    def add_key(key):
+        if key not in store:
+            bisect.insort(keys, key)
+
+    def remove_key(key):
+        if key in store:
+            del keys[bisect.bisect_left(keys, key)]
+
+    async def get_value(request):
+        key = request.match_info['key']
+        if key not in store:
+            raise web.HTTPNotFound()
+        return web.json_response({'value': store[key]})
+
+    async def put_value(request):
+        body = await request.json()
+        key = request.match_info['key']
+        previous = store.get(key)
+        add_key(key)
+        store[key] = body['value']
+        return web.json_response({'previous': previous})
+
+    async def delete_value(request):
+        key = request.match_info['key']
+        remove_key(key)
+        return web.json_response({'previous': store.pop(key, None)})
+
+    async def incr(request):
+        body = await request.json()
+        key = request.match_info['key']
+        value = store.get(key, 0) + body.get('by', 1)
+        add_key(key)
+        store[key] = value
+        return web.json_response({'value': value})
+
+    async def scan(request):
+        prefix = request.query.get('prefix', '')
+        after = request.query.get('after')
+        limit = int(request.query['limit']) if 'limit' in request.query else None
+        start = bisect.bisect_right(keys, after) if after is not None and after >= prefix else bisect.bisect_left(keys, prefix)
+        result = {}
+        for key in keys[start:] if limit is None else keys[start:start + limit]:
+            if not key.startswith(prefix):
+                break
+            result[key] = store[key]
+        return web.json_response(result)
+
+    async def save(app):
+        if data_path:
+            with open(data_path, 'w', encoding='utf-8') as f:
+                json.dump(store, f, ensure_ascii=False)
+            logger.info(f"💾 Сохранено ключей: {len(store)}")
+
+    app = web.Application()
+    app.router.add_post('/kv/{key:.+}/incr', incr)
+    app.router.add_get('/kv/{key:.+}', get_value)
+    app.router.add_put('/kv/{key:.+}', put_value)
+    app.router.add_delete('/kv/{key:.+}', delete_value)
+    app.router.add_get('/scan', scan)
+    app.on_cleanup.append(save)
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальный key-value сервер для STORAGE_BACKEND=kv')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--data', help='JSON файл для сохранения данных между запусками')
+    args = parser.parse_args()
+    web.run_app(create_app(args.data), host=args.host, port=args.port)
@@ -0,0 +1,148 @@
+"""
+Планировщик с полосами: строгий порядок внутри ключа, параллельность между ключами
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from metrics import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+class _Lane:
+    __slots__ = ('key', 'items', 'scheduled')
+
+    def __init__(self, key):
+        self.key = key
+        self.items = deque()  # (элемент, время постановки)
+        self.scheduled = False  # полоса стоит в очереди готовых или обрабатывается
+
+class LaneScheduler:
+    """У каждого ключа (например, чата) своя очередь-полоса.
+
+    Элементы одной полосы обрабатываются по одному и строго по порядку, разные полосы -
+    одновременно, но не больше max_concurrency сразу. Готовые полосы обслуживаются
+    по кругу по одному элементу, поэтому активный чат не задерживает остальных.
+    Опустевшая полоса сразу удаляется: память занимают только чаты с необработанными элементами.
+    Всего ждет обработки не больше max_pending элементов, дальше submit возвращает False.
+    """
+
+    def __init__(self, handler, max_concurrency: int, max_pending: int, starvation: float = 5.0):
+        self.handler = handler
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.starvation = starvation  # секунд ожидания, после которых элемент считается голодающим
+        self._lanes = {}
+        self._ready = None
+        self._idle = None
+        self._tasks = []
+        self.pending = 0
+        self.running = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.starved = 0
+        self.lanes_created = 0
+        self.max_lanes = 0
+        self.max_lane_depth = 0
+        self.wait = LatencyWindow()  # от постановки до начала обработки
+        self.handle = LatencyWindow()
+
+    def start(self):
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.max_concurrency)]
+
+    def submit(self, key, item) -> bool:
+        """Ставит элемент в полосу key; False, если очередь заполнена"""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return False
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane(key)
+            self.lanes_created += 1
+            self.max_lanes = max(self.max_lanes, len(self._lanes))
+        lane.items.append((item, time.monotonic()))
+        self.max_lane_depth = max(self.max_lane_depth, len(lane.items))
+        self.pending += 1
+        self.accepted += 1
+        self._idle.clear()
+        if not lane.scheduled:
+            lane.scheduled = True
+            self._ready.put_nowait(lane)
+        return True
+
+    async def _worker(self):
+        while True:
+            lane = await self._ready.get()
+            item, queued = lane.items.popleft()
+            self.pending -= 1
+            self.running += 1
+            started = time.monotonic()
+            waited = started - queued
+            self.wait.add(waited)
+            if waited > self.starvation:
+                self.starved += 1
+            try:
+                await self.handler(item)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"❌ Ошибка обработки в полосе {lane.key}: {e}")
+            finally:
+                self.handle.add(time.monotonic() - started)
+                self.running -= 1
+                if lane.items:
+                    # в конец очереди готовых: остальные полосы не ждут, пока эта опустеет
+                    self._ready.put_nowait(lane)
+                else:
+                    lane.scheduled = False
+                    del self._lanes[lane.key]
+                if not self.pending and not self.running:
+                    self._idle.set()
+
+    async def join(self):
+        """Ждет, пока не останется необработанных элементов"""
+        await self._idle.wait()
+
+    async def stop(self, timeout: float):
+        """Дожидается обработки принятых элементов (не дольше timeout) и останавливает обработчики"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Не обработано при остановке: {self.pending + self.running}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        now = time.monotonic()
+        oldest = max((now - lane.items[0][1] for lane in self._lanes.values() if lane.items), default=0.0)
+        return {
+            'pending': self.pending,
+            'capacity': self.max_pending,
+            'running': self.running,
+            'max_concurrency': self.max_concurrency,
+            'lanes': len(self._lanes),
+            'max_lanes': self.max_lanes,
+            'lanes_collected': self.lanes_created - len(self._lanes),
+            'max_lane_depth': self.max_lane_depth,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'processed': self.processed,
+            'failed': self.failed,
+            'starved': self.starved,
+            'oldest_wait_ms': round(oldest * 1000, 1),
+            'wait': self.wait.stats(),
+            'handle': self.handle.stats(),
+        }
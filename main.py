@@ -6,18 +6,21 @@
 
 import asyncio
 import logging
+import secrets
 import sys
 import traceback
-from aiohttp import web
+from aiohttp import MultipartWriter, web
 from aiohttp.web_request import Request
-from aiogram import Bot, Dispatcher
+from aiogram import Dispatcher
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiogram.types import Update
 
 # Импортируем модули бота
 import config
-import database as db
-from bot import dp, bot, set_bot_commands
+import async_db
+from bot import dp, bot, set_bot_commands, weather_service, backup_service, send_scheduler
+from update_queue import UpdateQueue
+import webhook_workers
 
 # Настройка логирования
 logging.basicConfig(
@@ -29,15 +32,53 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-async def webhook_handler(request: Request, bot: Bot) -> web.Response:
-    """Обработчик webhook запросов"""
+# Обновления из webhook обрабатываются в фоне (WEBHOOK_ACK_FAST)
+update_queue = UpdateQueue(dp, bot, can_reply=send_scheduler.reserve_now)
+
+def webhook_reply(method) -> web.Response:
+    """Ответ на webhook с вызовом метода Bot API в теле: Telegram выполнит его сам.
+
+    Формат тот же, что у SimpleRequestHandler aiogram; файлов в таких методах нет
+    (их не пропускает send_scheduler.reserve_now).
+    """
+    writer = MultipartWriter("form-data", boundary=f"webhookBoundary{secrets.token_urlsafe(16)}")
+    payload = writer.append(method.__api_method__)
+    payload.set_content_disposition("form-data", name="method")
+    for key, value in method.model_dump(warnings=False).items():
+        value = bot.session.prepare_value(value, bot=bot, files={})
+        if not value:
+            continue
+        payload = writer.append(value)
+        payload.set_content_disposition("form-data", name=key)
+    return web.Response(body=writer)
+
+async def webhook_handler(request: Request) -> web.Response:
+    """Обработчик webhook запросов: обновление ставится в очередь.
+
+    Если обработчик успел за WEBHOOK_REPLY_DEADLINE и отдал ответ (bot.send_reply), он уходит
+    в теле ответа на webhook, без отдельного запроса к api.telegram.org; иначе 200 сразу
+    по истечении срока, а ответ обработчик отправляет обычным запросом.
+    """
     try:
         update = Update.model_validate(await request.json(), context={"bot": bot})
-        await dp.feed_update(bot, update)
-        return web.Response(status=200)
     except Exception as e:
-        logger.error(f"Ошибка в webhook handler: {e}")
-        return web.Response(status=500)
+        logger.warning(f"⚠️ Некорректное обновление в webhook: {e}")
+        return web.Response(status=400)
+    reply = update_queue.submit(update)
+    if reply is None:
+        # Telegram повторит доставку; Retry-After подсказывает, когда
+        logger.warning(f"⚠️ Очередь обновлений заполнена, обновление {update.update_id} отклонено")
+        return web.Response(status=503, headers={"Retry-After": "1"})
+    method = await update_queue.wait_reply(reply, config.WEBHOOK_REPLY_DEADLINE)
+    if method is None:
+        return web.Response(status=200)
+    return webhook_reply(method)
+
+async def start_update_queue(app: web.Application):
+    update_queue.start()
+
+async def stop_update_queue(app: web.Application):
+    await update_queue.stop()
 
 async def health_check(request: Request) -> web.Response:
     """Health check endpoint для Render"""
@@ -45,7 +86,13 @@ async def health_check(request: Request) -> web.Response:
         "status": "ok", 
         "bot": "weather_bot",
         "version": "2.0",
-        "timestamp": asyncio.get_event_loop().time()
+        "timestamp": asyncio.get_event_loop().time(),
+        "weather": weather_service.stats(),
+        "profiles": async_db.stats(),
+        "top_cities": await async_db.get_top_cities(5),
+        "backups": backup_service.stats(),
+        "updates": update_queue.stats(),
+        "outbound": send_scheduler.stats()
     })
 
 async def healthz_check(request: Request) -> web.Response:
@@ -146,11 +193,17 @@ async def create_app() -> web.Application:
     app.router.add_get("/alive", health_check)
     
     # Webhook endpoint
-    webhook_requests_handler = SimpleRequestHandler(
-        dispatcher=dp,
-        bot=bot,
-    )
-    webhook_requests_handler.register(app, path=config.WEBHOOK_PATH)
+    if config.WEBHOOK_ACK_FAST:
+        app.router.add_post(config.WEBHOOK_PATH, webhook_handler)
+        # очередь останавливается раньше диспетчера: принятые обновления успевают обработаться
+        app.on_startup.append(start_update_queue)
+        app.on_shutdown.append(stop_update_queue)
+    else:
+        webhook_requests_handler = SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+        )
+        webhook_requests_handler.register(app, path=config.WEBHOOK_PATH)
     setup_application(app, dp, bot=bot)
     
     return app
@@ -159,13 +212,18 @@ async def run_webhook():
     """Запуск в режиме webhook (для Render)"""
     try:
         # Инициализация
-        db.init_db()
+        async_db.storage.init()
         await set_bot_commands()
         
         # Настройка webhook
         if not await setup_webhook():
             raise Exception("Не удалось настроить webhook")
         
+        if config.WEBHOOK_PROCESSES > 1:
+            # этот процесс принимает обновления и пересылает их процессам-обработчикам по чатам
+            await webhook_workers.supervise(config.WEBHOOK_PROCESSES)
+            return
+        
         # Создание веб-приложения
         app = await create_app()
         
@@ -211,7 +269,7 @@ async def run_polling():
     """Запуск в режиме polling (для разработки)"""
     try:
         # Инициализация
-        db.init_db()
+        async_db.storage.init()
         await set_bot_commands()
         
         # Удаляем webhook если есть
@@ -0,0 +1,35 @@
+"""
+Метрики для health endpoint: задержки за последние N событий
+"""
+
+from collections import deque
+
+class LatencyWindow:
+    """Последние size задержек и их перцентили в миллисекундах"""
+
+    def __init__(self, size: int = 1000):
+        self._values = deque(maxlen=size)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self._values.append(seconds)
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> float:
+        """Перцентиль в секундах по окну, 0 - если событий еще не было"""
+        if not self._values:
+            return 0.0
+        values = sorted(self._values)
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'p50_ms': round(self.percentile(50) * 1000, 1),
+            'p95_ms': round(self.percentile(95) * 1000, 1),
+            'p99_ms': round(self.percentile(99) * 1000, 1),
+            'max_ms': round(self.max * 1000, 1),
+        }
@@ -0,0 +1,308 @@
+"""
+Миграции схемы базы данных: версия схемы хранится в PRAGMA user_version
+"""
+
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+def _columns(conn, table):
+    """{имя столбца: NOT NULL} для таблицы, пустой словарь, если ее нет"""
+    return {row[1]: bool(row[3]) for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def _normalize_city_v5(city):
+    # копия geocoding.normalize_city на момент миграции 5: результат миграции
+    # не должен меняться вместе с кодом приложения, а импорт geocoding тянет async_db
+    return ' '.join(city.split()).lower()
+
+def _create_users(conn):
+    """Таблица пользователей; старые базы приводятся к той же структуре"""
+    columns = _columns(conn, 'users')
+    if not columns:
+        conn.execute('''
+        CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY,
+            city TEXT,
+            username TEXT,
+            first_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        return
+
+    if columns.get('city'):
+        # В первых версиях city был NOT NULL: снять ограничение можно только пересозданием таблицы
+        logger.info("🔧 Пересоздаю таблицу users без NOT NULL у city...")
+        conn.execute('''
+        CREATE TABLE users_new (
+            user_id INTEGER PRIMARY KEY,
+            city TEXT,
+            username TEXT,
+            first_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        copied = [name for name in ('user_id', 'city', 'username', 'first_name', 'created_at', 'updated_at')
+                  if name in columns]
+        names = ', '.join(copied)
+        conn.execute(f'INSERT INTO users_new ({names}) SELECT {names} FROM users')
+        conn.execute('DROP TABLE users')
+        conn.execute('ALTER TABLE users_new RENAME TO users')
+        return
+
+    # Добавляем недостающие столбцы
+    for name in ('username', 'first_name'):
+        if name not in columns:
+            logger.info(f"➕ Добавляю столбец {name}...")
+            conn.execute(f'ALTER TABLE users ADD COLUMN {name} TEXT')
+    for name in ('created_at', 'updated_at'):
+        if name not in columns:
+            logger.info(f"➕ Добавляю столбец {name}...")
+            # ALTER TABLE не принимает CURRENT_TIMESTAMP по умолчанию, заполняем отдельно
+            conn.execute(f'ALTER TABLE users ADD COLUMN {name} TIMESTAMP')
+            conn.execute(f'UPDATE users SET {name} = CURRENT_TIMESTAMP')
+
+def _create_geocodes(conn):
+    """Координаты городов (заполняются из ответов API погоды)"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS geocodes (
+        query TEXT PRIMARY KEY,
+        city_id INTEGER,
+        name TEXT NOT NULL,
+        country TEXT,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+def _drop_redundant_user_index(conn):
+    """idx_user_id дублирует первичный ключ и только замедляет запись"""
+    conn.execute('DROP INDEX IF EXISTS idx_user_id')
+
+USER_STATS_TRIGGERS = ('users_stats_insert', 'users_stats_delete', 'users_stats_city')
+
+def city_key_sql(row):
+    """Ключ города в city_counts: id города, а для строк без city_id - название"""
+    return f"COALESCE('id:' || {row}.city_id, 'name:' || {row}.city)"
+
+def create_user_stats_triggers(conn):
+    """Триггеры на users, которые ведут stats_counters и city_counts при каждом изменении строки"""
+    city_added = f'''
+        INSERT INTO city_counts (key, city, users) SELECT {city_key_sql('NEW')}, NEW.city, 1
+        WHERE {city_key_sql('NEW')} IS NOT NULL
+        ON CONFLICT(key) DO UPDATE SET users = users + 1;
+    '''
+    city_removed = f'''
+        UPDATE city_counts SET users = users - 1 WHERE key = {city_key_sql('OLD')};
+        DELETE FROM city_counts WHERE key = {city_key_sql('OLD')} AND users <= 0;
+    '''
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS users_stats_insert AFTER INSERT ON users BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'total_users';
+        {city_added}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS users_stats_delete AFTER DELETE ON users BEGIN
+        UPDATE stats_counters SET value = value - 1 WHERE name = 'total_users';
+        {city_removed}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS users_stats_city AFTER UPDATE OF city, city_id ON users
+    WHEN {city_key_sql('OLD')} IS NOT {city_key_sql('NEW')} BEGIN
+        {city_removed}
+        {city_added}
+    END
+    ''')
+
+def _create_user_stats_triggers_v4(conn):
+    """Триггеры миграции 4: city_counts по названию города (копия на момент миграции)"""
+    city_added = '''
+        INSERT INTO city_counts (city, users) SELECT NEW.city, 1 WHERE NEW.city IS NOT NULL
+        ON CONFLICT(city) DO UPDATE SET users = users + 1;
+    '''
+    city_removed = '''
+        UPDATE city_counts SET users = users - 1 WHERE city = OLD.city;
+        DELETE FROM city_counts WHERE city = OLD.city AND users <= 0;
+    '''
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS users_stats_insert AFTER INSERT ON users BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'total_users';
+        {city_added}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS users_stats_delete AFTER DELETE ON users BEGIN
+        UPDATE stats_counters SET value = value - 1 WHERE name = 'total_users';
+        {city_removed}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS users_stats_city AFTER UPDATE OF city ON users
+    WHEN OLD.city IS NOT NEW.city BEGIN
+        {city_removed}
+        {city_added}
+    END
+    ''')
+
+def _create_stats_counters(conn):
+    """Счетчики пользователей и городов, которые поддерживают триггеры: статистика без COUNT по users"""
+    conn.execute('CREATE TABLE IF NOT EXISTS stats_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+    conn.execute('CREATE TABLE IF NOT EXISTS city_counts (city TEXT PRIMARY KEY, users INTEGER NOT NULL)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_city_counts_users ON city_counts(users)')
+
+    # Начальные значения считаем один раз, дальше их меняют только триггеры
+    conn.execute('DELETE FROM city_counts')
+    conn.execute('INSERT INTO city_counts (city, users) SELECT city, COUNT(*) FROM users WHERE city IS NOT NULL GROUP BY city')
+    conn.execute("INSERT OR REPLACE INTO stats_counters VALUES ('total_users', (SELECT COUNT(*) FROM users))")
+    conn.execute("INSERT OR REPLACE INTO stats_counters VALUES ('unique_cities', (SELECT COUNT(*) FROM city_counts))")
+
+    _create_user_stats_triggers_v4(conn)
+    _create_city_counts_triggers(conn)
+
+def _create_city_counts_triggers(conn):
+    """unique_cities - число строк city_counts"""
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS city_counts_insert AFTER INSERT ON city_counts BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'unique_cities';
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS city_counts_delete AFTER DELETE ON city_counts BEGIN
+        UPDATE stats_counters SET value = value - 1 WHERE name = 'unique_cities';
+    END
+    ''')
+
+def _create_cities(conn):
+    """Нормализованные города: id OpenWeatherMap, варианты написания и ссылка на город из users"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS cities (
+        city_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        country TEXT,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS city_aliases (
+        alias TEXT PRIMARY KEY,
+        city_id INTEGER NOT NULL REFERENCES cities(city_id)
+    )
+    ''')
+
+    # Координаты с id города переезжают из geocodes; записи без id будут получены заново
+    if _columns(conn, 'geocodes'):
+        conn.execute('''
+            INSERT OR REPLACE INTO cities (city_id, name, country, lat, lon, updated_at)
+            SELECT city_id, name, country, lat, lon, updated_at FROM geocodes WHERE city_id IS NOT NULL
+        ''')
+        conn.execute('''
+            INSERT OR REPLACE INTO city_aliases (alias, city_id)
+            SELECT query, city_id FROM geocodes WHERE city_id IS NOT NULL
+        ''')
+        conn.execute('DROP TABLE geocodes')
+
+    if 'city_id' not in _columns(conn, 'users'):
+        conn.execute('ALTER TABLE users ADD COLUMN city_id INTEGER REFERENCES cities(city_id)')
+
+    # Известные написания заменяем официальным названием: статистика считает города, а не варианты ввода
+    aliases = {
+        alias: (city_id, name) for alias, city_id, name in conn.execute(
+            'SELECT alias, city_id, name FROM city_aliases JOIN cities USING (city_id)'
+        )
+    }
+    resolved = 0
+    for (city,) in conn.execute('SELECT DISTINCT city FROM users WHERE city IS NOT NULL AND city_id IS NULL').fetchall():
+        match = aliases.get(_normalize_city_v5(city))
+        if match is not None:
+            resolved += conn.execute(
+                'UPDATE users SET city_id = ?, city = ? WHERE city = ? AND city_id IS NULL', match + (city,)
+            ).rowcount
+    if resolved:
+        logger.info(f"🏙️ Привязано к городам пользователей: {resolved}")
+
+def _count_cities_by_id(conn):
+    """city_counts по id города: одно название у разных городов не сливается, а написания одного - не дробятся"""
+    for name in USER_STATS_TRIGGERS:
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    # вместе с таблицей удаляются и ее триггеры city_counts_insert/delete
+    conn.execute('DROP TABLE IF EXISTS city_counts')
+    conn.execute('CREATE TABLE city_counts (key TEXT PRIMARY KEY, city TEXT, users INTEGER NOT NULL)')
+    conn.execute('CREATE INDEX idx_city_counts_users ON city_counts(users)')
+
+    conn.execute(f'''
+        INSERT INTO city_counts (key, city, users)
+        SELECT {city_key_sql('users')} AS key, MAX(city), COUNT(*) FROM users
+        WHERE key IS NOT NULL GROUP BY key
+    ''')
+    conn.execute("INSERT OR REPLACE INTO stats_counters VALUES ('unique_cities', (SELECT COUNT(*) FROM city_counts))")
+
+    create_user_stats_triggers(conn)
+    _create_city_counts_triggers(conn)
+
+def rebuild_user_stats(conn):
+    """Пересчитывает счетчики по users и заново создает триггеры статистики последней версии.
+
+    Для базы последней версии, у которой пересоздавалась таблица users (fix_database.py):
+    вместе с таблицей удаляются и ее триггеры.
+    """
+    for name in USER_STATS_TRIGGERS:
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    conn.execute('DELETE FROM city_counts')
+    conn.execute(f'''
+        INSERT INTO city_counts (key, city, users)
+        SELECT {city_key_sql('users')} AS key, MAX(city), COUNT(*) FROM users
+        WHERE key IS NOT NULL GROUP BY key
+    ''')
+    conn.execute("INSERT OR REPLACE INTO stats_counters VALUES ('total_users', (SELECT COUNT(*) FROM users))")
+    conn.execute("INSERT OR REPLACE INTO stats_counters VALUES ('unique_cities', (SELECT COUNT(*) FROM city_counts))")
+    create_user_stats_triggers(conn)
+
+# (версия, описание, функция). Новые миграции только добавляются в конец;
+# каждая должна корректно отработать и на базе, созданной до появления версий.
+MIGRATIONS = [
+    (1, 'таблица users', _create_users),
+    (2, 'таблица geocodes', _create_geocodes),
+    (3, 'удаление лишнего индекса idx_user_id', _drop_redundant_user_index),
+    (4, 'счетчики статистики и городов', _create_stats_counters),
+    (5, 'таблицы cities и city_aliases, users.city_id', _create_cities),
+    (6, 'city_counts по id города', _count_cities_by_id),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn) -> int:
+    """Применяет недостающие миграции по порядку; возвращает число примененных.
+
+    Каждая миграция выполняется в своей транзакции вместе с повышением user_version,
+    поэтому прерванный запуск продолжится с той же миграции.
+    """
+    version = get_version(conn)
+    if version >= LATEST_VERSION:
+        return 0
+
+    applied = 0
+    for target, description, apply in MIGRATIONS:
+        if target <= version:
+            continue
+        logger.info(f"🛠️ Миграция {target}: {description}")
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            apply(conn)
+            conn.execute(f'PRAGMA user_version = {target}')
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied += 1
+    return applied
@@ -0,0 +1,134 @@
+"""
+Ограничение частоты и параллельности запросов к внешним API
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: чем меньше число, тем раньше запрос получит слот
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+class QuotaExceeded(Exception):
+    """Запрос не дождался слота в очереди до своего дедлайна"""
+
+class QuotaGovernor:
+    """Token bucket на число вызовов в минуту плюс ограничение числа одновременных запросов.
+
+    Ожидающие запросы обслуживаются по приоритету, внутри одного приоритета - по очереди.
+    """
+
+    def __init__(self, calls_per_minute: int, max_in_flight: int, queue_timeout: float, burst: int = None):
+        self.rate = calls_per_minute / 60.0  # токенов в секунду
+        self.capacity = float(burst or calls_per_minute)
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._waiters = []  # куча (приоритет, порядковый номер, future)
+        self._seq = itertools.count()
+        self._wakeup = None
+
+        self.granted = 0
+        self.rejected = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _dispatch(self):
+        """Раздает слоты ожидающим, пока есть токены и свободные места"""
+        self._refill()
+        while self._waiters:
+            fut = self._waiters[0][2]
+            if fut.done():
+                # ожидающий уже ушел по дедлайну
+                heapq.heappop(self._waiters)
+                continue
+            if self._in_flight >= self.max_in_flight:
+                return
+            if self._tokens < 1:
+                self._schedule_wakeup((1 - self._tokens) / self.rate)
+                return
+
+            heapq.heappop(self._waiters)
+            self._tokens -= 1
+            self._in_flight += 1
+            self.granted += 1
+            fut.set_result(None)
+
+    def _schedule_wakeup(self, delay: float):
+        if self._wakeup is None:
+            loop = asyncio.get_running_loop()
+            self._wakeup = loop.call_later(delay, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE, timeout: float = None):
+        """Ждет слот не дольше timeout секунд, иначе бросает QuotaExceeded"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._dispatch()
+
+        if fut.done():
+            return
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning(f"⏳ Запрос не дождался квоты API за {timeout} с (в очереди: {len(self._waiters)})")
+            raise QuotaExceeded(f"нет свободной квоты в течение {timeout} с") from None
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # слот успели выдать, но вызывающий отменен - возвращаем его
+                self.release()
+            raise
+
+    def try_take(self) -> bool:
+        """Забирает токен без ожидания; False, если токенов нет или перед нами есть очередь.
+
+        Слот одновременных запросов не занимается: для вызовов, которые выполняем не мы
+        (например, метод в ответе на webhook выполняет сам Telegram).
+        """
+        self._refill()
+        if self._tokens < 1 or any(not fut.done() for _, _, fut in self._waiters):
+            return False
+        self._tokens -= 1
+        self.granted += 1
+        return True
+
+    def release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE, timeout: float = None):
+        await self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        self._refill()
+        return {
+            'calls_per_minute': round(self.rate * 60),
+            'tokens': round(self._tokens, 2),
+            'in_flight': self._in_flight,
+            'max_in_flight': self.max_in_flight,
+            'queued': sum(1 for _, _, fut in self._waiters if not fut.done()),
+            'granted': self.granted,
+            'rejected': self.rejected,
+        }
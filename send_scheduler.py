@@ -0,0 +1,159 @@
+"""
+Исходящие запросы к Telegram: общий планировщик с учетом лимитов Bot API
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, EditMessageText, SendMessage
+
+import config
+from metrics import LatencyWindow
+from rate_limit import QuotaGovernor, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+# Методы, которые идут через планировщик; остальные (getMe, setWebhook...) - напрямую
+SCHEDULED_METHODS = (SendMessage, EditMessageText, AnswerCallbackQuery)
+
+# Приоритет отправок в текущей задаче: ответы пользователям по умолчанию, рассылки - в bulk()
+_priority = ContextVar('send_priority', default=PRIORITY_INTERACTIVE)
+
+@contextmanager
+def bulk():
+    """Отправки внутри блока (рассылки) уступают общий бюджет ответам пользователям"""
+    token = _priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class SendScheduler(BaseRequestMiddleware):
+    """Сообщения ждут своей очереди здесь, а не получают 429 от Telegram.
+
+    Telegram допускает около TELEGRAM_GLOBAL_RATE сообщений в секунду на бота,
+    около одного сообщения в секунду в личный чат (с небольшими всплесками)
+    и TELEGRAM_GROUP_PER_MINUTE в минуту в группу. Общий бюджет - QuotaGovernor
+    с приоритетами, лимит чата - расписание GCRA: для каждого чата хранится только
+    время, раньше которого следующее сообщение отправлять не стоит.
+    answerCallbackQuery не сообщение в чат и ограничивается только общим бюджетом.
+    """
+
+    def __init__(self, global_rate=None, chat_rate=None, chat_burst=None, group_per_minute=None,
+                 max_in_flight=None, timeout=None):
+        global_rate = config.TELEGRAM_GLOBAL_RATE if global_rate is None else global_rate
+        self.governor = QuotaGovernor(
+            calls_per_minute=global_rate * 60,
+            max_in_flight=config.TELEGRAM_MAX_IN_FLIGHT if max_in_flight is None else max_in_flight,
+            queue_timeout=config.TELEGRAM_SEND_TIMEOUT if timeout is None else timeout,
+            burst=global_rate,
+        )
+        self.chat_interval = 1 / (config.TELEGRAM_CHAT_RATE if chat_rate is None else chat_rate)
+        self.group_interval = 60 / (config.TELEGRAM_GROUP_PER_MINUTE if group_per_minute is None else group_per_minute)
+        self.chat_burst = config.TELEGRAM_CHAT_BURST if chat_burst is None else chat_burst
+        self._chat_next = {}  # chat_id -> теоретическое время следующей отправки (GCRA)
+        self._reservations = 0
+        self.chat_waiting = 0
+        self.sent = 0
+        self.retry_after = 0
+        self.webhook_replies = 0
+        self.wait = LatencyWindow()  # от вызова метода до отправки запроса
+
+    def _interval(self, chat_id):
+        # отрицательные id и @username - группы и каналы
+        return self.chat_interval if isinstance(chat_id, int) and chat_id > 0 else self.group_interval
+
+    def _slot(self, chat_id, now: float):
+        """(время, раньше которого отправлять в чат нельзя; новое теоретическое время чата)"""
+        interval = self._interval(chat_id)
+        tat = max(now, self._chat_next.get(chat_id, now))
+        return max(now, tat - (self.chat_burst - 1) * interval), tat + interval
+
+    def _reserve(self, chat_id) -> float:
+        """Занимает место в расписании чата; возвращает, сколько секунд ждать"""
+        now = time.monotonic()
+        send_at, self._chat_next[chat_id] = self._slot(chat_id, now)
+
+        self._reservations += 1
+        if self._reservations % 1000 == 0:
+            # чаты, расписание которых уже в прошлом, ничем не ограничены: забываем их
+            self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+        return send_at - now
+
+    def _postpone(self, chat_id, seconds: float):
+        """Telegram попросил подождать: следующая отправка в чат - не раньше чем через seconds"""
+        # запас на всплеск добавляем, иначе _reserve разрешит отправку сразу
+        tat = time.monotonic() + seconds + (self.chat_burst - 1) * self._interval(chat_id)
+        self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0), tat)
+
+    @staticmethod
+    def _chat_id(method):
+        return None if isinstance(method, AnswerCallbackQuery) else method.chat_id
+
+    def reserve_now(self, method) -> bool:
+        """Можно ли отдать метод прямо сейчас ответом на webhook, не нарушая лимитов.
+
+        Такой ответ Telegram выполняет сам, поэтому он занимает место в общем бюджете
+        и в расписании чата без ожидания. Если сейчас отправлять нельзя, метод
+        уйдет обычным запросом через планировщик.
+        """
+        if not isinstance(method, SCHEDULED_METHODS):
+            return False
+        chat_id = self._chat_id(method)
+        now = time.monotonic()
+        if chat_id is not None and self._slot(chat_id, now)[0] > now:
+            return False
+        if not self.governor.try_take():
+            return False
+        if chat_id is not None:
+            self._reserve(chat_id)
+        self.webhook_replies += 1
+        return True
+
+    async def _send(self, make_request, bot, method, chat_id, priority):
+        queued = time.monotonic()
+        if chat_id is not None:
+            delay = self._reserve(chat_id)
+            if delay > 0:
+                self.chat_waiting += 1
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self.chat_waiting -= 1
+        async with self.governor.slot(priority):
+            self.wait.add(time.monotonic() - queued)
+            self.sent += 1
+            return await make_request(bot, method)
+
+    async def __call__(self, make_request, bot, method):
+        if not isinstance(method, SCHEDULED_METHODS):
+            return await make_request(bot, method)
+        chat_id = self._chat_id(method)
+        priority = _priority.get()
+        try:
+            return await self._send(make_request, bot, method, chat_id, priority)
+        except TelegramRetryAfter as e:
+            # расписание разошлось с реальным лимитом: ждем и повторяем один раз
+            self.retry_after += 1
+            logger.warning(f"⏳ Telegram просит подождать {e.retry_after} с (чат {chat_id})")
+            if chat_id is not None:
+                self._postpone(chat_id, e.retry_after)
+            else:
+                await asyncio.sleep(e.retry_after)
+            return await self._send(make_request, bot, method, chat_id, priority)
+
+    def stats(self):
+        return dict(
+            self.governor.stats(),
+            chats=len(self._chat_next),
+            chat_waiting=self.chat_waiting,
+            sent=self.sent,
+            retry_after=self.retry_after,
+            webhook_replies=self.webhook_replies,
+            wait=self.wait.stats(),
+        )
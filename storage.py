@@ -0,0 +1,393 @@
+"""
+Хранилища данных бота: города пользователей, справочник городов и статистика.
+
+Бэкенд выбирается в config.STORAGE_BACKEND:
+  sqlite - локальный файл SQLite (database.py), один экземпляр бота;
+  memory - словари в памяти процесса, для тестов и нагрузочных замеров;
+  kv     - сетевое key-value хранилище (см. kv_server.py), общее для нескольких экземпляров.
+
+Методы синхронные: из обработчиков они вызываются через async_db в отдельных потоках.
+"""
+
+import http.client
+import json
+import logging
+import threading
+import time
+import urllib.parse
+
+import config
+import database as db
+
+logger = logging.getLogger(__name__)
+
+def _timestamp(seconds):
+    """Время в формате CURRENT_TIMESTAMP SQLite (UTC)"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds))
+
+def _city_key(city, city_id):
+    """Ключ счетчика города: id города, а без id - название (как migrations.city_key_sql)"""
+    if city_id is not None:
+        return f'id:{city_id}'
+    return None if city is None else f'name:{city}'
+
+class StorageError(Exception):
+    """Хранилище недоступно или ответило ошибкой"""
+
+class StorageBackend:
+    """Общий интерфейс хранилищ"""
+
+    name = None
+    # данные могут менять другие экземпляры бота: кэшировать их в процессе нельзя
+    shared = False
+
+    def init(self):
+        """Готовит хранилище к работе (схема, соединения)"""
+
+    def close(self):
+        """Закрывает соединения"""
+
+    def get_user_city(self, user_id):
+        raise NotImplementedError
+
+    def set_user_city(self, user_id, city, username=None, first_name=None, city_id=None):
+        raise NotImplementedError
+
+    def set_user_cities(self, rows):
+        """rows - [(user_id, city, username, first_name, city_id)]"""
+        for row in rows:
+            self.set_user_city(*row)
+
+    def get_recent_user_cities(self, limit):
+        """[(user_id, city)] последних активных пользователей для прогрева кэша.
+
+        Пустой список, если бэкенд не может найти их без обхода всех пользователей.
+        """
+        raise NotImplementedError
+
+    def get_user_stats(self):
+        """{'total_users': ..., 'unique_cities': ...}"""
+        raise NotImplementedError
+
+    def get_top_cities(self, limit=10):
+        """[(город, число пользователей)]"""
+        raise NotImplementedError
+
+    def iter_users(self, after_id=0, batch=10000):
+        """Пользователи после after_id пачками по batch: списки [(поля db.USER_FIELDS)].
+
+        Порядок (у SQLite и memory - по возрастанию user_id) постоянен для бэкенда,
+        поэтому прерванный обход продолжается с user_id последней выданной строки.
+        """
+        raise NotImplementedError
+
+    def import_users(self, rows):
+        """Загружает пользователей из выгрузки: rows - [(поля db.USER_FIELDS)].
+
+        По умолчанию через set_user_cities: даты создания и изменения не переносятся.
+        """
+        self.set_user_cities([
+            (user_id, city, username, first_name, city_id)
+            for user_id, city, city_id, username, first_name, _, _ in rows
+        ])
+
+    def save_city(self, city_id, name, country, lat, lon, aliases=()):
+        """Город по id OpenWeatherMap и нормализованные варианты его названия"""
+        raise NotImplementedError
+
+    def get_city_aliases(self):
+        """[(alias, city_id, name, country, lat, lon)]"""
+        raise NotImplementedError
+
+class SQLiteStorage(StorageBackend):
+    """Файл SQLite через database.py"""
+
+    name = 'sqlite'
+
+    def __init__(self, path=None):
+        self.path = path or db.DB_PATH
+
+    def init(self):
+        db.DB_PATH = self.path
+        db.init_db()
+
+    def close(self):
+        db.close_db()
+
+    def get_user_city(self, user_id):
+        return db.get_user_city(user_id)
+
+    def set_user_city(self, user_id, city, username=None, first_name=None, city_id=None):
+        db.set_user_city(user_id, city, username, first_name, city_id)
+
+    def set_user_cities(self, rows):
+        db.set_user_cities(rows)
+
+    def get_recent_user_cities(self, limit):
+        return db.get_recent_user_cities(limit)
+
+    def get_user_stats(self):
+        return db.get_user_stats()
+
+    def get_top_cities(self, limit=10):
+        return db.get_top_cities(limit)
+
+    def iter_users(self, after_id=0, batch=10000):
+        while True:
+            rows = db.get_users_page(after_id, batch)
+            if not rows:
+                return
+            yield rows
+            after_id = rows[-1][0]
+
+    def import_users(self, rows):
+        db.import_users(rows)
+
+    def save_city(self, city_id, name, country, lat, lon, aliases=()):
+        db.save_city(city_id, name, country, lat, lon, aliases)
+
+    def get_city_aliases(self):
+        return db.get_city_aliases()
+
+class MemoryStorage(StorageBackend):
+    """Данные в памяти процесса; пропадают при перезапуске"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}  # user_id -> (city, username, first_name, updated_at, city_id)
+        self._city_counts = {}  # ключ города (_city_key) -> [название, число пользователей]
+        self._cities = {}  # city_id -> (name, country, lat, lon)
+        self._aliases = {}  # alias -> city_id
+
+    def get_user_city(self, user_id):
+        user = self._users.get(user_id)
+        return user[0] if user else None
+
+    def set_user_city(self, user_id, city, username=None, first_name=None, city_id=None):
+        with self._lock:
+            old = self._users.get(user_id)
+            self._users[user_id] = (city, username, first_name, time.time(), city_id)
+            self._move_city(_city_key(old[0], old[4]) if old else None, _city_key(city, city_id), city)
+
+    def _move_city(self, old_key, new_key, new_city):
+        if old_key == new_key:
+            return
+        if old_key is not None:
+            counter = self._city_counts[old_key]
+            counter[1] -= 1
+            if not counter[1]:
+                del self._city_counts[old_key]
+        if new_key is not None:
+            self._city_counts.setdefault(new_key, [new_city, 0])[1] += 1
+
+    def get_recent_user_cities(self, limit):
+        with self._lock:
+            users = sorted(self._users.items(), key=lambda item: item[1][3], reverse=True)
+        return [(user_id, user[0]) for user_id, user in users[:limit]]
+
+    def get_user_stats(self):
+        return {'total_users': len(self._users), 'unique_cities': len(self._city_counts)}
+
+    def get_top_cities(self, limit=10):
+        with self._lock:
+            counts = [tuple(counter) for counter in self._city_counts.values()]
+        return sorted(counts, key=lambda item: item[1], reverse=True)[:limit]
+
+    def iter_users(self, after_id=0, batch=10000):
+        with self._lock:
+            users = sorted(item for item in self._users.items() if item[0] > after_id)
+        for start in range(0, len(users), batch):
+            yield [
+                (user_id, city, city_id, username, first_name, None, _timestamp(updated_at))
+                for user_id, (city, username, first_name, updated_at, city_id) in users[start:start + batch]
+            ]
+
+    def save_city(self, city_id, name, country, lat, lon, aliases=()):
+        with self._lock:
+            self._cities[city_id] = (name, country, lat, lon)
+            for alias in aliases:
+                self._aliases[alias] = city_id
+
+    def get_city_aliases(self):
+        with self._lock:
+            return [(alias, city_id) + self._cities[city_id] for alias, city_id in self._aliases.items()]
+
+class KVStorage(StorageBackend):
+    """Сетевое key-value хранилище по HTTP (протокол описан в kv_server.py).
+
+    Ключи:
+      user:<id>              - {"city", "city_id", "username", "first_name", "updated_at"}
+      citycount:id:<city_id> - число пользователей города (без city_id - citycount:name:<город>)
+      cityname:id:<city_id>  - название города для citycount:id:<city_id>
+      counter:<имя>          - total_users, unique_cities
+      city:<city_id>         - [name, country, lat, lon]
+      alias:<написание>      - city_id
+
+    Замена профиля возвращает прежнее значение атомарно на сервере, а счетчики
+    меняются атомарным incr, поэтому статистика сходится и при нескольких экземплярах бота.
+    """
+
+    name = 'kv'
+    shared = True
+
+    def __init__(self, url=None, timeout=None):
+        parsed = urllib.parse.urlsplit(url or config.KV_URL)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.prefix = parsed.path.rstrip('/')
+        self.timeout = config.KV_TIMEOUT if timeout is None else timeout
+        self._local = threading.local()  # keep-alive соединение на поток
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    # Соединение, простоявшее дольше этого, открываем заново: сервер мог его уже закрыть
+    IDLE_REUSE = 30  # секунд
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and time.monotonic() - self._local.used > self.IDLE_REUSE:
+            conn.close()
+            conn = None
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        self._local.used = time.monotonic()
+        return conn
+
+    def _request(self, method, path, body=None):
+        data = None if body is None else json.dumps(body).encode()
+        headers = {'Content-Type': 'application/json'} if data is not None else {}
+        # повторяем только чтение: запись могла дойти до сервера до обрыва соединения
+        attempts = 2 if method == 'GET' else 1
+        for attempt in range(attempts):
+            conn = self._connection()
+            try:
+                conn.request(method, self.prefix + path, body=data, headers=headers)
+                response = conn.getresponse()
+                payload = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                self._local.conn = None
+                if attempt + 1 < attempts:
+                    continue
+                raise StorageError(f"KV {method} {path}: {e!r}") from e
+            if response.status == 404:
+                return None
+            if response.status >= 400:
+                raise StorageError(f"KV {method} {path}: HTTP {response.status}")
+            return json.loads(payload) if payload else None
+
+    @staticmethod
+    def _key(*parts):
+        return '/kv/' + urllib.parse.quote(':'.join(str(p) for p in parts), safe='')
+
+    def _incr(self, key, by):
+        return self._request('POST', key + '/incr', {'by': by})['value']
+
+    def _scan(self, prefix):
+        result = self._request('GET', '/scan?prefix=' + urllib.parse.quote(prefix, safe=''))
+        return result or {}
+
+    def _scan_pages(self, prefix, limit, after=None):
+        """Ключи с префиксом страницами по limit в порядке ключей, начиная после ключа after"""
+        while True:
+            path = f"/scan?prefix={urllib.parse.quote(prefix, safe='')}&limit={limit}"
+            if after is not None:
+                path += '&after=' + urllib.parse.quote(after, safe='')
+            page = self._request('GET', path) or {}
+            if page:
+                yield page
+            if len(page) < limit:
+                return
+            after = next(reversed(page))
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+    def get_user_city(self, user_id):
+        user = self._request('GET', self._key('user', user_id))
+        return user['value']['city'] if user else None
+
+    def set_user_city(self, user_id, city, username=None, first_name=None, city_id=None):
+        new = {'city': city, 'city_id': city_id, 'username': username, 'first_name': first_name, 'updated_at': time.time()}
+        old = self._request('PUT', self._key('user', user_id), {'value': new})['previous']
+        if old is None:
+            self._incr(self._key('counter', 'total_users'), 1)
+        old_key = _city_key(old['city'], old.get('city_id')) if old else None
+        new_key = _city_key(city, city_id)
+        if old_key == new_key:
+            return
+        if old_key is not None and self._incr(self._key('citycount', old_key), -1) == 0:
+            self._incr(self._key('counter', 'unique_cities'), -1)
+        if new_key is not None and self._incr(self._key('citycount', new_key), 1) == 1:
+            self._incr(self._key('counter', 'unique_cities'), 1)
+            if city_id is not None:
+                self._request('PUT', self._key('cityname', new_key), {'value': city})
+
+    def get_recent_user_cities(self, limit):
+        # последних активных не найти без обхода всех ключей user:, а прогрев идет
+        # при каждом запуске и замене процесса: кэш заполняется по мере запросов
+        return []
+
+    def get_user_stats(self):
+        counters = self._scan('counter:')
+        return {
+            'total_users': counters.get('counter:total_users', 0),
+            'unique_cities': counters.get('counter:unique_cities', 0),
+        }
+
+    def get_top_cities(self, limit=10):
+        counts = [(key.split(':', 1)[1], users) for key, users in self._scan('citycount:').items() if users > 0]
+        top = sorted(counts, key=lambda item: item[1], reverse=True)[:limit]
+        names = self._scan('cityname:') if any(key.startswith('id:') for key, _ in top) else {}
+        return [
+            (names.get(f'cityname:{key}') if key.startswith('id:') else key.split(':', 1)[1], users)
+            for key, users in top
+        ]
+
+    def iter_users(self, after_id=0, batch=10000):
+        # страницы идут в порядке ключей user:<id> (как строк), а не по возрастанию user_id;
+        # продолжение после after_id идет в том же порядке, поэтому выгрузку можно возобновить
+        after = f'user:{after_id}' if after_id else None
+        for page in self._scan_pages('user:', batch, after):
+            yield [
+                (int(key.split(':', 1)[1]), user['city'], user.get('city_id'), user['username'],
+                 user['first_name'], None, _timestamp(user['updated_at']))
+                for key, user in page.items()
+            ]
+
+    def save_city(self, city_id, name, country, lat, lon, aliases=()):
+        # сначала город, потом написания: читатель не увидит написание без города
+        self._request('PUT', self._key('city', city_id), {'value': [name, country, lat, lon]})
+        for alias in aliases:
+            self._request('PUT', self._key('alias', alias), {'value': city_id})
+
+    def get_city_aliases(self):
+        cities = {int(key.split(':', 1)[1]): value for key, value in self._scan('city:').items()}
+        return [
+            (key.split(':', 1)[1], city_id) + tuple(cities[city_id])
+            for key, city_id in self._scan('alias:').items() if city_id in cities
+        ]
+
+BACKENDS = {
+    SQLiteStorage.name: SQLiteStorage,
+    MemoryStorage.name: MemoryStorage,
+    KVStorage.name: KVStorage,
+}
+
+def create_storage(name=None):
+    """Хранилище по имени бэкенда (по умолчанию из config.STORAGE_BACKEND)"""
+    name = (name or config.STORAGE_BACKEND).lower()
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"❌ Неизвестный STORAGE_BACKEND: {name} (доступны: {', '.join(BACKENDS)})")
+    logger.info(f"🗄️ Хранилище данных: {name}")
+    return backend()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Тест отложенной записи городов (async_db, PROFILE_WRITE_BEHIND): ошибки, отмена flush и остановка
+"""
+
+import asyncio
+import os
+import sys
+import threading
+
+# Добавляем путь для импорта модулей бота
+sys.path.append('.')
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ.setdefault('WEATHER_API_KEY', 'test')
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+
+import async_db
+import config
+from storage import MemoryStorage
+
+class GatedStorage(MemoryStorage):
+    """Хранилище, в котором запись пачки ждет gate и падает, пока fail=True"""
+
+    def __init__(self):
+        super().__init__()
+        self.fail = False
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def set_user_cities(self, rows):
+        self.entered.set()
+        self.gate.wait()
+        if self.fail:
+            raise OSError("database is locked")
+        super().set_user_cities(rows)
+
+class WriteBehind:
+    """Включает PROFILE_WRITE_BEHIND с GatedStorage и возвращает async_db в исходное состояние"""
+
+    def __enter__(self):
+        self._saved = (config.PROFILE_WRITE_BEHIND, config.PROFILE_FLUSH_INTERVAL, async_db.storage)
+        # flush только явный: фоновая запись по таймеру не вмешивается в тест
+        config.PROFILE_WRITE_BEHIND, config.PROFILE_FLUSH_INTERVAL = True, 3600
+        async_db.storage = GatedStorage()
+        async_db.storage.init()
+        async_db.start()
+        return async_db.storage
+
+    def __exit__(self, *exc):
+        async_db.shutdown()
+        async_db.start()
+        async_db._pending, async_db._flushing = {}, {}
+        async_db._flush_write = async_db._flush_task = None
+        async_db.profiles.clear()
+        config.PROFILE_WRITE_BEHIND, config.PROFILE_FLUSH_INTERVAL, async_db.storage = self._saved
+
+async def failed_batch(store):
+    await async_db.set_user_city(1, 'Москва')
+    await async_db.set_user_city(2, 'Казань')
+    store.fail = True
+    assert await async_db.flush() == 0
+    assert async_db._pending == {1: (1, 'Москва', None, None, None), 2: (2, 'Казань', None, None, None)}
+    assert async_db._flushing == {}
+
+    store.fail = False
+    assert await async_db.flush() == 2
+    assert async_db._pending == {}
+    assert store.get_user_city(1) == 'Москва' and store.get_user_city(2) == 'Казань'
+
+def test_failed_batch_requeued():
+    """Пачка, которую не удалось записать, возвращается в _pending и пишется следующим flush"""
+    with WriteBehind() as store:
+        asyncio.run(failed_batch(store))
+
+async def cancelled_flush(store):
+    await async_db.set_user_city(1, 'Москва')
+    await async_db.set_user_city(2, 'Казань')
+    store.gate.clear()
+    store.fail = True
+    flush = asyncio.ensure_future(async_db.flush())
+    while not store.entered.is_set():
+        await asyncio.sleep(0.01)
+
+    flush.cancel()
+    try:
+        await flush
+    except asyncio.CancelledError:
+        pass
+    else:
+        raise AssertionError("flush не отменен")
+    # пачка пишется дальше: ее строки видны и не потеряны
+    assert set(async_db._flushing) == {1, 2}
+    assert await async_db.get_user_city(2) == 'Казань'
+    await async_db.set_user_city(1, 'Омск')  # изменение во время записи пачки
+
+    store.gate.set()
+    # следующий flush ждет отмененную пачку; она падает и возвращается в очередь,
+    # не затирая более новое изменение
+    assert await async_db.flush() == 0
+    assert async_db._pending == {1: (1, 'Омск', None, None, None), 2: (2, 'Казань', None, None, None)}
+
+    store.fail = False
+    assert await async_db.flush() == 2
+    assert store.get_user_city(1) == 'Омск' and store.get_user_city(2) == 'Казань'
+
+def test_cancelled_flush_keeps_rows():
+    """Отмена flush во время записи не теряет пачку"""
+    with WriteBehind() as store:
+        asyncio.run(cancelled_flush(store))
+
+async def close_with_pending(store):
+    for user_id in range(1, 4):
+        await async_db.set_user_city(user_id, f'Город {user_id}')
+    assert store.get_user_stats()['total_users'] == 0
+    await async_db.close()
+    assert async_db._pending == {}
+    assert [store.get_user_city(user_id) for user_id in range(1, 4)] == ['Город 1', 'Город 2', 'Город 3']
+
+def test_close_flushes_pending():
+    """close() записывает отложенные изменения до остановки потоков"""
+    with WriteBehind() as store:
+        asyncio.run(close_with_pending(store))
+
+if __name__ == "__main__":
+    print("🗄️ Тест отложенной записи городов")
+    test_failed_batch_requeued()
+    print("✅ Неудачная пачка возвращается в очередь")
+    test_cancelled_flush_keeps_rows()
+    print("✅ Отмененный flush не теряет пачку")
+    test_close_flushes_pending()
+    print("✅ close() записывает отложенные изменения")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Тест кэша с мягким и жестким сроком жизни (cache.TTLCache)
+"""
+
+import sys
+from types import SimpleNamespace
+
+# Добавляем путь для импорта модулей бота
+sys.path.append('.')
+
+import cache
+from cache import TTLCache
+
+class FakeClock:
+    """Подменяет time.monotonic в cache"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __enter__(self):
+        self._time = cache.time
+        cache.time = SimpleNamespace(monotonic=lambda: self.now)
+        return self
+
+    def __exit__(self, *exc):
+        cache.time = self._time
+
+def test_soft_and_hard_ttl():
+    """До soft_ttl запись свежая, до ttl - отдается с пометкой обновить, после ttl - промах"""
+    with FakeClock() as clock:
+        weather = TTLCache(ttl=1200, max_size=10, soft_ttl=600)
+        weather.set('москва', 'ясно')
+
+        clock.now += 600
+        assert weather.lookup('москва') == ('ясно', False)
+        clock.now += 1
+        assert weather.lookup('москва') == ('ясно', True)
+        clock.now += 600
+        assert weather.lookup('москва') is None
+
+        # устаревшая запись остается запасным ответом
+        assert weather.get_stale('москва') == ('ясно', 1201)
+        stats = weather.stats()
+        assert (stats['hits'], stats['soft_hits'], stats['misses']) == (2, 1, 1)
+
+def test_lru_eviction():
+    """При переполнении вытесняется давно не использованная запись"""
+    with FakeClock():
+        weather = TTLCache(ttl=600, max_size=2)
+        weather.set('москва', 1)
+        weather.set('казань', 2)
+        weather.get('москва')
+        weather.set('омск', 3)
+        assert weather.get_stale('казань') is None
+        assert weather.get('москва') == 1 and weather.get('омск') == 3
+
+if __name__ == "__main__":
+    print("🗃️ Тест кэша погоды")
+    test_soft_and_hard_ttl()
+    print("✅ Мягкий и жесткий сроки жизни соблюдаются")
+    test_lru_eviction()
+    print("✅ Вытесняются давно не использованные записи")
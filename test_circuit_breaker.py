@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Тест circuit breaker (circuit_breaker.py): размыкание по доле ошибок и пробные вызовы half-open
+"""
+
+import sys
+from types import SimpleNamespace
+
+# Добавляем путь для импорта модулей бота
+sys.path.append('.')
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, CircuitOpenError, STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN
+
+RESET_TIMEOUT = 30
+
+class FakeClock:
+    """Подменяет time.monotonic в circuit_breaker, чтобы не ждать reset_timeout"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __enter__(self):
+        self._time = circuit_breaker.time
+        circuit_breaker.time = SimpleNamespace(monotonic=lambda: self.now)
+        return self
+
+    def __exit__(self, *exc):
+        circuit_breaker.time = self._time
+
+def make_breaker():
+    return CircuitBreaker('test', failure_ratio=0.5, window=10, min_calls=4, reset_timeout=RESET_TIMEOUT)
+
+def open_breaker(breaker):
+    for _ in range(4):
+        breaker.record_failure(breaker.before_call())
+    assert breaker.state == STATE_OPEN
+
+def raises_open(breaker):
+    try:
+        breaker.before_call()
+    except CircuitOpenError:
+        return True
+    return False
+
+def test_opens_on_failure_ratio():
+    """Размыкается только после min_calls вызовов с долей ошибок не меньше порога"""
+    with FakeClock() as clock:
+        breaker = make_breaker()
+        breaker.record_success(breaker.before_call())
+        breaker.record_failure(breaker.before_call())
+        breaker.record_success(breaker.before_call())
+        assert breaker.state == STATE_CLOSED  # 3 вызова < min_calls
+        breaker.record_failure(breaker.before_call())
+        assert breaker.state == STATE_OPEN  # 2 ошибки из 4
+
+        assert raises_open(breaker)
+        clock.now += RESET_TIMEOUT - 1
+        assert raises_open(breaker)
+        assert breaker.stats()['short_circuited'] == 2
+
+def test_single_probe_in_half_open():
+    """После reset_timeout проходит один пробный вызов, остальные отклоняются"""
+    with FakeClock() as clock:
+        breaker = make_breaker()
+        open_breaker(breaker)
+        clock.now += RESET_TIMEOUT
+        probe = breaker.before_call()
+        assert probe is not None and breaker.state == STATE_HALF_OPEN
+        assert raises_open(breaker)
+
+        breaker.record_success(probe)
+        assert breaker.state == STATE_CLOSED
+        assert breaker.before_call() is None
+
+def test_only_probe_decides_half_open():
+    """Исход вызовов, начатых до размыкания, не замыкает и не размыкает half-open"""
+    with FakeClock() as clock:
+        breaker = make_breaker()
+        stale = breaker.before_call()  # None: вызов начат, пока breaker замкнут
+        open_breaker(breaker)
+        clock.now += RESET_TIMEOUT
+        probe = breaker.before_call()
+
+        breaker.record_success(stale)
+        assert breaker.state == STATE_HALF_OPEN
+        breaker.record_failure(stale)
+        assert breaker.state == STATE_HALF_OPEN
+
+        breaker.record_failure(probe)
+        assert breaker.state == STATE_OPEN
+        assert breaker.stats()['times_opened'] == 2
+
+def test_probe_token_expires_with_half_open():
+    """Токен пробы прошлого half-open не решает исход следующего"""
+    with FakeClock() as clock:
+        breaker = make_breaker()
+        open_breaker(breaker)
+        clock.now += RESET_TIMEOUT
+        old_probe = breaker.before_call()
+        breaker.record_failure(old_probe)
+        assert breaker.state == STATE_OPEN
+
+        clock.now += RESET_TIMEOUT
+        probe = breaker.before_call()
+        breaker.record_success(old_probe)
+        assert breaker.state == STATE_HALF_OPEN
+        breaker.record_success(probe)
+        assert breaker.state == STATE_CLOSED
+
+def test_skipped_probe_frees_slot():
+    """Проба, не дошедшая до API (нет квоты), освобождает слот для следующей"""
+    with FakeClock() as clock:
+        breaker = make_breaker()
+        open_breaker(breaker)
+        clock.now += RESET_TIMEOUT
+        probe = breaker.before_call()
+        assert raises_open(breaker)
+        breaker.record_skipped(probe)
+        assert breaker.state == STATE_HALF_OPEN
+        assert breaker.before_call() is not None
+
+if __name__ == "__main__":
+    print("🔌 Тест circuit breaker")
+    test_opens_on_failure_ratio()
+    print("✅ Размыкается по доле ошибок")
+    test_single_probe_in_half_open()
+    print("✅ В half-open проходит один пробный вызов")
+    test_only_probe_decides_half_open()
+    print("✅ Исход half-open решает только проба")
+    test_probe_token_expires_with_half_open()
+    print("✅ Токены прошлых проб не действуют")
+    test_skipped_probe_frees_slot()
+    print("✅ Пропущенная проба освобождает слот")
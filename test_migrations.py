@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Тест миграций схемы (migrations.py), счетчиков городов и fix_database.py
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+from contextlib import contextmanager
+
+# Добавляем путь для импорта модулей бота
+sys.path.append('.')
+
+import database
+import fix_database
+import migrations
+
+@contextmanager
+def temp_dir():
+    """Временная рабочая папка: fix_database пишет резервную копию в текущую"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(cwd)
+
+def stats(conn):
+    counters = dict(conn.execute('SELECT name, value FROM stats_counters'))
+    cities = dict(conn.execute('SELECT key, users FROM city_counts'))
+    return counters, cities
+
+def legacy_db(path):
+    """База первых версий бота: без user_version, city NOT NULL, лишний индекс idx_user_id"""
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE users (user_id INTEGER PRIMARY KEY, city TEXT NOT NULL)')
+    conn.execute('CREATE INDEX idx_user_id ON users(user_id)')
+    conn.executemany('INSERT INTO users VALUES (?, ?)', [(1, 'Москва'), (2, 'Москва'), (3, 'Казань')])
+    conn.commit()
+    return conn
+
+def test_migrate_legacy_db():
+    """База без версии доходит до последней версии, данные и счетчики сохраняются"""
+    with temp_dir() as tmp:
+        conn = legacy_db(os.path.join(tmp, 'users.db'))
+        assert migrations.migrate(conn) == migrations.LATEST_VERSION
+        assert migrations.get_version(conn) == migrations.LATEST_VERSION
+        assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_user_id'").fetchone()
+        assert conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 3
+
+        counters, cities = stats(conn)
+        assert counters == {'total_users': 3, 'unique_cities': 2}
+        assert cities == {'name:Москва': 2, 'name:Казань': 1}
+
+        # повторный запуск ничего не меняет
+        assert migrations.migrate(conn) == 0
+        assert stats(conn) == (counters, cities)
+        conn.close()
+
+def test_city_counts_by_id():
+    """Написания одного города считаются вместе, одноименные города - отдельно"""
+    with temp_dir() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'users.db'))
+        migrations.migrate(conn)
+        conn.executemany('INSERT INTO users (user_id, city, city_id) VALUES (?, ?, ?)', [
+            (1, 'Moscow', 524901),
+            (2, 'Москва', 524901),
+            (3, 'Moscow', 4601471),  # Moscow, Idaho
+            (4, 'Тверь', None),
+        ])
+        counters, cities = stats(conn)
+        assert counters == {'total_users': 4, 'unique_cities': 3}
+        assert cities == {'id:524901': 2, 'id:4601471': 1, 'name:Тверь': 1}
+
+        conn.execute('UPDATE users SET city = ?, city_id = ? WHERE user_id = 3', ('Москва', 524901))
+        conn.execute('DELETE FROM users WHERE user_id = 4')
+        counters, cities = stats(conn)
+        assert counters == {'total_users': 3, 'unique_cities': 1}
+        assert cities == {'id:524901': 3}
+        conn.close()
+
+def test_fix_database_then_init_db():
+    """После fix_database на базе последней версии бот запускается, статистика верна"""
+    with temp_dir() as tmp:
+        path = os.path.join(tmp, 'users.db')
+        conn = sqlite3.connect(path)
+        migrations.migrate(conn)
+        conn.execute('INSERT INTO cities (city_id, name, lat, lon) VALUES (524901, ?, 55.75, 37.62)', ('Москва',))
+        conn.execute("INSERT INTO city_aliases VALUES ('москва', 524901)")
+        conn.executemany('INSERT INTO users (user_id, city, city_id) VALUES (?, ?, ?)', [
+            (1, 'Москва', 524901),
+            (2, 'москва', None),  # написание, еще не привязанное к id
+            (3, 'Казань', None),
+        ])
+        conn.commit()
+        conn.close()
+
+        old_fix_path, old_db_path = fix_database.DB_PATH, database.DB_PATH
+        fix_database.DB_PATH = database.DB_PATH = path
+        try:
+            assert fix_database.fix_database()
+            database.init_db()
+            conn = database.get_connection()
+            assert migrations.get_version(conn) == migrations.LATEST_VERSION
+            assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_user_id'").fetchone()
+            counters, cities = stats(conn)
+            assert counters == {'total_users': 3, 'unique_cities': 3}
+            assert cities == {'id:524901': 1, 'name:москва': 1, 'name:Казань': 1}
+
+            # триггеры восстановлены: запись снова меняет счетчики
+            database.set_user_city(4, 'Москва', city_id=524901)
+            database.set_user_city(3, 'Москва', city_id=524901)
+            assert database.get_user_stats() == {'total_users': 4, 'unique_cities': 2}
+            assert dict(database.get_top_cities()) == {'Москва': 3, 'москва': 1}
+        finally:
+            database.close_db()
+            fix_database.DB_PATH, database.DB_PATH = old_fix_path, old_db_path
+
+if __name__ == "__main__":
+    print("🛠️ Тест миграций базы данных")
+    test_migrate_legacy_db()
+    print("✅ Старая база обновляется до последней версии")
+    test_city_counts_by_id()
+    print("✅ Города считаются по id")
+    test_fix_database_then_init_db()
+    print("✅ После fix_database бот запускается")
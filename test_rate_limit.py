@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Тест квоты внешних API (rate_limit.QuotaGovernor): приоритеты, дедлайн очереди, token bucket
+"""
+
+import asyncio
+import sys
+
+# Добавляем путь для импорта модулей бота
+sys.path.append('.')
+
+from rate_limit import QuotaGovernor, QuotaExceeded, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+
+async def served_order():
+    """Один слот занят; фоновые запросы встали в очередь раньше интерактивного"""
+    governor = QuotaGovernor(calls_per_minute=6000, max_in_flight=1, queue_timeout=1)
+    order = []
+
+    async def call(name, priority):
+        async with governor.slot(priority):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    await governor.acquire()
+    tasks = [asyncio.ensure_future(call('background-1', PRIORITY_BACKGROUND)),
+             asyncio.ensure_future(call('background-2', PRIORITY_BACKGROUND))]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.ensure_future(call('interactive', PRIORITY_INTERACTIVE)))
+    await asyncio.sleep(0)
+    governor.release()
+    await asyncio.gather(*tasks)
+    return order
+
+def test_priority_order():
+    """Интерактивный запрос обгоняет фоновые, фоновые идут по очереди"""
+    assert asyncio.run(served_order()) == ['interactive', 'background-1', 'background-2']
+
+async def wait_past_deadline():
+    governor = QuotaGovernor(calls_per_minute=6000, max_in_flight=1, queue_timeout=0.05)
+    await governor.acquire()
+    try:
+        await governor.acquire()
+    except QuotaExceeded:
+        pass
+    else:
+        raise AssertionError("слот выдан сверх max_in_flight")
+    governor.release()
+    # ушедший по дедлайну не занимает слот: следующий получает его сразу
+    await asyncio.wait_for(governor.acquire(), 0.01)
+    return governor.stats()
+
+def test_queue_timeout():
+    """Запрос, не дождавшийся слота, получает QuotaExceeded и не держит очередь"""
+    stats = asyncio.run(wait_past_deadline())
+    assert stats['rejected'] == 1
+    assert stats['queued'] == 0
+    assert stats['in_flight'] == 1
+
+async def take_burst():
+    governor = QuotaGovernor(calls_per_minute=60, max_in_flight=10, queue_timeout=0.05, burst=2)
+    await governor.acquire()
+    await governor.acquire()
+    try:
+        await governor.acquire()
+    except QuotaExceeded:
+        return True
+    return False
+
+def test_token_bucket_burst():
+    """Сверх burst вызовов подряд следующий ждет токена (1 в секунду при 60 в минуту)"""
+    assert asyncio.run(take_burst())
+
+if __name__ == "__main__":
+    print("⏳ Тест квоты API")
+    test_priority_order()
+    print("✅ Интерактивные запросы идут раньше фоновых")
+    test_queue_timeout()
+    print("✅ Дедлайн очереди соблюдается")
+    test_token_bucket_burst()
+    print("✅ Token bucket ограничивает всплеск")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Тест планировщика исходящих сообщений (send_scheduler.py): ответы пользователям раньше рассылок
+"""
+
+import asyncio
+import os
+import sys
+
+# Добавляем путь для импорта модулей бота
+sys.path.append('.')
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ.setdefault('WEATHER_API_KEY', 'test')
+
+from aiogram.methods import SendMessage
+
+import send_scheduler
+from send_scheduler import SendScheduler
+
+async def send_order():
+    """Один запрос к Bot API за раз; первый висит, пока в очереди копятся рассылка и ответ"""
+    scheduler = SendScheduler(global_rate=1000, max_in_flight=1, timeout=5)
+    first_started, release_first = asyncio.Event(), asyncio.Event()
+    order = []
+
+    async def make_request(bot, method):
+        order.append(method.text)
+        if method.text == 'first':
+            first_started.set()
+            await release_first.wait()
+
+    async def send(text, chat_id, in_bulk=False):
+        method = SendMessage(chat_id=chat_id, text=text)
+        if in_bulk:
+            with send_scheduler.bulk():
+                return await scheduler(make_request, None, method)
+        return await scheduler(make_request, None, method)
+
+    # разные чаты: лимит чата не вмешивается, порядок решает только общий бюджет
+    tasks = [asyncio.ensure_future(send('first', 1))]
+    await first_started.wait()
+    tasks += [asyncio.ensure_future(send(f'bulk-{chat_id}', chat_id, in_bulk=True)) for chat_id in (2, 3)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.ensure_future(send('reply', 4)))
+    await asyncio.sleep(0)
+    assert scheduler.stats()['queued'] == 3
+    release_first.set()
+    await asyncio.gather(*tasks)
+    return order
+
+def test_reply_overtakes_bulk():
+    """Ответ пользователю обгоняет рассылку, которая встала в очередь раньше"""
+    assert asyncio.run(send_order()) == ['first', 'reply', 'bulk-2', 'bulk-3']
+
+if __name__ == "__main__":
+    print("📤 Тест планировщика отправок")
+    test_reply_overtakes_bulk()
+    print("✅ Ответы пользователям идут раньше рассылок")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Тест счетчиков хранилищ (storage.py): memory, kv и sqlite дают одну статистику на одних и тех же изменениях
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# Добавляем путь для импорта модулей бота
+sys.path.append('.')
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ.setdefault('WEATHER_API_KEY', 'test')
+
+import database as db
+from storage import KVStorage, MemoryStorage, SQLiteStorage
+
+MOSCOW, OMSK = 524901, 1496153
+
+# (описание шага, [(user_id, city, username, first_name, city_id)])
+STEPS = [
+    ("новые пользователи", [
+        (1, 'Москва', 'ivan', 'Иван', MOSCOW),
+        (2, 'Moscow', None, None, MOSCOW),  # тот же город под другим названием
+        (3, 'Казань', None, None, None),
+        (4, 'Казань', None, None, None),
+        (5, 'Омск', None, None, OMSK),
+        (6, None, None, None, None),  # город еще не выбран
+    ]),
+    ("смена города", [(3, 'Омск', None, None, OMSK)]),
+    ("тот же город еще раз", [(4, 'Казань', 'petr', 'Петр', None)]),
+    ("город сброшен", [(5, None, None, None, None)]),
+    ("город выбран впервые", [(6, 'Казань', None, None, None)]),
+    ("последний пользователь города ушел", [(1, 'Омск', None, None, OMSK), (2, 'Омск', None, None, OMSK)]),
+]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_kv_server():
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kv_server.py'),
+         '--port', str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise TimeoutError("kv_server.py не запустился")
+
+def snapshot(store):
+    return store.get_user_stats(), sorted(store.get_top_cities(10))
+
+def test_counters_match():
+    """После каждого шага total_users, unique_cities и get_top_cities совпадают у всех хранилищ"""
+    server, url = start_kv_server()
+    db_path = db.DB_PATH  # SQLiteStorage.init подменяет путь базы в database
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = {
+            'memory': MemoryStorage(),
+            'kv': KVStorage(url, timeout=5),
+            'sqlite': SQLiteStorage(os.path.join(tmp, 'users.db')),
+        }
+        try:
+            for store in stores.values():
+                store.init()
+            for step, rows in STEPS:
+                for store in stores.values():
+                    # одиночные изменения и пачка идут разными путями записи
+                    if len(rows) > 1:
+                        store.set_user_cities(rows)
+                    else:
+                        store.set_user_city(*rows[0])
+                expected = snapshot(stores['memory'])
+                for name in ('kv', 'sqlite'):
+                    assert snapshot(stores[name]) == expected, (step, name, snapshot(stores[name]), expected)
+        finally:
+            for store in stores.values():
+                store.close()
+            db.DB_PATH = db_path
+            server.terminate()
+            server.wait(timeout=10)
+
+    stats, top = expected
+    assert stats == {'total_users': 6, 'unique_cities': 2}
+    assert top == [('Казань', 2), ('Омск', 3)]
+
+if __name__ == "__main__":
+    print("🗄️ Тест счетчиков хранилищ")
+    test_counters_match()
+    print("✅ memory, kv и sqlite считают пользователей и города одинаково")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Тест передачи ответа обработчика в тело ответа на webhook (reply_in_webhook, UpdateQueue.wait_reply)
+"""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+# Добавляем путь для импорта модулей бота
+sys.path.append('.')
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ.setdefault('WEATHER_API_KEY', 'test')
+
+from aiogram.methods import SendMessage
+
+from update_queue import UpdateQueue, reply_in_webhook
+
+DEADLINE = 0.1
+
+class FakeBot:
+    """Вместо запросов к Bot API запоминает отправленные методы"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def __call__(self, method):
+        self.sent.append(method)
+
+class FakeDispatcher:
+    """Обработчик отвечает через delay секунд, как bot.send_reply"""
+
+    def __init__(self, delay=DEADLINE, before_reply=None):
+        self.delay = delay
+        self.before_reply = before_reply
+
+    async def feed_update(self, bot, update):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        method = SendMessage(chat_id=update.update_id, text='ok')
+        if self.before_reply is not None:
+            self.before_reply()
+        if not reply_in_webhook(method):
+            await bot(method)
+
+async def receive(queue, update, deadline):
+    """Запрос webhook, как main.webhook_handler: submit и сразу wait_reply"""
+    return await queue.wait_reply(queue.submit(update), deadline)
+
+def chat_update(update_id, chat_id=1):
+    return SimpleNamespace(update_id=update_id, event=SimpleNamespace(chat=SimpleNamespace(id=chat_id)))
+
+async def deliver_at_deadline(update_id):
+    """Обработчик завершается в ту же итерацию цикла, когда у webhook истекает срок.
+
+    Время цикла заморожено, поэтому оба таймера срабатывают одновременно.
+    Возвращает (метод в теле webhook или None, методы, отправленные обычным запросом).
+    """
+    loop = asyncio.get_running_loop()
+    bot = FakeBot()
+    queue = UpdateQueue(FakeDispatcher(), bot, max_size=10, workers=1, can_reply=lambda method: True)
+    queue.start()
+    now = [loop.time()]
+    real_time = loop.time
+    loop.time = lambda: now[0]
+    try:
+        reply = queue.submit(SimpleNamespace(update_id=update_id))
+        webhook = asyncio.ensure_future(queue.wait_reply(reply, DEADLINE))
+        for _ in range(5):
+            await asyncio.sleep(0)  # оба таймера поставлены на один и тот же момент
+        now[0] += DEADLINE
+        for _ in range(10):
+            await asyncio.sleep(0)
+    finally:
+        loop.time = real_time
+    in_body = await webhook
+    await queue.stop(timeout=1)
+    return in_body, bot.sent
+
+def test_reply_not_lost_at_deadline():
+    """Ответ доставляется ровно один раз: в теле webhook или обычным запросом"""
+    for update_id in range(200):
+        in_body, sent = asyncio.run(deliver_at_deadline(update_id))
+        delivered = len(sent) + (in_body is not None)
+        assert delivered == 1, f"запуск {update_id}: доставлено {delivered} раз"
+
+async def disconnect_at_reply():
+    """Запрос webhook обрывается в ту же итерацию цикла, когда обработчик отдал ему метод"""
+    bot = FakeBot()
+    webhook = None
+    dispatcher = FakeDispatcher(delay=0, before_reply=lambda: webhook.cancel())
+    queue = UpdateQueue(dispatcher, bot, can_reply=lambda method: True)
+    queue.start()
+    webhook = asyncio.ensure_future(receive(queue, chat_update(1), DEADLINE * 10))
+    result = (await asyncio.gather(webhook, return_exceptions=True))[0]
+    await queue.stop(timeout=1)
+    return result, bot.sent
+
+def test_reply_sent_when_webhook_disconnects():
+    """Оборванный запрос webhook не теряет уже готовый ответ"""
+    result, sent = asyncio.run(disconnect_at_reply())
+    assert isinstance(result, asyncio.CancelledError), result
+    assert len(sent) == 1, f"отправлено {len(sent)} раз"
+
+async def reply_then_next_update():
+    """Два обновления одного чата: ответ на первое уходит в теле webhook"""
+    bot = FakeBot()
+    queue = UpdateQueue(FakeDispatcher(delay=0), bot, can_reply=lambda method: True)
+    queue.start()
+    first = queue.submit(chat_update(1))
+    # webhook второго обновления не ждет ответа (WEBHOOK_REPLY_DEADLINE=0)
+    second = asyncio.ensure_future(receive(queue, chat_update(2), 0))
+    while not first.done():
+        await asyncio.sleep(0)
+    for _ in range(10):
+        await asyncio.sleep(0)
+    sent_before_handoff = list(bot.sent)
+    in_body = await queue.wait_reply(first, DEADLINE)
+    await second
+    await queue.stop(timeout=1)
+    return sent_before_handoff, in_body, bot.sent
+
+def test_next_update_waits_for_webhook_reply():
+    """Следующее обновление чата не отправляет ничего, пока webhook не передал ответ на предыдущее"""
+    sent_before_handoff, in_body, sent = asyncio.run(reply_then_next_update())
+    assert sent_before_handoff == []
+    assert in_body is not None and in_body.chat_id == 1
+    assert [method.chat_id for method in sent] == [2]
+
+if __name__ == "__main__":
+    print("📬 Тест ответа в теле webhook")
+    test_reply_not_lost_at_deadline()
+    print("✅ Ответ в момент истечения срока не теряется")
+    test_reply_sent_when_webhook_disconnects()
+    print("✅ Ответ при оборванном запросе отправляется обычным запросом")
+    test_next_update_waits_for_webhook_reply()
+    print("✅ Следующее обновление чата не обгоняет ответ в теле webhook")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Тест выгрузки и загрузки пользователей (user_export.py) с продолжением после прерывания
+"""
+
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+# Добавляем путь для импорта модулей бота
+sys.path.append('.')
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ.setdefault('WEATHER_API_KEY', 'test')
+
+import user_export
+from storage import MemoryStorage
+
+USERS = 25
+
+class Interrupted(Exception):
+    pass
+
+class FailingStorage(MemoryStorage):
+    """Хранилище, которое прерывает команду после fail_after пачек (None - не прерывает)"""
+
+    def __init__(self, fail_after):
+        super().__init__()
+        self.fail_after = fail_after
+
+    def iter_users(self, after_id, batch):
+        for number, page in enumerate(super().iter_users(after_id, batch)):
+            if number == self.fail_after:
+                raise Interrupted()
+            yield page
+
+    def import_users(self, rows):
+        if self.fail_after is not None:
+            if self.fail_after == 0:
+                raise Interrupted()
+            self.fail_after -= 1
+        super().import_users(rows)
+
+def filled(store):
+    store.init()
+    store.set_user_cities([(user_id, f'Город {user_id % 7}', None, None, None) for user_id in range(1, USERS + 1)])
+    return store
+
+def interrupted(command):
+    try:
+        command()
+    except Interrupted:
+        return True
+    return False
+
+def test_export_resume():
+    """Прерванная выгрузка, продолженная с --resume, совпадает с выгрузкой за один раз"""
+    for fmt in user_export.FORMATS:
+        with tempfile.TemporaryDirectory() as tmp:
+            full, resumed = os.path.join(tmp, f'full.{fmt}'), os.path.join(tmp, f'resumed.{fmt}')
+            user_export.export_users(filled(MemoryStorage()), full, fmt, batch=10)
+
+            store = filled(FailingStorage(fail_after=2))
+            assert interrupted(lambda: user_export.export_users(store, resumed, fmt, batch=10))
+            assert user_export.load_progress(resumed)['rows'] == 20
+            store.fail_after = None
+            assert user_export.export_users(store, resumed, fmt, batch=10, resume=True) == USERS
+
+            with open(full, 'rb') as a, open(resumed, 'rb') as b:
+                assert a.read() == b.read()
+            assert user_export.load_progress(resumed) is None
+
+def test_import_resume():
+    """Прерванная загрузка, продолженная с --resume, загружает каждого пользователя один раз"""
+    for fmt in user_export.FORMATS:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f'users.{fmt}')
+            user_export.export_users(filled(MemoryStorage()), path, fmt, batch=10)
+
+            target = FailingStorage(fail_after=1)
+            target.init()
+            assert interrupted(lambda: user_export.import_users(target, path, fmt, batch=10))
+            target.fail_after = None
+            assert user_export.import_users(target, path, fmt, batch=10, resume=True) == USERS
+
+            assert target.get_user_stats() == {'total_users': USERS, 'unique_cities': 7}
+            assert target.get_user_city(USERS) == f'Город {USERS % 7}'
+
+def test_db_path_from_dotenv():
+    """Выгрузка из командной строки берет DB_PATH из .env, хотя database импортируется раньше config"""
+    script = os.path.abspath(user_export.__file__)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'other.db'))
+        conn.execute('CREATE TABLE users (user_id INTEGER PRIMARY KEY, city TEXT)')
+        conn.execute("INSERT INTO users VALUES (1, 'Москва')")
+        conn.commit()
+        conn.close()
+        with open(os.path.join(tmp, '.env'), 'w', encoding='utf-8') as f:
+            f.write('DB_PATH=other.db\n')
+
+        # хранилище - sqlite, как по умолчанию, даже если другие тесты выбрали иное
+        env = dict({name: value for name, value in os.environ.items() if name != 'DB_PATH'}, STORAGE_BACKEND='sqlite')
+        subprocess.run([sys.executable, script, 'export', 'out.jsonl'], cwd=tmp, env=env,
+                       check=True, capture_output=True)
+
+        assert not os.path.exists(os.path.join(tmp, 'users.db'))
+        with open(os.path.join(tmp, 'out.jsonl'), encoding='utf-8') as f:
+            assert 'Москва' in f.read()
+
+if __name__ == "__main__":
+    print("📦 Тест выгрузки и загрузки пользователей")
+    test_export_resume()
+    print("✅ Выгрузка продолжается после прерывания")
+    test_import_resume()
+    print("✅ Загрузка продолжается после прерывания")
+    test_db_path_from_dotenv()
+    print("✅ DB_PATH берется из .env")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Тест stale-while-revalidate в WeatherService._cached: запись между мягким и жестким TTL
+"""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+# Добавляем путь для импорта модулей бота
+sys.path.append('.')
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ.setdefault('WEATHER_API_KEY', 'test')
+
+import cache
+import config
+from rate_limit import PRIORITY_BACKGROUND
+from weather_service import WeatherService
+
+KEY = ('москва', 'metric', 'ru')
+CALLERS = 10
+
+class FakeClock:
+    """Подменяет time.monotonic в cache"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __enter__(self):
+        self._time = cache.time
+        cache.time = SimpleNamespace(monotonic=lambda: self.now)
+        return self
+
+    def __exit__(self, *exc):
+        cache.time = self._time
+
+class FakeUpstream:
+    """Запрос к API, который считает вызовы и висит, пока не отпустят"""
+
+    def __init__(self):
+        self.calls = []
+        self.release = asyncio.Event()
+
+    async def fetch(self, priority):
+        self.calls.append(priority)
+        await self.release.wait()
+        return 200, 'свежая'
+
+async def soft_expired_reads(clock):
+    service = WeatherService(client=None)
+    upstream = FakeUpstream()
+    service.current_cache.set(KEY, 'старая')
+    clock.now += config.WEATHER_CACHE_TTL + 1
+    assert config.WEATHER_CACHE_TTL + 1 < config.WEATHER_CACHE_HARD_TTL
+
+    def read():
+        return service._cached(service.current_cache, KEY, 'weather', upstream.fetch)
+
+    # все читатели сразу получают запись из кэша, не дожидаясь API
+    results = await asyncio.wait_for(asyncio.gather(*(read() for _ in range(CALLERS))), 1)
+    assert results == [(200, 'старая')] * CALLERS
+    assert list(service._refresh_tasks) == [('weather',) + KEY]
+    await asyncio.sleep(0)
+    assert len(upstream.calls) == 1
+
+    # пока обновление идет, новые читатели не запускают второе
+    assert await read() == (200, 'старая')
+    assert service.refreshes == 1
+
+    upstream.release.set()
+    await asyncio.gather(*service._refresh_tasks.values())
+    await asyncio.sleep(0)
+    assert service._refresh_tasks == {}
+    assert upstream.calls == [PRIORITY_BACKGROUND]
+    assert service.current_cache.lookup(KEY) == ('свежая', False)
+
+def test_single_background_refresh():
+    """Между мягким и жестким TTL запись отдается сразу, а в API уходит одно фоновое обновление"""
+    with FakeClock() as clock:
+        asyncio.run(soft_expired_reads(clock))
+
+if __name__ == "__main__":
+    print("🌦️ Тест фонового обновления погоды")
+    test_single_background_refresh()
+    print("✅ Одно фоновое обновление на устаревшую запись")
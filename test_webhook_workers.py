@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Тест пересылки обновлений по процессам (webhook_workers.chat_key): чат из JSON тот же, что у полос UpdateQueue
+"""
+
+import os
+import sys
+
+# Добавляем путь для импорта модулей бота
+sys.path.append('.')
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ.setdefault('WEATHER_API_KEY', 'test')
+
+from aiogram.types import Update
+
+from update_queue import lane_key
+from webhook_workers import chat_key
+
+USER = {"id": 42, "is_bot": False, "first_name": "Test"}
+GROUP = {"id": -1001234567890, "type": "supergroup", "title": "Test"}
+
+def message(update_id, chat, text):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": chat, "from": USER, "text": text,
+    }}
+
+UPDATES = [
+    message(1, {"id": 42, "type": "private"}, "/setcity"),
+    message(2, GROUP, "Москва"),
+    {"update_id": 3, "edited_message": dict(message(3, GROUP, "Казань")["message"], edit_date=1)},
+    {"update_id": 4, "callback_query": {
+        "id": "1", "from": USER, "chat_instance": "1", "data": "weather",
+        "message": message(4, GROUP, "Погода")["message"],
+    }},
+    {"update_id": 5, "inline_query": {"id": "2", "from": USER, "query": "", "offset": ""}},
+]
+
+def test_chat_key_matches_lane_key():
+    """Обновления одной полосы попадают в один процесс"""
+    for data in UPDATES:
+        assert chat_key(data) == lane_key(Update.model_validate(data)), data
+
+def test_same_chat_same_worker():
+    """Номер процесса зависит только от чата"""
+    group = [hash(chat_key(data)) % 4 for data in UPDATES[1:4]]
+    assert len(set(group)) == 1
+
+if __name__ == "__main__":
+    print("🔀 Тест пересылки обновлений по процессам")
+    test_chat_key_matches_lane_key()
+    print("✅ Чат из JSON совпадает с полосой UpdateQueue")
+    test_same_chat_same_worker()
+    print("✅ Обновления одного чата идут в один процесс")
@@ -0,0 +1,155 @@
+"""
+Очередь обновлений webhook: Telegram получает ответ сразу после приема обновления,
+а обработка идет в фоне
+"""
+
+import asyncio
+import logging
+from contextvars import ContextVar
+
+from aiogram.methods import TelegramMethod
+
+import config
+from lanes import LaneScheduler
+
+logger = logging.getLogger(__name__)
+
+# (очередь, reply) обновления, которое сейчас обрабатывается в UpdateQueue
+_current_reply = ContextVar('webhook_reply', default=None)
+
+def reply_in_webhook(method) -> bool:
+    """Передает метод в тело ответа на webhook, если тот еще ждет ответа на текущее обновление.
+
+    True - метод забрал webhook, отправлять его не нужно; False - обработчик отправляет
+    его сам (await), под своей обработкой ошибок. Вне UpdateQueue всегда False.
+    """
+    current = _current_reply.get()
+    if current is None:
+        return False
+    queue, reply = current
+    if reply.done() or queue.can_reply is None or not queue.can_reply(method):
+        return False
+    queue.webhook_replies += 1
+    reply.set_result(method)
+    return True
+
+def lane_key(update):
+    """Чат обновления (или пользователь, если чата нет): обновления одного чата идут по порядку"""
+    try:
+        event = update.event
+    except Exception:
+        return ('update', update.update_id)
+    chat = getattr(event, 'chat', None) or getattr(getattr(event, 'message', None), 'chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, 'from_user', None)
+    if user is not None:
+        return user.id
+    return ('update', update.update_id)
+
+class UpdateQueue:
+    """Ограниченная очередь обновлений с обработкой по полосам чатов.
+
+    Webhook только проверяет обновление и кладет его в очередь, поэтому Telegram не ждет
+    ответа OpenWeatherMap и не снижает число одновременных доставок. Если очередь
+    заполнена, submit возвращает None: webhook отвечает 503, и Telegram повторит доставку.
+
+    Обновления одного чата обрабатываются по очереди (иначе "/setcity" и название города
+    обгоняют друг друга и ломают FSM), разных чатов - параллельно, до WEBHOOK_WORKERS сразу.
+
+    Обработчик может отдать ответ Telegram в теле ответа на webhook (reply_in_webhook),
+    если webhook еще ждет (см. wait_reply) и can_reply(метод) разрешает. Следующее
+    обновление чата ждет, пока webhook не передаст этот ответ, чтобы не обогнать его.
+    """
+
+    def __init__(self, dispatcher, bot, max_size=None, workers=None, can_reply=None):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.can_reply = can_reply
+        self.webhook_replies = 0
+        self.late_replies = 0
+        self._handoffs = {}  # reply -> future: webhook передал ответ (None) или оборван (метод)
+        self.lanes = LaneScheduler(
+            self._handle,
+            max_concurrency=config.WEBHOOK_WORKERS if workers is None else workers,
+            max_pending=config.WEBHOOK_QUEUE_SIZE if max_size is None else max_size,
+            starvation=config.WEBHOOK_LANE_STARVATION,
+        )
+
+    def start(self):
+        self.lanes.start()
+        logger.info(f"📬 Очередь обновлений: до {self.lanes.max_pending}, обработчиков {self.lanes.max_concurrency}")
+
+    def submit(self, update):
+        """Ставит обновление в полосу его чата.
+
+        Возвращает future с ответом обработчика для wait_reply или None, если очередь заполнена.
+        wait_reply вызывается сразу после submit: до этого полоса чата не отпустит ответ в теле webhook.
+        """
+        loop = asyncio.get_running_loop()
+        reply = loop.create_future()
+        handoff = self._handoffs[reply] = loop.create_future()
+        if not self.lanes.submit(lane_key(update), (update, reply, handoff)):
+            del self._handoffs[reply]
+            return None
+        return reply
+
+    async def wait_reply(self, reply, deadline: float):
+        """Метод для тела ответа на webhook, если обработчик уложился в deadline секунд, иначе None.
+
+        Передача атомарна: либо обработчик успел положить метод в reply, и его отправит
+        webhook, либо webhook отменил reply, и метод обработчик отправит сам. Если запрос
+        webhook оборван после передачи, метод отправляется обычным запросом из полосы чата.
+        """
+        handoff = self._handoffs.pop(reply, None)
+        abandoned = None
+        try:
+            if deadline > 0:
+                await asyncio.wait_for(asyncio.shield(reply), deadline)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if not reply.cancel() and not reply.cancelled():
+                abandoned = reply.result()
+            raise
+        finally:
+            if handoff is not None and not handoff.done():
+                handoff.set_result(abandoned)
+        if reply.cancel():
+            return None
+        # метод мог появиться в ту же итерацию цикла, когда истек срок
+        return None if reply.cancelled() else reply.result()
+
+    async def _handle(self, item):
+        update, reply, handoff = item
+        token = _current_reply.set((self, reply))
+        try:
+            result = await self.dispatcher.feed_update(self.bot, update)
+        finally:
+            _current_reply.reset(token)
+            if not reply.done():
+                reply.set_result(None)
+
+        if reply.cancelled() or reply.result() is None:
+            self._handoffs.pop(reply, None)
+        else:
+            # ответ в теле webhook: полоса чата ждет, пока webhook его не передаст
+            abandoned = await handoff
+            if abandoned is not None:
+                self.late_replies += 1
+                try:
+                    await self.bot(abandoned)
+                except Exception as e:
+                    logger.error(f"❌ Не удалось отправить ответ после обрыва webhook: {e}")
+
+        if isinstance(result, TelegramMethod):
+            # возвращенный метод отправляется обычным запросом, как при polling
+            await self.bot(result)
+
+    async def stop(self, timeout=None):
+        """Дожидается обработки принятых обновлений (не дольше timeout) и останавливает обработчики"""
+        await self.lanes.stop(config.WEBHOOK_DRAIN_TIMEOUT if timeout is None else timeout)
+
+    def stats(self):
+        """Глубина очереди, полосы и задержки для health endpoint"""
+        return dict(self.lanes.stats(), webhook_replies=self.webhook_replies, late_replies=self.late_replies)
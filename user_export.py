@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Выгрузка и загрузка пользователей бота в JSONL или CSV: перенос базы между серверами
+или хранилищами без копирования users.db вручную.
+
+Выгрузка читает пользователей страницами по user_id, загрузка пишет их пачками
+в больших транзакциях; в памяти одновременно держится одна пачка. После каждой пачки
+положение сохраняется в <файл>.progress, и прерванная команда, запущенная снова
+с --resume, продолжает с этого места.
+
+Загружать лучше в остановленного бота: кэш городов работающего бота изменения не увидит.
+
+Запуск:
+  python user_export.py export users.jsonl [--format csv] [--batch 10000] [--resume]
+  python user_export.py import users.jsonl [--batch 50000] [--resume]
+  --backend выбирает хранилище, --db - файл SQLite (по умолчанию из .env)
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+import database as db
+import storage
+
+FORMATS = ('jsonl', 'csv')
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+def _progress_path(path):
+    return path + '.progress'
+
+def load_progress(path):
+    """Сохраненное положение прерванной команды или None"""
+    try:
+        with open(_progress_path(path), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_progress(path, state):
+    # через временный файл: прерывание посреди записи не портит положение
+    tmp_path = _progress_path(path) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, _progress_path(path))
+
+def clear_progress(path):
+    if os.path.exists(_progress_path(path)):
+        os.remove(_progress_path(path))
+
+class Progress:
+    """Строка прогресса в stderr, обновляется не чаще раза в секунду"""
+
+    def __init__(self, action, rows=0):
+        self.action = action
+        self.rows = rows
+        self.start_rows = rows
+        self.start = time.monotonic()
+        self._shown = 0.0
+
+    def add(self, count):
+        self.rows += count
+        now = time.monotonic()
+        if now - self._shown >= 1:
+            self._shown = now
+            self._show(now)
+
+    def _show(self, now, end=''):
+        rate = (self.rows - self.start_rows) / max(now - self.start, 1e-9)
+        sys.stderr.write(f"\r{self.action}: {self.rows} пользователей ({rate:.0f}/с){end}")
+        sys.stderr.flush()
+
+    def done(self):
+        self._show(time.monotonic(), end='\n')
+        return round(time.monotonic() - self.start, 3)
+
+# json.dumps с параметрами создает новый кодировщик на каждый вызов
+_to_json = json.JSONEncoder(ensure_ascii=False).encode
+
+def _encode(rows, fmt):
+    """Пачка строк выгрузки в байтах"""
+    if fmt == 'jsonl':
+        return ''.join(_to_json(dict(zip(db.USER_FIELDS, row))) + '\n' for row in rows).encode('utf-8')
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+def export_users(store, path, fmt='jsonl', batch=10000, resume=False):
+    """Выгружает всех пользователей хранилища в файл; возвращает число строк в файле"""
+    state = load_progress(path) if resume else None
+    if state is not None:
+        f = open(path, 'r+b')
+        # все, что записано после последней сохраненной пачки, пишем заново
+        f.truncate(state['offset'])
+        f.seek(state['offset'])
+        after_id, rows = state['after_id'], state['rows']
+        print(f"▶️ Продолжаю выгрузку после user_id {after_id} ({rows} уже выгружено)", file=sys.stderr)
+    else:
+        f = open(path, 'wb')
+        if fmt == 'csv':
+            f.write(_encode([db.USER_FIELDS], fmt))
+        after_id, rows = 0, 0
+
+    progress = Progress('📤 Выгружено', rows)
+    with f:
+        for page in store.iter_users(after_id, batch):
+            f.write(_encode(page, fmt))
+            f.flush()
+            # положение сохраняем только после того, как пачка на диске
+            os.fsync(f.fileno())
+            rows += len(page)
+            after_id = page[-1][0]
+            save_progress(path, {'after_id': after_id, 'offset': f.tell(), 'rows': rows})
+            progress.add(len(page))
+    duration = progress.done()
+    clear_progress(path)
+    print(f"✅ Выгружено {rows} пользователей в {path} за {duration} с", file=sys.stderr)
+    return rows
+
+def _from_csv(record, header):
+    values = dict(zip(header, record))
+    row = []
+    for field in db.USER_FIELDS:
+        value = values.get(field) or None
+        if value is not None and field in ('user_id', 'city_id'):
+            value = int(value)
+        row.append(value)
+    return tuple(row)
+
+def read_rows(f, fmt, offset=0):
+    """Строки выгрузки начиная с offset: (строка, смещение сразу после нее)"""
+    if fmt == 'csv':
+        f.seek(0)
+        header = next(csv.reader([f.readline().decode('utf-8')]))
+        offset = max(offset, f.tell())
+    f.seek(offset)
+
+    position = [offset]
+
+    def lines():
+        for line in f:
+            position[0] += len(line)
+            yield line.decode('utf-8')
+
+    if fmt == 'jsonl':
+        for line in lines():
+            if line.strip():
+                data = json.loads(line)
+                yield tuple(data.get(field) for field in db.USER_FIELDS), position[0]
+    else:
+        # csv.reader берет строки по одной, поэтому position - это конец текущей записи
+        for record in csv.reader(lines()):
+            if record:
+                yield _from_csv(record, header), position[0]
+
+def import_users(store, path, fmt='jsonl', batch=50000, resume=False):
+    """Загружает пользователей из файла в хранилище; возвращает число загруженных строк"""
+    state = load_progress(path) if resume else None
+    offset, rows = (state['offset'], state['rows']) if state is not None else (0, 0)
+    if state is not None:
+        print(f"▶️ Продолжаю загрузку с байта {offset} ({rows} уже загружено)", file=sys.stderr)
+
+    progress = Progress('📥 Загружено', rows)
+    pending = []
+    with open(path, 'rb') as f:
+        for row, end in read_rows(f, fmt, offset):
+            pending.append(row)
+            if len(pending) >= batch:
+                store.import_users(pending)
+                rows += len(pending)
+                save_progress(path, {'offset': end, 'rows': rows})
+                progress.add(len(pending))
+                pending = []
+        if pending:
+            store.import_users(pending)
+            rows += len(pending)
+            progress.add(len(pending))
+    duration = progress.done()
+    clear_progress(path)
+    print(f"✅ Загружено {rows} пользователей из {path} за {duration} с", file=sys.stderr)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Выгрузка и загрузка пользователей бота')
+    parser.add_argument('command', choices=('export', 'import'))
+    parser.add_argument('path', help='файл .jsonl или .csv')
+    parser.add_argument('--format', choices=FORMATS, help='по умолчанию по расширению файла')
+    parser.add_argument('--batch', type=int, help='строк в пачке (export: 10000, import: 50000)')
+    parser.add_argument('--resume', action='store_true', help='продолжить прерванную команду')
+    parser.add_argument('--backend', choices=sorted(storage.BACKENDS), help='по умолчанию STORAGE_BACKEND')
+    parser.add_argument('--db', help='файл SQLite (по умолчанию DB_PATH)')
+    args = parser.parse_args()
+
+    store = storage.SQLiteStorage(args.db) if args.db else storage.create_storage(args.backend)
+    store.init()
+    fmt = detect_format(args.path, args.format)
+    try:
+        if args.command == 'export':
+            export_users(store, args.path, fmt, args.batch or 10000, args.resume)
+        else:
+            import_users(store, args.path, fmt, args.batch or 50000, args.resume)
+    finally:
+        store.close()
+
+if __name__ == '__main__':
+    main()
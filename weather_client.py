@@ -0,0 +1,141 @@
+"""
+HTTP клиент для OpenWeatherMap с общим пулом соединений
+"""
+
+import asyncio
+import logging
+import aiohttp
+
+import config
+from circuit_breaker import CircuitBreaker
+from rate_limit import QuotaGovernor, QuotaExceeded, PRIORITY_INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+class WeatherClient:
+    """Долгоживущий клиент OpenWeatherMap: одна сессия и keep-alive соединения на весь процесс"""
+
+    def __init__(self, api_key=None, base_url=None, limit_per_host=None,
+                 dns_cache_ttl=None, keepalive_timeout=None, governor=None, breaker=None):
+        self.api_key = api_key or config.WEATHER_API_KEY
+        # base_url можно подменить, чтобы направить клиент на локальный тестовый сервер
+        self.base_url = (base_url or config.OWM_BASE_URL).rstrip('/')
+        self.limit_per_host = limit_per_host or config.OWM_LIMIT_PER_HOST
+        self.dns_cache_ttl = dns_cache_ttl or config.OWM_DNS_CACHE_TTL
+        self.keepalive_timeout = keepalive_timeout or config.OWM_KEEPALIVE_TIMEOUT
+        self._session = None
+        # квота OWM: вызовов в минуту и одновременных запросов
+        self.governor = governor or QuotaGovernor(
+            calls_per_minute=config.OWM_CALLS_PER_MINUTE,
+            max_in_flight=config.OWM_MAX_IN_FLIGHT,
+            queue_timeout=config.OWM_QUEUE_TIMEOUT,
+        )
+        # при частых ошибках и таймаутах запросы к OWM временно не отправляются
+        self.breaker = breaker or CircuitBreaker(
+            'openweathermap',
+            failure_ratio=config.OWM_BREAKER_FAILURE_RATIO,
+            window=config.OWM_BREAKER_WINDOW,
+            min_calls=config.OWM_BREAKER_MIN_CALLS,
+            reset_timeout=config.OWM_BREAKER_RESET_TIMEOUT,
+        )
+
+    @property
+    def closed(self):
+        return self._session is None or self._session.closed
+
+    async def start(self):
+        """Создает сессию и пул соединений (вызывается при старте бота)"""
+        if not self.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(connector=connector)
+        logger.info(f"🌐 HTTP клиент погоды запущен: {self.base_url} (до {self.limit_per_host} соединений)")
+
+    async def close(self):
+        """Закрывает сессию и все соединения пула"""
+        if self.closed:
+            return
+        await self._session.close()
+        self._session = None
+        logger.info("🔌 HTTP клиент погоды остановлен")
+
+    async def get_json(self, path: str, params: dict, timeout: float = 10,
+                       priority: int = PRIORITY_INTERACTIVE):
+        """Выполняет GET запрос к API и возвращает (статус, json или None).
+
+        Если квота не освободилась за OWM_QUEUE_TIMEOUT, бросает QuotaExceeded.
+        Если breaker разомкнут, сразу бросает CircuitOpenError.
+        """
+        if self.closed:
+            # Ленивый запуск для скриптов, которые не вызывают start()
+            await self.start()
+
+        probe = self.breaker.before_call()
+        query = dict(params, appid=self.api_key)
+        try:
+            async with self.governor.slot(priority):
+                async with self._session.get(
+                    f"{self.base_url}{path}",
+                    params=query,
+                    timeout=aiohttp.ClientTimeout(total=timeout),
+                ) as response:
+                    if response.status == 200:
+                        result = response.status, await response.json()
+                    else:
+                        if response.status == 429:
+                            logger.warning("⚠️ OpenWeatherMap вернул 429: превышен лимит запросов")
+                        result = response.status, None
+        except (QuotaExceeded, asyncio.CancelledError):
+            self.breaker.record_skipped(probe)
+            raise
+        except Exception:
+            # таймауты и сетевые ошибки
+            self.breaker.record_failure(probe)
+            raise
+
+        # 404 и 401 - ответы исправного сервиса, ошибкой считаются только 429 и 5xx
+        if result[0] == 429 or result[0] >= 500:
+            self.breaker.record_failure(probe)
+        else:
+            self.breaker.record_success(probe)
+        return result
+
+    async def current(self, city: str, units: str = 'metric', lang: str = 'ru', timeout: float = 10,
+                      priority: int = PRIORITY_INTERACTIVE):
+        """Текущая погода по названию города"""
+        return await self.get_json(
+            '/data/2.5/weather', {'q': city, 'units': units, 'lang': lang}, timeout, priority
+        )
+
+    async def current_by_id(self, city_id: int, units: str = 'metric', lang: str = 'ru', timeout: float = 10,
+                            priority: int = PRIORITY_INTERACTIVE):
+        """Текущая погода по id города OpenWeatherMap"""
+        return await self.get_json(
+            '/data/2.5/weather', {'id': city_id, 'units': units, 'lang': lang}, timeout, priority
+        )
+
+    async def current_by_coordinates(self, lat: float, lon: float, units: str = 'metric',
+                                     lang: str = 'ru', timeout: float = 10,
+                                     priority: int = PRIORITY_INTERACTIVE):
+        """Текущая погода по координатам"""
+        return await self.get_json(
+            '/data/2.5/weather', {'lat': lat, 'lon': lon, 'units': units, 'lang': lang}, timeout, priority
+        )
+
+    async def forecast(self, city: str, units: str = 'metric', lang: str = 'ru', timeout: float = 15,
+                       priority: int = PRIORITY_INTERACTIVE):
+        """Прогноз на 5 дней с шагом 3 часа"""
+        return await self.get_json(
+            '/data/2.5/forecast', {'q': city, 'units': units, 'lang': lang}, timeout, priority
+        )
+
+    async def forecast_by_id(self, city_id: int, units: str = 'metric', lang: str = 'ru', timeout: float = 15,
+                             priority: int = PRIORITY_INTERACTIVE):
+        """Прогноз на 5 дней по id города OpenWeatherMap"""
+        return await self.get_json(
+            '/data/2.5/forecast', {'id': city_id, 'units': units, 'lang': lang}, timeout, priority
+        )
@@ -0,0 +1,233 @@
+"""
+Компактные записи о погоде: результат разбора ответов OpenWeatherMap
+"""
+
+import copy
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+
+class CurrentWeather:
+    """Текущая погода в точке или городе"""
+
+    __slots__ = (
+        'city_id', 'name', 'country', 'lat', 'lon',
+        'weather_main', 'description', 'temp', 'feels_like', 'wind_speed', 'humidity', 'pressure',
+        'timezone', 'sunrise', 'sunset', 'dt', 'from_forecast', 'stale_age',
+    )
+
+    def __init__(self, city_id, name, country, lat, lon, weather_main, description, temp, feels_like,
+                 wind_speed, humidity, pressure, timezone=0, sunrise=None, sunset=None, dt=None,
+                 from_forecast=False):
+        self.city_id = city_id
+        self.name = name
+        self.country = country
+        self.lat = lat
+        self.lon = lon
+        self.weather_main = weather_main
+        self.description = description
+        self.temp = temp
+        self.feels_like = feels_like
+        self.wind_speed = wind_speed
+        self.humidity = humidity
+        self.pressure = pressure
+        self.timezone = timezone
+        self.sunrise = sunrise
+        self.sunset = sunset
+        self.dt = dt
+        self.from_forecast = from_forecast
+        self.stale_age = None  # секунд, если данные отданы из кэша при недоступном API
+
+    @classmethod
+    def from_api(cls, data: dict):
+        """Разбирает ответ /data/2.5/weather"""
+        sys_info = data.get('sys', {})
+        return cls(
+            city_id=data.get('id'),
+            name=data.get('name'),
+            country=sys_info.get('country'),
+            lat=data['coord']['lat'],
+            lon=data['coord']['lon'],
+            weather_main=data['weather'][0]['main'],
+            description=data['weather'][0]['description'],
+            temp=data['main']['temp'],
+            feels_like=data['main']['feels_like'],
+            wind_speed=data['wind']['speed'],
+            humidity=data['main']['humidity'],
+            pressure=data['main']['pressure'],
+            timezone=data.get('timezone', 0),
+            sunrise=sys_info.get('sunrise'),
+            sunset=sys_info.get('sunset'),
+            dt=data.get('dt'),
+        )
+
+    @classmethod
+    def from_forecast_slot(cls, forecast, slot):
+        """Текущая погода из слота прогноза и сведений о городе"""
+        record = cls(
+            city_id=forecast.city_id,
+            name=forecast.name,
+            country=forecast.country,
+            lat=forecast.lat,
+            lon=forecast.lon,
+            weather_main=slot.weather_main,
+            description=slot.description,
+            temp=slot.temp,
+            feels_like=slot.feels_like,
+            wind_speed=slot.wind_speed,
+            humidity=slot.humidity,
+            pressure=slot.pressure,
+            timezone=forecast.timezone,
+            sunrise=forecast.sunrise,
+            sunset=forecast.sunset,
+            dt=slot.dt,
+            from_forecast=True,
+        )
+        record.stale_age = forecast.stale_age
+        return record
+
+    def with_stale(self, age: float):
+        """Копия записи с пометкой устаревания"""
+        record = copy.copy(self)
+        record.stale_age = age
+        return record
+
+class ForecastSlot:
+    """Один 3-часовой слот прогноза"""
+
+    __slots__ = ('dt', 'weather_main', 'description', 'temp', 'feels_like', 'wind_speed', 'humidity', 'pressure')
+
+    def __init__(self, dt, weather_main, description, temp, feels_like, wind_speed, humidity, pressure):
+        self.dt = dt
+        self.weather_main = weather_main
+        self.description = description
+        self.temp = temp
+        self.feels_like = feels_like
+        self.wind_speed = wind_speed
+        self.humidity = humidity
+        self.pressure = pressure
+
+    @classmethod
+    def from_api(cls, item: dict):
+        main = item['main']
+        return cls(
+            dt=item['dt'],
+            weather_main=item['weather'][0]['main'],
+            description=item['weather'][0]['description'],
+            temp=main['temp'],
+            feels_like=main.get('feels_like', main['temp']),
+            wind_speed=item.get('wind', {}).get('speed'),
+            humidity=main.get('humidity'),
+            pressure=main.get('pressure'),
+        )
+
+class DailySummary:
+    """Сводка прогноза за один местный день"""
+
+    __slots__ = ('date', 'min_temp', 'max_temp', 'weather_main', 'description')
+
+    def __init__(self, date, min_temp, max_temp, weather_main, description):
+        self.date = date  # datetime.date в часовом поясе города
+        self.min_temp = min_temp
+        self.max_temp = max_temp
+        self.weather_main = weather_main
+        self.description = description
+
+class Forecast:
+    """Прогноз на 5 дней: слоты и дневные сводки"""
+
+    __slots__ = ('city_id', 'name', 'country', 'lat', 'lon', 'timezone', 'sunrise', 'sunset',
+                 'slots', 'days', 'stale_age')
+
+    def __init__(self, city_id, name, country, lat, lon, timezone, sunrise, sunset, slots):
+        self.city_id = city_id
+        self.name = name
+        self.country = country
+        self.lat = lat
+        self.lon = lon
+        self.timezone = timezone
+        self.sunrise = sunrise
+        self.sunset = sunset
+        self.slots = tuple(slots)
+        self.days = tuple(summarize_days(self.slots, timezone))
+        self.stale_age = None
+
+    @classmethod
+    def from_api(cls, data: dict):
+        """Разбирает ответ /data/2.5/forecast"""
+        city = data.get('city', {})
+        coord = city.get('coord', {})
+        return cls(
+            city_id=city.get('id'),
+            name=city.get('name'),
+            country=city.get('country'),
+            lat=coord.get('lat'),
+            lon=coord.get('lon'),
+            timezone=city.get('timezone', 0),
+            sunrise=city.get('sunrise'),
+            sunset=city.get('sunset'),
+            slots=[ForecastSlot.from_api(item) for item in data['list'][:40]],  # 5 дней по 8 записей
+        )
+
+    def nearest_slot(self, now: float, max_gap: float):
+        """Ближайший ко времени now слот или None, если он дальше max_gap секунд"""
+        slot = min(self.slots, key=lambda item: abs(item.dt - now), default=None)
+        if slot is None or abs(slot.dt - now) > max_gap:
+            return None
+        return slot
+
+    def with_stale(self, age: float):
+        record = copy.copy(self)
+        record.stale_age = age
+        return record
+
+def summarize_days(slots, timezone_offset: int, limit: int = 5):
+    """Группирует слоты по местным дням: минимум, максимум и преобладающая погода"""
+    days = {}
+    for slot in slots:
+        local_time = datetime.fromtimestamp(slot.dt, tz=timezone.utc) + timedelta(seconds=timezone_offset)
+        days.setdefault(local_time.date(), []).append(slot)
+
+    summaries = []
+    for date in sorted(days)[:limit]:
+        day_slots = days[date]
+        temps = [slot.temp for slot in day_slots]
+        most_common_weather = Counter(slot.weather_main for slot in day_slots).most_common(1)[0][0]
+        summaries.append(DailySummary(
+            date=date,
+            min_temp=min(temps),
+            max_temp=max(temps),
+            weather_main=most_common_weather,
+            # первое описание дня обычно самое точное
+            description=day_slots[0].description,
+        ))
+    return summaries
+
+# Виды ошибок получения погоды
+ERROR_NOT_FOUND = 'not_found'
+ERROR_AUTH = 'auth'
+ERROR_RATE_LIMITED = 'rate_limited'
+ERROR_UNAVAILABLE = 'unavailable'
+ERROR_TIMEOUT = 'timeout'
+ERROR_NETWORK = 'network'
+
+class WeatherError:
+    """Результат неудачного запроса погоды"""
+
+    __slots__ = ('kind', 'status')
+
+    def __init__(self, kind: str, status: int = None):
+        self.kind = kind
+        self.status = status
+
+    @classmethod
+    def from_status(cls, status: int):
+        if status == 404:
+            return cls(ERROR_NOT_FOUND, status)
+        if status == 401:
+            return cls(ERROR_AUTH, status)
+        if status == 429:
+            return cls(ERROR_RATE_LIMITED, status)
+        return cls(ERROR_UNAVAILABLE, status)
+
+    def __repr__(self):
+        return f"WeatherError({self.kind!r}, {self.status!r})"
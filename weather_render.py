@@ -0,0 +1,149 @@
+"""
+Форматирование записей о погоде в текст сообщений
+"""
+
+from datetime import datetime, timezone, timedelta
+
+from weather_models import (
+    ERROR_NOT_FOUND, ERROR_AUTH, ERROR_RATE_LIMITED, ERROR_TIMEOUT, ERROR_NETWORK,
+)
+
+WEATHER_EMOJIS = {
+    'Clear': '☀️',
+    'Clouds': '☁️',
+    'Rain': '🌧️',
+    'Drizzle': '🌦️',
+    'Thunderstorm': '⛈️',
+    'Snow': '❄️',
+    'Mist': '🌫️',
+    'Fog': '🌫️',
+    'Haze': '🌫️'
+}
+
+DAY_NAMES_RU = ('Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье')
+
+# Тексты ошибок для разных запросов: (погода, прогноз)
+_ERROR_TEXTS = {
+    ERROR_NOT_FOUND: (
+        "❌ Город не найден. Проверьте правильность написания названия города.",
+        "❌ Город не найден для прогноза погоды.",
+    ),
+    ERROR_AUTH: (
+        "⚠️ Ошибка сервиса. Попробуйте позже.",
+        "⚠️ Сервис прогноза временно недоступен.",
+    ),
+    ERROR_RATE_LIMITED: (
+        "⚠️ Слишком много запросов к сервису погоды. Попробуйте через минуту.",
+        "⚠️ Слишком много запросов к сервису прогноза. Попробуйте через минуту.",
+    ),
+    ERROR_TIMEOUT: (
+        "⏰ Превышено время ожидания. Попробуйте позже.",
+        "⏰ Превышено время ожидания прогноза.",
+    ),
+    ERROR_NETWORK: (
+        "🌐 Проблемы с сетью. Попробуйте позже.",
+        "❌ Произошла ошибка при получении прогноза.",
+    ),
+}
+_UNAVAILABLE_TEXTS = (
+    "⚠️ Сервис временно недоступен. Попробуйте позже.",
+    "⚠️ Сервис прогноза временно недоступен.",
+)
+
+def get_weather_emoji(weather_main: str) -> str:
+    """Возвращает эмодзи в зависимости от типа погоды"""
+    return WEATHER_EMOJIS.get(weather_main, '🌤️')
+
+def _local_time(timestamp, timezone_offset: int):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc) + timedelta(seconds=timezone_offset)
+
+def stale_note(record) -> str:
+    """Пометка для данных, отданных из кэша, пока API погоды недоступен"""
+    if record.stale_age is None:
+        return ""
+    return f"\n\n⚠️ Сервис погоды недоступен, показаны данные {max(1, round(record.stale_age / 60))} мин назад"
+
+def forecast_note(record) -> str:
+    """Пометка для текущей погоды, взятой из ближайшего слота прогноза, а не из /weather"""
+    if not record.from_forecast or not record.dt:
+        return ""
+    slot_time = _local_time(record.dt, record.timezone or 0).strftime('%H:%M')
+    return f"\n\n📅 Данные прогноза на {slot_time} (местное время), а не текущее измерение"
+
+def render_current(weather, city: str) -> str:
+    """Текущая погода в городе, который запросил пользователь"""
+    offset = weather.timezone or 0
+    local_time = datetime.now(timezone.utc) + timedelta(seconds=offset)
+
+    sunrise_str = "—"
+    sunset_str = "—"
+    if weather.sunrise and weather.sunset:
+        sunrise_str = _local_time(weather.sunrise, offset).strftime('%H:%M')
+        sunset_str = _local_time(weather.sunset, offset).strftime('%H:%M')
+
+    return (
+        f"{get_weather_emoji(weather.weather_main)} Погода в городе {city.capitalize()}:\n\n"
+        f"🌡️ Температура: {weather.temp}°C\n"
+        f"🤔 Ощущается как: {weather.feels_like}°C\n"
+        f"🌬️ Скорость ветра: {weather.wind_speed} м/с\n"
+        f"💧 Влажность: {weather.humidity}%\n"
+        f"📊 Давление: {weather.pressure} гПа\n"
+        f"📝 Описание: {weather.description.capitalize()}\n\n"
+        f"📅 Дата: {local_time.strftime('%d.%m.%Y')}\n"
+        f"🕐 Местное время: {local_time.strftime('%H:%M:%S')}\n"
+        f"🌅 Восход: {sunrise_str}\n"
+        f"🌇 Закат: {sunset_str}\n"
+        f"🌍 Часовой пояс: UTC{offset//3600:+d}"
+        f"{forecast_note(weather)}"
+        f"{stale_note(weather)}"
+    )
+
+def render_current_at(weather, lat: float, lon: float) -> str:
+    """Текущая погода по координатам пользователя"""
+    city_name = weather.name or 'Неизвестное место'
+    location_name = f"{city_name}, {weather.country}" if weather.country else city_name
+    local_time = datetime.now(timezone.utc) + timedelta(seconds=weather.timezone or 0)
+
+    return (
+        f"{get_weather_emoji(weather.weather_main)} Погода в {location_name}:\n\n"
+        f"🌡️ Температура: {weather.temp}°C\n"
+        f"🤔 Ощущается как: {weather.feels_like}°C\n"
+        f"🌬️ Скорость ветра: {weather.wind_speed} м/с\n"
+        f"💧 Влажность: {weather.humidity}%\n"
+        f"📊 Давление: {weather.pressure} гПа\n"
+        f"📝 Описание: {weather.description.capitalize()}\n\n"
+        f"📅 Дата: {local_time.strftime('%d.%m.%Y')}\n"
+        f"🕐 Местное время: {local_time.strftime('%H:%M:%S')}\n"
+        f"📍 Координаты: {lat:.4f}, {lon:.4f}"
+        f"{stale_note(weather)}"
+    )
+
+def render_forecast(forecast, city: str) -> str:
+    """Прогноз по дням (Markdown)"""
+    parts = [f"📅 Прогноз погоды на 5 дней для {forecast.name or city}:\n\n"]
+    for day in forecast.days:
+        parts.append(
+            f"{get_weather_emoji(day.weather_main)} **{DAY_NAMES_RU[day.date.weekday()]} ({day.date.strftime('%d.%m')})**\n"
+            f"   🌡️ {day.min_temp:.0f}°...{day.max_temp:.0f}°C\n"
+            f"   📝 {day.description.capitalize()}\n\n"
+        )
+    parts.append(stale_note(forecast).lstrip())
+    return ''.join(parts)
+
+def render_map(geocode) -> str:
+    """Ссылки на карты погоды для города (Markdown)"""
+    lat = geocode.lat
+    lon = geocode.lon
+    base_url = "https://openweathermap.org/weathermap?basemap=map&cities=true"
+    return (
+        f"🗺️ Карты погоды для {geocode.name}:\n\n"
+        f"🌧️ [Карта осадков]({base_url}&layer=precipitation&lat={lat}&lon={lon}&zoom=10)\n"
+        f"☁️ [Карта облачности]({base_url}&layer=clouds&lat={lat}&lon={lon}&zoom=10)\n"
+        f"🌡️ [Карта температуры]({base_url}&layer=temp&lat={lat}&lon={lon}&zoom=10)\n\n"
+        f"📍 Координаты: {lat:.2f}, {lon:.2f}"
+    )
+
+def render_error(error, forecast: bool = False) -> str:
+    """Текст ошибки для пользователя"""
+    texts = _ERROR_TEXTS.get(error.kind, _UNAVAILABLE_TEXTS)
+    return texts[1] if forecast else texts[0]
@@ -0,0 +1,299 @@
+"""
+Слой получения данных о погоде: кэш и объединение запросов поверх HTTP клиента OpenWeatherMap
+"""
+
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+import config
+from cache import TTLCache, SingleFlight
+from circuit_breaker import CircuitOpenError
+from geo import GeoCellStats, quantize
+from geocoding import GeocodeIndex, normalize_city
+from rate_limit import QuotaExceeded, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from weather_models import (
+    CurrentWeather, Forecast, WeatherError,
+    ERROR_RATE_LIMITED, ERROR_UNAVAILABLE, ERROR_TIMEOUT, ERROR_NETWORK,
+)
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, при которых текущую погоду можно взять из прогноза
+_UPSTREAM_ERRORS = (QuotaExceeded, CircuitOpenError, asyncio.TimeoutError, aiohttp.ClientError)
+
+def error_from_exception(error: Exception) -> WeatherError:
+    """WeatherError для исключения, которым закончился запрос к API"""
+    if isinstance(error, QuotaExceeded):
+        return WeatherError(ERROR_RATE_LIMITED)
+    if isinstance(error, CircuitOpenError):
+        return WeatherError(ERROR_UNAVAILABLE)
+    if isinstance(error, asyncio.TimeoutError):
+        return WeatherError(ERROR_TIMEOUT)
+    return WeatherError(ERROR_NETWORK)
+
+class WeatherService:
+    """Отвечает на запросы погоды из кэша, а при промахе обращается к API.
+
+    Ответы API сразу разбираются в компактные записи (weather_models), и в кэшах
+    лежат уже они. Публичные методы возвращают запись или WeatherError.
+
+    Записи старше мягкого TTL отдаются сразу, а обновление уходит в фон
+    (stale-while-revalidate); ждать API приходится только после жесткого TTL.
+
+    Данные по городу собираются в один набор: прогноз, координаты и, при необходимости,
+    текущая погода. Один запрос прогноза отвечает и на погоду, и на прогноз, и на карту.
+
+    Города в кэшах и в запросах к API определяются по id OpenWeatherMap: все написания
+    одного города ("Москва", "moscow ") попадают в одну запись кэша.
+    """
+
+    def __init__(self, client, units='metric', lang='ru', cache_size=None):
+        self.client = client
+        self.units = units
+        self.lang = lang
+        size = cache_size or config.WEATHER_CACHE_SIZE
+        self.current_cache = TTLCache(
+            ttl=config.WEATHER_CACHE_HARD_TTL, soft_ttl=config.WEATHER_CACHE_TTL, max_size=size,
+        )
+        # кэш по координатам хранит погоду на geohash ячейку, а не на точку
+        self.coords_cache = TTLCache(
+            ttl=config.WEATHER_CACHE_HARD_TTL, soft_ttl=config.WEATHER_CACHE_TTL, max_size=size,
+        )
+        self.geo_precision = config.GEO_CACHE_PRECISION
+        self.geo_stats = GeoCellStats(
+            config.GEO_STATS_PRECISIONS, ttl=config.WEATHER_CACHE_HARD_TTL, max_size=size,
+        )
+        self.forecast_cache = TTLCache(
+            ttl=config.FORECAST_CACHE_HARD_TTL, soft_ttl=config.FORECAST_CACHE_TTL, max_size=size,
+        )
+        # написания городов -> id и координаты из ответов API
+        self.geocodes = GeocodeIndex(normalize_city)
+        # одинаковые запросы, пришедшие одновременно, уходят в API один раз
+        self.flights = SingleFlight()
+        self._refresh_tasks = {}  # ключ запроса -> задача фонового обновления
+        self.stale_served = 0
+        self.refreshes = 0
+        self.current_from_forecast = config.WEATHER_CURRENT_FROM_FORECAST
+        self.slot_max_gap = config.WEATHER_SLOT_MAX_GAP
+        self.derived_current = 0
+
+    def _city_key(self, city: str):
+        """Ключ кэша: id города, если написание уже известно, иначе нормализованное название"""
+        city_id = self.geocodes.resolve(city)
+        return (normalize_city(city) if city_id is None else city_id, self.units, self.lang)
+
+    def _city_query(self, city: str, by_name, by_id, timeout: float):
+        """(ключ кэша, запрос к API) для города: известный город запрашивается по id, новое написание - по q="""
+        key = self._city_key(city)
+        if isinstance(key[0], int):
+            return key, lambda priority: by_id(key[0], self.units, self.lang, timeout, priority)
+        return key, lambda priority: by_name(city, self.units, self.lang, timeout, priority)
+
+    async def _cached(self, cache, key, endpoint, fetch, by_city=False):
+        """(статус, запись) из кэша, иначе один общий запрос к API.
+
+        fetch(priority) выполняет запрос и разбирает ответ. Пока breaker разомкнут,
+        возвращает последнюю удачную запись с пометкой устаревания.
+        При by_city ответ сохраняется под id города из ответа, а не под ключом запроса.
+        """
+        flight_key = (endpoint,) + key
+
+        async def fetch_and_store(priority=PRIORITY_INTERACTIVE):
+            status, record = await fetch(priority)
+            if status == 200:
+                if by_city and record.city_id is not None:
+                    cache.set((record.city_id,) + key[1:], record)
+                else:
+                    cache.set(key, record)
+            return status, record
+
+        entry = cache.lookup(key)
+        if entry is not None:
+            record, needs_refresh = entry
+            if needs_refresh and flight_key not in self._refresh_tasks:
+                self._refresh_in_background(
+                    flight_key, lambda: fetch_and_store(PRIORITY_BACKGROUND)
+                )
+            return 200, record
+
+        try:
+            return await self.flights.do(flight_key, fetch_and_store)
+        except CircuitOpenError:
+            stale = cache.get_stale(key)
+            if stale is None:
+                raise
+            self.stale_served += 1
+            record, age = stale
+            logger.warning(f"♻️ API недоступен, отдаю данные {endpoint} для {key[0]} возрастом {age:.0f} с")
+            return 200, record.with_stale(age)
+
+    def _refresh_in_background(self, flight_key, fetch):
+        """Запускает одно фоновое обновление записи, не дожидаясь его"""
+        self.refreshes += 1
+        task = asyncio.ensure_future(self.flights.do(flight_key, fetch))
+        self._refresh_tasks[flight_key] = task
+        task.add_done_callback(lambda t: self._refresh_done(flight_key, t))
+
+    def _refresh_done(self, flight_key, task):
+        self._refresh_tasks.pop(flight_key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"⚠️ Фоновое обновление {flight_key[0]} не удалось: {task.exception()!r}")
+
+    async def close(self):
+        """Отменяет незавершенные фоновые обновления"""
+        tasks = list(self._refresh_tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _parsed(self, request, parse, city=None):
+        """Оборачивает запрос: удачный ответ разбирается в запись, координаты города попадают в индекс"""
+        async def fetch(priority):
+            status, data = await request(priority)
+            if status != 200:
+                return status, None
+            record = parse(data)
+            if city is not None:
+                self.geocodes.remember(city, record)
+            return status, record
+        return fetch
+
+    async def _result(self, request):
+        """Запись при удачном ответе, иначе WeatherError"""
+        try:
+            status, record = await request
+        except _UPSTREAM_ERRORS as e:
+            return error_from_exception(e)
+        if status != 200 or record is None:
+            return WeatherError.from_status(status)
+        return record
+
+    async def current(self, city: str, timeout: float = 10):
+        """Текущая погода по городу: CurrentWeather или WeatherError.
+
+        Если включен WEATHER_CURRENT_FROM_FORECAST, берется из ближайшего слота прогноза,
+        а /weather запрашивается, только когда подходящего слота нет. Если /weather
+        недоступен из-за лимитов или ошибок, тоже отвечаем слотом прогноза из кэша.
+        """
+        return await self._result(self._fetch_current(city, timeout))
+
+    def has_current(self, city: str) -> bool:
+        """Есть ли в кэше текущая погода для города, то есть ответ не потребует запроса к API"""
+        key = self._city_key(city)
+        if self.current_from_forecast:
+            stale = self.forecast_cache.get_stale(key)
+            if (stale is not None and stale[1] <= self.forecast_cache.ttl
+                    and stale[0].nearest_slot(time.time(), self.slot_max_gap) is not None):
+                return True
+        stale = self.current_cache.get_stale(key)
+        return stale is not None and stale[1] <= self.current_cache.ttl
+
+    async def _fetch_current(self, city: str, timeout: float):
+        if self.current_from_forecast:
+            try:
+                status, forecast = await self._fetch_forecast(city)
+            except _UPSTREAM_ERRORS as e:
+                logger.debug(f"Прогноз для {city} недоступен ({e!r}), запрашиваю текущую погоду")
+            else:
+                if status == 404:
+                    return status, None
+                if status == 200:
+                    derived = self._derive_current(forecast)
+                    if derived is not None:
+                        return 200, derived
+
+        key, request = self._city_query(city, self.client.current, self.client.current_by_id, timeout)
+        try:
+            status, record = await self._cached(
+                self.current_cache, key, 'weather',
+                self._parsed(request, CurrentWeather.from_api, city), by_city=True,
+            )
+        except _UPSTREAM_ERRORS:
+            fallback = self._current_from_cached_forecast(city)
+            if fallback is None:
+                raise
+            return 200, fallback
+
+        if status == 429 or status >= 500:
+            fallback = self._current_from_cached_forecast(city)
+            if fallback is not None:
+                return 200, fallback
+        return status, record
+
+    def _derive_current(self, forecast: Forecast):
+        slot = forecast.nearest_slot(time.time(), self.slot_max_gap)
+        if slot is None:
+            return None
+        self.derived_current += 1
+        return CurrentWeather.from_forecast_slot(forecast, slot)
+
+    def _current_from_cached_forecast(self, city: str):
+        """Текущая погода из уже загруженного прогноза, без запросов к API"""
+        stale = self.forecast_cache.get_stale(self._city_key(city))
+        if stale is None:
+            return None
+        logger.info(f"📅 Текущая погода для {city} взята из прогноза: API /weather недоступен")
+        return self._derive_current(stale[0])
+
+    async def current_by_coordinates(self, lat: float, lon: float, timeout: float = 10):
+        """Текущая погода по координатам: CurrentWeather или WeatherError.
+
+        Точка привязывается к geohash ячейке, и API запрашивается для центра ячейки,
+        поэтому соседи в пределах одной ячейки получают один и тот же ответ.
+        """
+        self.geo_stats.record(lat, lon)
+        cell, cell_lat, cell_lon = quantize(lat, lon, self.geo_precision)
+        return await self._result(self._cached(
+            self.coords_cache, (cell, self.units, self.lang), 'weather_coords',
+            self._parsed(
+                lambda priority: self.client.current_by_coordinates(
+                    cell_lat, cell_lon, self.units, self.lang, timeout, priority
+                ),
+                CurrentWeather.from_api,
+            ),
+        ))
+
+    async def forecast(self, city: str, timeout: float = 15):
+        """Прогноз на 5 дней: Forecast или WeatherError"""
+        return await self._result(self._fetch_forecast(city, timeout))
+
+    async def _fetch_forecast(self, city: str, timeout: float = 15):
+        key, request = self._city_query(city, self.client.forecast, self.client.forecast_by_id, timeout)
+        return await self._cached(
+            self.forecast_cache, key, 'forecast',
+            self._parsed(request, Forecast.from_api, city), by_city=True,
+        )
+
+    async def geocode(self, city: str, timeout: float = 10):
+        """Координаты города: Geocode или WeatherError.
+
+        Берутся из индекса; к API обращаемся, только если город еще ни разу не запрашивали.
+        """
+        geocode = self.geocodes.get(city)
+        if geocode is not None:
+            return geocode
+
+        result = await self.current(city, timeout)
+        if isinstance(result, WeatherError):
+            return result
+        return self.geocodes.get(city) or WeatherError.from_status(404)
+
+    def stats(self):
+        """Статистика кэшей для health endpoint"""
+        return {
+            'current_cache': self.current_cache.stats(),
+            'coords_cache': dict(self.coords_cache.stats(), precision=self.geo_precision),
+            'geo_precision_hit_ratios': self.geo_stats.stats(),
+            'geocodes': self.geocodes.stats(),
+            'forecast_cache': self.forecast_cache.stats(),
+            'background_refreshes': self.refreshes,
+            'coalescing': self.flights.stats(),
+            'quota': self.client.governor.stats(),
+            'breaker': self.client.breaker.stats(),
+            'stale_served': self.stale_served,
+            'current_from_forecast': self.derived_current,
+        }
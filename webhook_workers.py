@@ -0,0 +1,469 @@
+"""
+Webhook в нескольких процессах: родительский процесс принимает обновления на PORT
+и пересылает каждое процессу-обработчику с номером hash(чат) % WEBHOOK_PROCESSES.
+
+Все обновления одного чата попадают в один процесс, и его полосы UpdateQueue
+сохраняют порядок внутри чата, как в одном процессе: "/setcity" и название города
+не обгоняют друг друга. Разбор обновлений, обработчики и сборка ответов идут
+в процессах-обработчиках, каждый на своем ядре; родительский процесс только читает
+чат из JSON и передает запрос и ответ через unix-сокет обработчика.
+
+Родительский процесс также запускает обработчики, перезапускает упавшие и плавно
+заменяет те, что обслужили WEBHOOK_WORKER_MAX_REQUESTS запросов: сначала поднимается
+замена; когда она готова, старый процесс дообрабатывает свою очередь, а обновления
+его чатов ждут и уходят замене только после его выхода, чтобы не обогнать очередь.
+Пока обработчик перезапускается, обновления его чатов ждут до ROUTE_TIMEOUT,
+затем webhook отвечает 503, и Telegram повторит доставку.
+
+Общее состояние:
+- пользователи и города - в STORAGE_BACKEND (sqlite в режиме WAL или kv), memory не подходит;
+- состояния диалогов - в FSM_STORAGE=kv, иначе они теряются при замене и перезапуске процесса;
+- лимиты OpenWeatherMap и Telegram делятся между процессами поровну;
+- кэши погоды у каждого процесса свои;
+- кэш городов пользователей (async_db.profiles) выключен: один пользователь пишет
+  из разных чатов, а запись из другого процесса не сбросила бы кэш.
+Лимит сообщений в один чат соблюдает процесс этого чата; рассылки идут из процесса 0,
+и если они совпадут с ответом в тот же чат, планировщик отправок дождется 429 и повторит.
+
+Метрики всех процессов отдает GET /workers родительского процесса, остальные
+запросы (health и т.п.) обслуживает процесс 0.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import shutil
+import signal
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+import config
+from metrics import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+METRICS_INTERVAL = 1  # секунд между записями метрик процесса
+CHECK_INTERVAL = 0.2  # секунд между проверками процессов в родительском
+RESTART_BACKOFF_MAX = 30  # секунд паузы перед перезапуском процесса, который падает сразу после старта
+FAST_FAILURE = 10  # процесс, проживший меньше стольких секунд, считается упавшим при запуске
+STOP_GRACE = 5  # секунд сверх WEBHOOK_DRAIN_TIMEOUT до принудительной остановки
+ROUTE_TIMEOUT = 30  # секунд ожидания готового обработчика чата, затем 503
+FORWARD_TIMEOUT = 60  # секунд на ответ обработчика на пересланный запрос
+FORWARD_HEADERS = ('Content-Type', 'X-Telegram-Bot-Api-Secret-Token')
+
+def worker_environ(processes: int) -> dict:
+    """Переменные окружения процессов-обработчиков: общие лимиты делятся поровну"""
+    def share(value):
+        return str(max(1, value // processes))
+    return {
+        'OWM_CALLS_PER_MINUTE': share(config.OWM_CALLS_PER_MINUTE),
+        'OWM_MAX_IN_FLIGHT': share(config.OWM_MAX_IN_FLIGHT),
+        'TELEGRAM_GLOBAL_RATE': share(config.TELEGRAM_GLOBAL_RATE),
+        'TELEGRAM_MAX_IN_FLIGHT': share(config.TELEGRAM_MAX_IN_FLIGHT),
+    }
+
+def chat_key(data):
+    """Чат обновления по JSON из webhook, как update_queue.lane_key, но без разбора aiogram"""
+    for name, event in data.items():
+        if name == 'update_id' or not isinstance(event, dict):
+            continue
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = event.get('from')
+        if user:
+            return user['id']
+        break
+    return data.get('update_id', 0)
+
+def _write_json(path, data):
+    # через временный файл: читатель не увидит наполовину записанный файл
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _worker_path(directory, pid):
+    return os.path.join(directory, f'worker-{pid}.json')
+
+def _socket_path(directory, pid):
+    return os.path.join(directory, f'worker-{pid}.sock')
+
+def read_metrics(directory):
+    """Метрики родительского процесса и всех процессов-обработчиков из каталога метрик"""
+    workers, supervisor = [], None
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue  # процесс как раз завершился
+        if name == 'supervisor.json':
+            supervisor = data
+        else:
+            workers.append(data)
+    workers.sort(key=lambda w: (w['index'], w['pid']))
+    return {'supervisor': supervisor, 'workers': workers}
+
+class WorkerStats:
+    """Метрики одного процесса-обработчика"""
+
+    def __init__(self, index, update_queue, send_scheduler, max_requests=0):
+        self.index = index
+        self.pid = os.getpid()
+        self.started = time.time()
+        self.update_queue = update_queue
+        self.send_scheduler = send_scheduler
+        self.max_requests = max_requests
+        self.state = 'starting'
+        self.requests = 0
+        self.latency = LatencyWindow()  # время ответа на webhook
+
+    def snapshot(self):
+        updates = self.update_queue.stats()
+        outbound = self.send_scheduler.stats()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return {
+            'index': self.index,
+            'pid': self.pid,
+            'state': self.state,
+            'uptime_s': round(time.time() - self.started),
+            'requests': self.requests,
+            'max_requests': self.max_requests,
+            'latency': self.latency.stats(),
+            'cpu_s': round(usage.ru_utime + usage.ru_stime, 2),
+            'max_rss_mb': round(usage.ru_maxrss / 1024, 1),
+            'updates': {k: updates[k] for k in (
+                'pending', 'running', 'accepted', 'rejected', 'processed', 'failed',
+                'webhook_replies', 'late_replies',
+            )},
+            'outbound': {k: outbound[k] for k in ('sent', 'queued', 'retry_after', 'webhook_replies')},
+            'updated_at': round(time.time(), 3),
+        }
+
+async def serve_worker(index, parent_pid, metrics_dir, events):
+    """Процесс-обработчик: свой сервер на unix-сокете до сигнала остановки"""
+    import async_db
+    import main
+
+    max_requests = config.WEBHOOK_WORKER_MAX_REQUESTS
+    if max_requests > 0:
+        max_requests += random.randint(0, config.WEBHOOK_WORKER_MAX_REQUESTS_JITTER)
+    stats = WorkerStats(index, main.update_queue, main.send_scheduler, max_requests)
+    metrics_path = _worker_path(metrics_dir, stats.pid)
+
+    @web.middleware
+    async def count_requests(request, handler):
+        if request.path != config.WEBHOOK_PATH:
+            return await handler(request)
+        started = time.monotonic()
+        try:
+            return await handler(request)
+        finally:
+            stats.requests += 1
+            stats.latency.add(time.monotonic() - started)
+
+    async def workers_handler(request):
+        return web.json_response(dict(read_metrics(metrics_dir), served_by=stats.pid))
+
+    async_db.storage.init()
+    app = await main.create_app()
+    app.middlewares.append(count_requests)
+    app.router.add_get('/workers', workers_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.UnixSite(runner, _socket_path(metrics_dir, stats.pid)).start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    stats.state = 'serving'
+    events.put(('ready', index, stats.pid))
+    logger.info(f"👷 Обработчик {index} (PID {stats.pid}) готов")
+
+    try:
+        while not stop.is_set():
+            _write_json(metrics_path, stats.snapshot())
+            if os.getppid() != parent_pid:
+                logger.warning(f"⚠️ Обработчик {index}: родительский процесс завершился, останавливаюсь")
+                break
+            if stats.state == 'serving' and max_requests and stats.requests >= max_requests:
+                # замену запускает родительский процесс, а нас остановит, когда она будет готова
+                stats.state = 'recycling'
+                events.put(('recycle', index, stats.pid))
+                logger.info(f"♻️ Обработчик {index} (PID {stats.pid}) обслужил {stats.requests} запросов, жду замену")
+            try:
+                await asyncio.wait_for(stop.wait(), METRICS_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        stats.state = 'stopping'
+        _write_json(metrics_path, stats.snapshot())
+        # сначала закрывается сокет, затем очередь дообрабатывается (stop_update_queue)
+        await runner.cleanup()
+        if os.path.exists(metrics_path):
+            os.remove(metrics_path)
+        logger.info(f"👋 Обработчик {index} (PID {stats.pid}) остановлен, обслужено запросов: {stats.requests}")
+
+def run_worker(index, parent_pid, metrics_dir, events):
+    """Точка входа процесса-обработчика"""
+    asyncio.run(serve_worker(index, parent_pid, metrics_dir, events))
+
+class Supervisor:
+    """Пересылает обновления обработчикам по чатам, запускает их, перезапускает упавшие
+    и плавно заменяет отслужившие"""
+
+    def __init__(self, processes: int, metrics_dir: str):
+        self.processes = processes
+        self.metrics_dir = metrics_dir
+        self._context = multiprocessing.get_context('spawn')
+        self.events = self._context.Queue()
+        self.current = {}  # номер -> процесс, который обслуживает запросы
+        self.replacements = {}  # номер -> запущенная, но еще не готовая замена
+        self.retiring = []  # процессы, которые дообрабатывают очередь перед выходом
+        self.restart_at = {}  # номер -> когда перезапустить упавший процесс
+        self.failures = {}  # номер -> падений подряд сразу после старта
+        self._started = {}  # PID -> время запуска
+        self._retire_by = {}  # PID уходящего процесса -> когда остановить его принудительно
+        self._handover = {}  # PID уходящего процесса -> номер, который ждет его выхода
+        self._ready = set()  # PID процессов, которые слушают свой сокет
+        self._sessions = {}  # PID -> сессия для пересылки в сокет процесса
+        self.routes = {}  # номер -> PID готового процесса, которому пересылаются его чаты
+        self._routable = [asyncio.Event() for _ in range(processes)]
+        self.restarts = 0
+        self.recycled = 0
+        self.forwarded = 0
+        self.unavailable = 0
+
+    def _start(self, index):
+        os.environ['WEBHOOK_WORKER_INDEX'] = str(index)
+        process = self._context.Process(
+            target=run_worker, args=(index, os.getpid(), self.metrics_dir, self.events),
+            name=f'webhook-worker-{index}', daemon=True,
+        )
+        process.start()
+        self._started[process.pid] = time.monotonic()
+        return process
+
+    async def _forget(self, process):
+        self._started.pop(process.pid, None)
+        self._retire_by.pop(process.pid, None)
+        self._ready.discard(process.pid)
+        session = self._sessions.pop(process.pid, None)
+        if session is not None:
+            await session.close()
+        for path in (_worker_path(self.metrics_dir, process.pid), _socket_path(self.metrics_dir, process.pid)):
+            if os.path.exists(path):
+                os.remove(path)
+        process.join()
+
+    def _open_route(self, index, pid):
+        if pid not in self._sessions:
+            self._sessions[pid] = aiohttp.ClientSession(
+                connector=aiohttp.UnixConnector(_socket_path(self.metrics_dir, pid), limit=0),
+                timeout=aiohttp.ClientTimeout(total=FORWARD_TIMEOUT),
+            )
+        self.routes[index] = pid
+        self._routable[index].set()
+
+    def _close_route(self, index):
+        # новые обновления чатов этого номера ждут, пересланные дорабатывают
+        self.routes.pop(index, None)
+        self._routable[index].clear()
+
+    async def forward(self, request: web.Request) -> web.Response:
+        """Пересылает запрос обработчику: webhook - по чату обновления, остальное - процессу 0"""
+        body = await request.read()
+        index = 0
+        if request.path == config.WEBHOOK_PATH:
+            try:
+                index = hash(chat_key(json.loads(body))) % self.processes
+            except (ValueError, AttributeError, TypeError, KeyError) as e:
+                logger.warning(f"⚠️ Некорректное обновление в webhook: {e}")
+                return web.Response(status=400)
+        try:
+            await asyncio.wait_for(self._routable[index].wait(), ROUTE_TIMEOUT)
+            session = self._sessions[self.routes[index]]
+            headers = {name: request.headers[name] for name in FORWARD_HEADERS if name in request.headers}
+            async with session.request(request.method, f'http://worker{request.path_qs}',
+                                       data=body, headers=headers) as resp:
+                reply = await resp.read()
+                headers = {name: resp.headers[name] for name in ('Content-Type', 'Retry-After') if name in resp.headers}
+                self.forwarded += 1
+                return web.Response(status=resp.status, body=reply, headers=headers)
+        except (asyncio.TimeoutError, aiohttp.ClientError, KeyError) as e:
+            # обработчик перезапускается или упал посреди запроса: Telegram повторит доставку
+            self.unavailable += 1
+            logger.warning(f"⚠️ Обработчик {index} недоступен ({type(e).__name__}), отвечаю 503")
+            return web.Response(status=503, headers={"Retry-After": "1"})
+
+    async def workers_handler(self, request):
+        return web.json_response(dict(read_metrics(self.metrics_dir), supervisor=self._state(), served_by=os.getpid()))
+
+    def _state(self):
+        return {
+            'pid': os.getpid(),
+            'processes': self.processes,
+            'restarts': self.restarts,
+            'recycled': self.recycled,
+            'forwarded': self.forwarded,
+            'unavailable': self.unavailable,
+            'routes': {str(index): pid for index, pid in sorted(self.routes.items())},
+        }
+
+    def _write_state(self):
+        _write_json(os.path.join(self.metrics_dir, 'supervisor.json'), self._state())
+
+    def _handle_events(self):
+        while True:
+            try:
+                event, index, pid = self.events.get_nowait()
+            except queue.Empty:
+                return
+            if event == 'ready':
+                self._ready.add(pid)
+            current = self.current.get(index)
+            if event == 'recycle' and current is not None and current.pid == pid and index not in self.replacements:
+                self.replacements[index] = self._start(index)
+            elif event == 'ready' and index in self.replacements and self.replacements[index].pid == pid:
+                old = self.current[index]
+                self.current[index] = self.replacements.pop(index)
+                # замена получит чаты, когда старый процесс дообработает их очередь и выйдет
+                self._close_route(index)
+                self._handover[old.pid] = index
+                self._retire(old)
+                self.recycled += 1
+                self._write_state()
+                logger.info(f"♻️ Обработчик {index} заменяется: PID {old.pid} -> {pid}")
+            elif event == 'ready' and current is not None and current.pid == pid and index not in self._handover.values():
+                self._open_route(index, pid)
+                self._write_state()
+
+    def _retire(self, process):
+        process.terminate()  # SIGTERM: закрыть сокет и дообработать очередь
+        self.retiring.append(process)
+        self._retire_by[process.pid] = time.monotonic() + config.WEBHOOK_DRAIN_TIMEOUT + STOP_GRACE
+
+    async def _reap(self):
+        now = time.monotonic()
+        for index, process in list(self.current.items()):
+            if process.is_alive():
+                continue
+            lifetime = now - self._started.get(process.pid, now)
+            self._close_route(index)
+            await self._forget(process)
+            replacement = self.replacements.pop(index, None)
+            if replacement is not None:
+                # замена уже запускается: она и займет место, маршрут откроется, когда она будет готова
+                self.current[index] = replacement
+                continue
+            del self.current[index]
+            self.failures[index] = self.failures.get(index, 0) + 1 if lifetime < FAST_FAILURE else 0
+            delay = min(RESTART_BACKOFF_MAX, 2 ** self.failures[index] - 1)
+            self.restart_at[index] = now + delay
+            logger.error(f"💥 Обработчик {index} (PID {process.pid}) завершился с кодом {process.exitcode}, "
+                         f"перезапуск через {delay} с")
+
+        for index, process in list(self.replacements.items()):
+            if not process.is_alive():
+                # старый процесс продолжает работать
+                await self._forget(process)
+                del self.replacements[index]
+                logger.error(f"💥 Замена обработчика {index} не запустилась (код {process.exitcode})")
+
+        for process in list(self.retiring):
+            if process.is_alive() and now > self._retire_by.get(process.pid, now):
+                logger.warning(f"⚠️ Обработчик PID {process.pid} не дообработал очередь вовремя, завершаю принудительно")
+                process.kill()
+                process.join()
+            if process.is_alive():
+                continue
+            index = self._handover.pop(process.pid, None)
+            await self._forget(process)
+            self.retiring.remove(process)
+            current = self.current.get(index)
+            if current is not None and current.pid in self._ready:
+                self._open_route(index, current.pid)
+                self._write_state()
+
+        for index, when in list(self.restart_at.items()):
+            if when <= now:
+                del self.restart_at[index]
+                self.current[index] = self._start(index)
+                self.restarts += 1
+                self._write_state()
+
+    async def run(self):
+        """Работает до SIGTERM/SIGINT, затем останавливает все процессы"""
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        app = web.Application()
+        app.router.add_get('/workers', self.workers_handler)
+        app.router.add_route('*', '/{tail:.*}', self.forward)
+        runner = web.AppRunner(app)
+        try:
+            self._write_state()
+            for index in range(self.processes):
+                self.current[index] = self._start(index)
+            await runner.setup()
+            await web.TCPSite(runner, "0.0.0.0", config.PORT).start()
+            logger.info(f"🚀 Запущено обработчиков webhook: {self.processes}, порт {config.PORT}")
+            while not stop.is_set():
+                self._handle_events()
+                await self._reap()
+                try:
+                    await asyncio.wait_for(stop.wait(), CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(sig)
+            # сначала порт закрывается и пересланные запросы получают ответы, затем останавливаются обработчики
+            await runner.cleanup()
+            await self.stop()
+
+    async def stop(self):
+        """Останавливает все процессы: SIGTERM, затем принудительно после WEBHOOK_DRAIN_TIMEOUT + STOP_GRACE"""
+        processes = list(self.current.values()) + list(self.replacements.values()) + self.retiring
+        logger.info(f"🛑 Останавливаю обработчиков webhook: {len(processes)}")
+        for index in list(self.routes):
+            self._close_route(index)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + config.WEBHOOK_DRAIN_TIMEOUT + STOP_GRACE
+        while any(p.is_alive() for p in processes) and time.monotonic() < deadline:
+            await asyncio.sleep(CHECK_INTERVAL)
+        for process in processes:
+            if process.is_alive():
+                logger.warning(f"⚠️ Обработчик PID {process.pid} не остановился вовремя, завершаю принудительно")
+                process.kill()
+            await self._forget(process)
+        self.current, self.replacements, self.retiring = {}, {}, []
+
+async def supervise(processes: int):
+    """Запускает processes процессов-обработчиков webhook и пересылает им обновления до сигнала остановки"""
+    if config.STORAGE_BACKEND == 'memory':
+        raise ValueError("❌ STORAGE_BACKEND=memory не подходит для нескольких процессов: у каждого была бы своя база")
+    if config.FSM_STORAGE == 'memory':
+        raise ValueError("❌ FSM_STORAGE=memory не подходит для нескольких процессов: "
+                         "состояния диалогов терялись бы при замене и перезапуске процесса, нужен FSM_STORAGE=kv")
+    os.environ.update(worker_environ(processes))
+    metrics_dir = tempfile.mkdtemp(prefix='weather_bot_workers_')
+    try:
+        await Supervisor(processes, metrics_dir).run()
+    finally:
+        shutil.rmtree(metrics_dir, ignore_errors=True)